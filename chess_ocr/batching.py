@@ -0,0 +1,168 @@
+"""
+Cross-request micro-batching of cell recognition
+MicroBatcher wraps a recognizer shared by concurrent requests. Cells submitted
+through recognize_regions / recognize_sources / recognize_batch are queued, and
+scheduler threads collect the submissions of all in-flight requests for up to
+max_wait seconds (or until max_cells cells are waiting), run them through the
+wrapped recognizer in one recognize_sources call and hand each request its own
+results back. CTC beam decoding stays on the calling request's thread.
+Inside direct() a thread bypasses the batching and runs its cells itself, e.g.
+a profiled request whose recognition must show up in its own thread's profile.
+"""
+
+import contextlib
+import queue
+import threading
+import time
+
+
+class Submission:
+    """Cells of one recognize call waiting for a batch."""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.submitted = time.perf_counter()
+        self.started = None
+        # time its batch waited for a predictor of the wrapped recognizer's pool
+        self.pool_wait = 0.0
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Recognizer wrapper that batches cells across requests (same interface as the wrapped one).
+
+    workers scheduler threads run batches at the same time, match it to the
+    recognizer's predictor pool. on_batch(cells, submissions) is called after
+    every batch (e.g. to record metrics). A request gives up with TimeoutError
+    when its cells were not recognized within timeout seconds.
+    """
+
+    def __init__(self, recognizer, max_wait=0.005, max_cells=64, workers=1, on_batch=None, timeout=60.0):
+        self.recognizer = recognizer
+        self.chars = recognizer.chars
+        self.char_index = recognizer.char_index
+        self.max_wait = max_wait
+        self.max_cells = max_cells
+        self.on_batch = on_batch
+        self.timeout = timeout
+        self.submissions = queue.Queue()
+        # per-thread {'queue_wait', 'batches'} of the calling requests, see take_stats
+        self.local = threading.local()
+        self.threads = [threading.Thread(target=self.schedule, name=f'micro-batcher-{i}', daemon=True)
+                        for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    # anything not batched (recognize, beam_search_decode, ...) goes straight to the recognizer
+    def __getattr__(self, name):
+        return getattr(self.recognizer, name)
+
+    # batches this thread waited for, plus its own predictor runs inside direct()
+    def take_stats(self):
+        stats = getattr(self.local, 'stats', None) or {'queue_wait': 0.0, 'batches': 0}
+        self.local.stats = {'queue_wait': 0.0, 'batches': 0}
+        direct = self.recognizer.take_stats()
+        return {k: stats[k] + direct[k] for k in stats}
+    
+    @contextlib.contextmanager
+    def direct(self):
+        """Recognize this thread's cells on this thread, without batching."""
+        previous = getattr(self.local, 'direct', False)
+        self.local.direct = True
+        try:
+            yield self
+        finally:
+            self.local.direct = previous
+
+    def close(self):
+        for _ in self.threads:
+            self.submissions.put(None)
+        for t in self.threads:
+            t.join()
+
+    def schedule(self):
+        while True:
+            first = self.submissions.get()
+            if first is None:
+                return
+            batch = [first]
+            cells = len(first.sources)
+            started = None
+            try:
+                # the first submission waits at most max_wait for others to join it, submissions
+                # that queued up while the previous batch ran are always taken
+                deadline = first.submitted + self.max_wait
+                while cells < self.max_cells:
+                    timeout = deadline - time.perf_counter()
+                    try:
+                        item = self.submissions.get(timeout=timeout) if timeout > 0 else self.submissions.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # closing, let this thread finish the batch and the next one see the stop
+                        self.submissions.put(None)
+                        break
+                    batch.append(item)
+                    cells += len(item.sources)
+                started = time.perf_counter()
+                self.run_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            finally:
+                # every collected request is released whatever failed, this thread keeps serving
+                for item in batch:
+                    item.started = started if started is not None else time.perf_counter()
+                    item.done.set()
+            if self.on_batch is not None and batch[0].error is None:
+                try:
+                    self.on_batch(cells, len(batch))
+                except Exception as e:
+                    print(f"  [MicroBatcher] on_batch failed: {e}")
+
+    # recognize the cells of a batch and fill in each submission's results, raises on failure
+    def run_batch(self, batch):
+        # drop predictor waits left over from a failed batch
+        self.recognizer.take_stats()
+        sources = [source for item in batch for source in item.sources]
+        results = self.recognizer.recognize_sources(sources, decode=False)
+        if len(results) != len(sources):
+            raise RuntimeError(f"recognizer returned {len(results)} results for {len(sources)} cells")
+        # the predictor wait is recorded on this thread, every request of the batch sat through it
+        pool_wait = self.recognizer.take_stats()['queue_wait']
+        start = 0
+        for item in batch:
+            item.results = results[start:start + len(item.sources)]
+            item.pool_wait = pool_wait
+            start += len(item.sources)
+
+    def recognize_sources(self, sources, beam_width=20, top_k=5, decode=True):
+        """Same as the wrapped recognizer's recognize_sources, batched with other requests."""
+        if not sources:
+            return []
+        if getattr(self.local, 'direct', False):
+            return self.recognizer.recognize_sources(sources, beam_width=beam_width, top_k=top_k, decode=decode)
+        item = Submission(list(sources))
+        self.submissions.put(item)
+        if not item.done.wait(self.timeout):
+            raise TimeoutError(f"cells not recognized within {self.timeout:g}s")
+        stats = getattr(self.local, 'stats', None)
+        if stats is None:
+            stats = self.local.stats = {'queue_wait': 0.0, 'batches': 0}
+        stats['queue_wait'] += item.started - item.submitted + item.pool_wait
+        stats['batches'] += 1
+        if item.error is not None:
+            raise item.error
+        if not decode:
+            return item.results
+        return [(probs, self.recognizer.beam_search_decode(probs, beam_width=beam_width, top_k=top_k))
+                if probs is not None else (probs, candidates) for probs, candidates in item.results]
+
+    def recognize_regions(self, img, regions, beam_width=20, top_k=5, decode=True):
+        return self.recognize_sources([(img, r) for r in regions], beam_width=beam_width, top_k=top_k, decode=decode)
+
+    def recognize_batch(self, crops, beam_width=20, top_k=5, decode=True):
+        sources = [(crop, (0, 0, crop.shape[1], crop.shape[0])) if crop is not None else None for crop in crops]
+        return self.recognize_sources(sources, beam_width=beam_width, top_k=top_k, decode=decode)
@@ -0,0 +1,143 @@
+"""
+Benchmark: Hungarian move association vs the greedy heuristic (step 5)
+
+Runs both association methods on the same step 5 inputs and scores every
+white/black slot against the expected box. Fixtures are JSON files written by
+
+    pipeline.process(img_path, record_dir='fixtures/association')
+
+with "truth" holding the rows the pipeline produced; correct the boxes that are
+wrong (or set them to null for an empty cell) to turn a recording into ground truth.
+Without fixtures, synthetic sheets with jittered, missing and stray boxes are used.
+
+Usage:
+    python benchmarks/bench_association.py --fixtures fixtures/association
+    python benchmarks/bench_association.py --synthetic 200
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from box_table import make_boxes, make_numbers
+from scoresheet_pipeline import ScoresheetPipeline
+
+METHODS = ('heuristic', 'hungarian')
+
+
+def load_fixture(path):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    numbers = make_numbers([(n['number'], n['x'], n['y'], n['source']) for n in data['numbers']])
+    mb = data['move_boxes']
+    boxes = make_boxes([b['x1'] for b in mb], [b['y1'] for b in mb], [b['x2'] for b in mb], [b['y2'] for b in mb],
+                       conf=[b.get('conf', 1.0) for b in mb])
+    truth = {int(num): t for num, t in data['truth'].items()}
+    return numbers, boxes, truth
+
+
+# a regular 2-block sheet, rows drift and jitter, some cells missing, a few stray boxes
+def synthetic_sheet(rng, rows_per_col=30, row_h=40):
+    records, x1, y1, x2, y2, conf = [], [], [], [], [], []
+    truth = {}
+    drift = rng.normal(0, 0.004)
+    for col in range(2):
+        num_x = 80 + col * 560
+        for r in range(rows_per_col):
+            num = col * rows_per_col + r + 1
+            y = 200 + r * row_h
+            records.append((num, num_x, y + rng.normal(0, 2), 'synthetic'))
+            truth[num] = {}
+            for ctype, cx in (('white', num_x + 140), ('black', num_x + 360)):
+                cy = y + cx * drift + rng.normal(0, row_h * 0.12)
+                h = row_h * rng.uniform(0.7, 0.95)
+                if rng.random() < 0.12:
+                    truth[num][ctype] = None
+                    continue
+                box = [int(cx - 90), int(cy - h / 2), int(cx + 90), int(cy + h / 2)]
+                truth[num][ctype] = box
+                x1.append(box[0]); y1.append(box[1]); x2.append(box[2]); y2.append(box[3])
+                conf.append(rng.uniform(0.5, 0.95))
+    # stray boxes (half-detected cells, scribbles) near real rows, low confidence
+    for _ in range(rng.integers(0, 4)):
+        cx = rng.choice([220, 440, 780, 1000]) + rng.normal(0, 10)
+        cy = 200 + rng.uniform(0, rows_per_col) * row_h
+        x1.append(int(cx - 90)); y1.append(int(cy - 12)); x2.append(int(cx + 90)); y2.append(int(cy + 12))
+        conf.append(rng.uniform(0.25, 0.4))
+    return make_numbers(records), make_boxes(x1, y1, x2, y2, conf=conf), truth
+
+
+def score(rows, truth):
+    correct = total = 0
+    used = {}
+    for num, expected in truth.items():
+        row = rows.get(num, {})
+        for ctype in ('white', 'black'):
+            if ctype not in expected:
+                continue
+            box = row.get(f'{ctype}_box')
+            real = box is not None and box.get('source') != 'virtual_fill'
+            got = [box['x1'], box['y1'], box['x2'], box['y2']] if real else None
+            if got is not None:
+                used[tuple(got)] = used.get(tuple(got), 0) + 1
+            total += 1
+            correct += got == expected[ctype]
+    duplicates = sum(c - 1 for c in used.values() if c > 1)
+    return correct, total, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='directory of recorded association fixtures (.json)')
+    parser.add_argument('--synthetic', type=int, default=100, help='number of synthetic sheets if no fixtures')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        sheets = [load_fixture(p) for p in sorted(glob.glob(os.path.join(args.fixtures, '*.json')))]
+        source = args.fixtures
+    else:
+        rng = np.random.default_rng(args.seed)
+        sheets = [synthetic_sheet(rng) for _ in range(args.synthetic)]
+        source = 'synthetic'
+    if not sheets:
+        sys.exit(f"no fixtures found in {source}")
+    print(f"{len(sheets)} sheets ({source})")
+
+    # step 5 uses no models, skip loading them
+    pipeline = ScoresheetPipeline.__new__(ScoresheetPipeline)
+
+    for method in METHODS:
+        # the first call pays one-off costs (the lazy scipy import for hungarian), report it apart
+        numbers, boxes, _ = sheets[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            pipeline.step5_associate_moves(numbers, boxes, method=method)
+            first_call = time.perf_counter() - t0
+
+        correct = total = duplicates = 0
+        elapsed = 0.0
+        for numbers, boxes, truth in sheets:
+            with contextlib.redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                rows = pipeline.step5_associate_moves(numbers, boxes, method=method)
+                elapsed += time.perf_counter() - t0
+            c, t, d = score(rows, truth)
+            correct += c
+            total += t
+            duplicates += d
+        print(f"  {method:10s}: {correct / total * 100:6.2f}% slots correct, "
+              f"{duplicates} boxes used twice, {elapsed / len(sheets) * 1000:.2f} ms/sheet "
+              f"(first call {first_call * 1000:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
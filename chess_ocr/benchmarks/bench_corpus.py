@@ -0,0 +1,221 @@
+"""
+Benchmark: the full pipeline over a corpus of scoresheets with golden PGNs
+
+Runs ScoresheetPipeline.process on every image in a directory that has a PGN
+with the same name next to it (sheet_01.jpg + sheet_01.pgn), and reports
+per-stage latency percentiles, peak RSS, step 6 cells per second, move-level
+accuracy against the PGN mainline and the legality rate of the read games.
+
+Results are written as JSON. With --baseline, the run is compared against a
+stored results file and the exit code is 1 if latency or accuracy regressed:
+
+    python benchmarks/bench_corpus.py --corpus corpus/ --out results/base.json
+    python benchmarks/bench_corpus.py --corpus corpus/ --out results/new.json --baseline results/base.json
+
+synth_scoresheet.py generates such a corpus from PGN games.
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+import chess.pgn
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from san_index import normalize_san, san_index
+from scoresheet_pipeline import ScoresheetPipeline
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+STAGES = ('step1_yolo', 'step2_deskew', 'template_match', 'step3_numbers', 'step4_extrap',
+          'step5_assoc', 'step6_ocr', 'total')
+PERCENTILES = (50, 90, 99)
+
+
+def load_corpus(corpus_dir):
+    """[(image path, golden SAN list)] for every image with a matching .pgn."""
+    sheets = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*'))):
+        stem, ext = os.path.splitext(path)
+        if ext.lower() not in IMAGE_EXTS or not os.path.exists(stem + '.pgn'):
+            continue
+        with open(stem + '.pgn') as f:
+            game = chess.pgn.read_game(f)
+        board = game.board()
+        sans = []
+        for move in game.mainline_moves():
+            sans.append(board.san(move))
+            board.push(move)
+        sheets.append((path, sans))
+    return sheets
+
+
+# texts in ply order, white then black for each move number
+def read_plies(rows):
+    plies = []
+    for num in sorted(rows.keys()):
+        for ctype in ('white', 'black'):
+            plies.append(rows[num].get(f'{ctype}_text') or '')
+    return plies
+
+
+def score_game(plies, golden):
+    """(correct plies, plies read, plies that replay legally from the start)."""
+    correct = sum(1 for got, want in zip(plies, golden) if got and normalize_san(got) == normalize_san(want))
+    read = [p for p in plies if p]
+    board = chess.Board()
+    legal = 0
+    for text in plies:
+        if not text:
+            break
+        move = san_index(board).lookup(text)
+        if move is None:
+            break
+        board.push(move)
+        legal += 1
+    return correct, len(read), legal
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    out = {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES}
+    out['mean'] = float(values.mean())
+    out['max'] = float(values.max())
+    return out
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run(pipeline, sheets, zoom=None, verbose=False):
+    per_image = []
+    stage_times = {stage: [] for stage in STAGES}
+    for path, golden in sheets:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(sys.stdout if verbose else out):
+            t0 = time.perf_counter()
+            rows, _, timings = pipeline.process(path, zoom=zoom)
+            wall = time.perf_counter() - t0
+        correct, read, legal = score_game(read_plies(rows), golden)
+        timings = {k: float(v) for k, v in timings.items()}
+        timings['total'] = wall
+        for stage in STAGES:
+            if stage in timings:
+                stage_times[stage].append(timings[stage])
+        per_image.append({
+            'image': os.path.basename(path),
+            'plies': len(golden), 'correct': correct, 'read': read, 'legal_prefix': legal,
+            'cells': int(timings.get('cells_recognized', 0)),
+            'timings': timings,
+        })
+        print(f"  {os.path.basename(path):30s} {wall:6.2f}s  {correct}/{len(golden)} plies correct, "
+              f"{legal} legal")
+
+    plies = sum(r['plies'] for r in per_image)
+    read = sum(r['read'] for r in per_image)
+    cells = sum(r['cells'] for r in per_image)
+    step6 = sum(r['timings'].get('step6_ocr', 0.0) for r in per_image)
+    return {
+        'images': len(per_image),
+        'stages': {stage: percentiles(times) for stage, times in stage_times.items() if times},
+        'peak_rss_mb': peak_rss_mb(),
+        'cells_per_sec': cells / step6 if step6 > 0 else 0.0,
+        'accuracy': sum(r['correct'] for r in per_image) / plies if plies else 0.0,
+        # share of the plies read that replay as a legal game from the first move
+        'legality': sum(r['legal_prefix'] for r in per_image) / read if read else 0.0,
+        'per_image': per_image,
+    }
+
+
+def compare(result, baseline, max_latency_regression, min_latency_delta, max_accuracy_drop):
+    """List of regression messages, empty if the run is as good as the baseline."""
+    problems = []
+    for stage, base in baseline.get('stages', {}).items():
+        new = result['stages'].get(stage)
+        if not new:
+            continue
+        for key in ('p50', 'p90'):
+            if key not in base:
+                continue
+            delta = new[key] - base[key]
+            if delta > min_latency_delta and new[key] > base[key] * (1 + max_latency_regression):
+                problems.append(f"{stage} {key}: {base[key]:.3f}s -> {new[key]:.3f}s")
+    for key in ('accuracy', 'legality'):
+        if key in baseline and result[key] < baseline[key] - max_accuracy_drop:
+            problems.append(f"{key}: {baseline[key] * 100:.2f}% -> {result[key] * 100:.2f}%")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', required=True, help='directory of scoresheet images with same-name .pgn files')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--max-latency-regression', type=float, default=0.10,
+                        help='allowed relative p50/p90 slowdown per stage (default 10%%)')
+    parser.add_argument('--min-latency-delta', type=float, default=0.02,
+                        help='slowdowns smaller than this many seconds are noise')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.005,
+                        help='allowed absolute drop in accuracy and legality rate')
+    parser.add_argument('--warmup', type=int, default=1, help='images processed before measuring')
+    parser.add_argument('--zoom', type=float, default=None)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--cpu-threads', type=int, default=4)
+    parser.add_argument('--precision', default='fp32', help="move model precision, 'fp32' or 'int8'")
+    parser.add_argument('--templates', default=None, help='template index to match against (never learned into)')
+    parser.add_argument('--verbose', action='store_true', help='show the pipeline output')
+    args = parser.parse_args()
+
+    sheets = load_corpus(args.corpus)
+    if not sheets:
+        sys.exit(f"no images with a golden .pgn in {args.corpus}")
+    print(f"{len(sheets)} scoresheets ({args.corpus})")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline = ScoresheetPipeline(device=args.device, cpu_threads=args.cpu_threads,
+                                      move_ocr_precision=args.precision,
+                                      template_path=args.templates, learn_templates=False)
+        # first runs pay for predictor and MKLDNN primitive setup
+        for path, _ in sheets[:args.warmup]:
+            pipeline.process(path, zoom=args.zoom)
+
+    result = run(pipeline, sheets, zoom=args.zoom, verbose=args.verbose)
+
+    print(f"\n{'stage':16s} {'p50':>8s} {'p90':>8s} {'p99':>8s}")
+    for stage, p in result['stages'].items():
+        print(f"{stage:16s} {p['p50']:8.3f} {p['p90']:8.3f} {p['p99']:8.3f}")
+    print(f"peak RSS: {result['peak_rss_mb']:.0f} MB, step 6: {result['cells_per_sec']:.1f} cells/s")
+    print(f"accuracy: {result['accuracy'] * 100:.2f}% of plies, legality: {result['legality'] * 100:.2f}%")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(result, baseline, args.max_latency_regression, args.min_latency_delta,
+                           args.max_accuracy_drop)
+        if problems:
+            print(f"\nREGRESSIONS vs {args.baseline}:")
+            for p in problems:
+                print(f"  {p}")
+            sys.exit(1)
+        print(f"\nno regressions vs {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Microbenchmark: CTC prefix beam search vs the original dict-based beam search
+
+Runs both decoders over recorded posterior matrices, one (time_steps, num_classes)
+.npy file per cell, e.g. saved from PaddleRecognizer.recognize_batch():
+
+    for i, (probs, _) in enumerate(recognizer.recognize_batch(crops)):
+        np.save(f'posteriors/cell_{i:04d}.npy', probs)
+
+Usage:
+    python benchmarks/bench_ctc_decode.py --posteriors posteriors/ --beam-width 30
+    python benchmarks/bench_ctc_decode.py --synthetic 200
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ctc_decode import ctc_prefix_beam_search
+
+DICT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'chess_dict_full.txt')
+
+
+# the decoder PaddleRecognizer used before ctc_prefix_beam_search, kept for comparison
+def legacy_beam_search(probs, chars, beam_width=20, top_k=5):
+    log_probs = np.log(probs + 1e-10)
+    beams = [{'text': '', 'score': 0.0, 'last': -1}]
+
+    for t in range(log_probs.shape[0]):
+        new_beams = []
+        for beam in beams:
+            for idx in range(len(chars)):
+                lp = log_probs[t, idx]
+                if idx == 0:  # blank
+                    new_beams.append({'text': beam['text'], 'score': beam['score'] + lp, 'last': idx})
+                elif idx != beam['last']:
+                    new_beams.append({'text': beam['text'] + chars[idx], 'score': beam['score'] + lp, 'last': idx})
+                else:
+                    new_beams.append({'text': beam['text'], 'score': beam['score'] + lp, 'last': idx})
+
+        merged = {}
+        for b in new_beams:
+            key = (b['text'], b['last'])
+            if key not in merged or b['score'] > merged[key]:
+                merged[key] = b['score']
+
+        beams = [{'text': k[0], 'score': v, 'last': k[1]} for k, v in merged.items()]
+        beams.sort(key=lambda x: -x['score'])
+        beams = beams[:beam_width]
+
+    unique = {}
+    for b in beams:
+        if b['text'] not in unique or b['score'] > unique[b['text']]:
+            unique[b['text']] = b['score']
+
+    results = [(text, np.exp(score)) for text, score in sorted(unique.items(), key=lambda x: -x[1])[:top_k]]
+    total = sum(p for _, p in results)
+    if total > 0:
+        results = [(t, p/total) for t, p in results]
+
+    return results
+
+
+def load_chars(dict_path):
+    with open(dict_path, 'r') as f:
+        return [''] + [line.strip() for line in f.readlines()]
+
+
+# peaked posteriors for random SAN-like strings, used when no recordings are given
+def synthetic_posteriors(count, num_classes, time_steps=40, seed=0):
+    rng = np.random.default_rng(seed)
+    mats = []
+    for _ in range(count):
+        length = rng.integers(2, 7)
+        labels = rng.integers(1, num_classes, size=length)
+        path = np.zeros(time_steps, dtype=int)
+        slots = np.sort(rng.choice(np.arange(2, time_steps - 2), size=length, replace=False))
+        path[slots] = labels
+        logits = rng.normal(0, 1.0, size=(time_steps, num_classes))
+        logits[np.arange(time_steps), path] += rng.uniform(3, 8, size=time_steps)
+        e = np.exp(logits - logits.max(axis=1, keepdims=True))
+        mats.append((e / e.sum(axis=1, keepdims=True)).astype(np.float32))
+    return mats
+
+
+def time_decoder(fn, mats, chars, beam_width, top_k):
+    outputs = []
+    start = time.perf_counter()
+    for probs in mats:
+        outputs.append(fn(probs, chars, beam_width=beam_width, top_k=top_k))
+    return (time.perf_counter() - start) / len(mats), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posteriors', help='directory of recorded .npy posterior matrices')
+    parser.add_argument('--synthetic', type=int, default=100, help='number of synthetic matrices if no recordings')
+    parser.add_argument('--dict', default=DICT_PATH)
+    parser.add_argument('--beam-width', type=int, default=30)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+
+    chars = load_chars(args.dict)
+    if args.posteriors:
+        mats = [np.load(p) for p in sorted(glob.glob(os.path.join(args.posteriors, '*.npy')))]
+        source = args.posteriors
+    else:
+        mats = synthetic_posteriors(args.synthetic, len(chars))
+        source = 'synthetic'
+    if not mats:
+        sys.exit(f"no posterior matrices found in {source}")
+
+    print(f"{len(mats)} posterior matrices ({source}), beam_width={args.beam_width}, top_k={args.top_k}")
+
+    legacy_t, legacy_out = time_decoder(legacy_beam_search, mats, chars, args.beam_width, args.top_k)
+    prefix_t, prefix_out = time_decoder(ctc_prefix_beam_search, mats, chars, args.beam_width, args.top_k)
+
+    agree = sum(1 for a, b in zip(legacy_out, prefix_out) if a[0][0] == b[0][0])
+
+    print(f"  {'legacy':20s}: {legacy_t * 1000:8.3f} ms/cell")
+    print(f"  {'prefix beam search':20s}: {prefix_t * 1000:8.3f} ms/cell")
+    print(f"  speedup: {legacy_t / prefix_t:.1f}x")
+    print(f"  top-1 agreement: {agree}/{len(mats)} ({agree / len(mats) * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Microbenchmarks: the non-model stages of the pipeline, on a plain CPU with no model files
+
+Builds the pipeline with fakes.FakeDetector / fakes.FakeRecognizer (no
+ultralytics, paddle or weights needed) and times, on synthetic sheets:
+
+    step2_deskew               angle estimate from tilted move boxes
+    step4_extrapolate_numbers  gap filling with missing number anchors
+    step5_associate_moves      move box association (ASSOCIATION method)
+    beam_search_recognize      CTC prefix beam search of one noisy cell (beam 30, top 10)
+    try_parse_move             OCR text -> legal move, cold and warm SanIndex cache
+
+Usage:
+    python benchmarks/bench_stages.py
+    python benchmarks/bench_stages.py --sheets 50 --repeat 20 --only step5_associate_moves
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import chess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import san_index as san_index_module
+from bench_association import synthetic_sheet
+from box_table import make_boxes
+from fakes import FakeDetector, FakeRecognizer, text_posteriors
+from scoresheet_pipeline import PageImage, ScoresheetPipeline, load_charset
+
+DICT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'chess_dict_full.txt')
+BENCHMARKS = ('step2_deskew', 'step4_extrapolate_numbers', 'step5_associate_moves',
+              'beam_search_recognize', 'try_parse_move')
+
+
+def make_pipeline(chars):
+    empty = make_boxes([], [], [], [])
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ScoresheetPipeline(detector=FakeDetector([(empty, empty)]),
+                                  move_recognizer=FakeRecognizer.from_texts(chars, ['e4']),
+                                  number_recognizer=FakeRecognizer.from_texts(chars, ['1']),
+                                  template_path=None)
+
+
+# move boxes of a synthetic sheet rotated by angle degrees around the page center
+def tilted_boxes(boxes, angle, center):
+    theta = np.radians(angle)
+    cx, cy = boxes['cx'] - center[0], boxes['cy'] - center[1]
+    nx = cx * np.cos(theta) - cy * np.sin(theta) + center[0]
+    ny = cx * np.sin(theta) + cy * np.cos(theta) + center[1]
+    hw, hh = boxes['w'] // 2, boxes['h'] // 2
+    return make_boxes(nx - hw, ny - hh, nx + hw, ny + hh, conf=boxes['conf'])
+
+
+# CTC posteriors of a move with Dirichlet noise, so the beam search has real competition
+def noisy_posteriors(rng, text, chars, noise=0.3):
+    probs = text_posteriors(text, chars)
+    mix = rng.dirichlet(np.full(len(chars), 0.1), size=len(probs)).astype(np.float32)
+    return (1 - noise) * probs + noise * mix
+
+
+def random_positions(rng, n):
+    boards = []
+    for _ in range(n):
+        board = chess.Board()
+        for _ in range(int(rng.integers(0, 60))):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(moves[int(rng.integers(len(moves)))])
+        boards.append(board)
+    return boards
+
+
+def timed(fn, items, repeat):
+    """(median seconds per item over repeat passes through items, seconds of the first call).
+
+    The first call pays one-off costs (lazy imports such as scipy for step 5, first
+    use caches), it is made once before the timed passes and reported apart.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        fn(items[0])
+        first_call = time.perf_counter() - t0
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for item in items:
+                fn(item)
+        runs.append((time.perf_counter() - t0) / len(items))
+    return float(np.median(runs)), first_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=20, help='synthetic sheets per benchmark')
+    parser.add_argument('--cells', type=int, default=200, help='cells for beam_search_recognize')
+    parser.add_argument('--positions', type=int, default=200, help='positions for try_parse_move')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', choices=BENCHMARKS, action='append', help='run only these benchmarks')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    chars = load_charset(DICT_PATH)
+    pipeline = make_pipeline(chars)
+    sheets = [synthetic_sheet(rng) for _ in range(args.sheets)]
+    selected = args.only or BENCHMARKS
+    results = {}
+
+    if 'step2_deskew' in selected:
+        page = PageImage(np.zeros((1600, 1200, 3), dtype=np.uint8))
+        inputs = [tilted_boxes(boxes, rng.uniform(-4, 4), (600, 800)) for _, boxes, _ in sheets]
+        results['step2_deskew'] = (timed(lambda b: pipeline.step2_deskew(page, b), inputs, args.repeat), 'sheet')
+
+    if 'step4_extrapolate_numbers' in selected:
+        # YOLO misses about a third of the number cells
+        inputs = [numbers[rng.random(len(numbers)) > 0.35] for numbers, _, _ in sheets]
+        results['step4_extrapolate_numbers'] = (timed(pipeline.step4_extrapolate_numbers, inputs, args.repeat), 'sheet')
+
+    if 'step5_associate_moves' in selected:
+        inputs = [(numbers, boxes) for numbers, boxes, _ in sheets]
+        results['step5_associate_moves'] = (timed(lambda nb: pipeline.step5_associate_moves(*nb), inputs, args.repeat), 'sheet')
+
+    if 'beam_search_recognize' in selected:
+        boards = random_positions(rng, args.cells)
+        texts = [board.san(list(board.legal_moves)[0]) if board.legal_moves.count() else 'O-O' for board in boards]
+        recognizer = FakeRecognizer(chars, [noisy_posteriors(rng, t, chars) for t in texts])
+        results['beam_search_recognize'] = (
+            timed(lambda _: recognizer.beam_search_recognize(None, beam_width=30, top_k=10), texts, args.repeat), 'cell')
+
+    if 'try_parse_move' in selected:
+        boards = random_positions(rng, args.positions)
+        inputs = []
+        for board in boards:
+            for move in list(board.legal_moves)[:5]:
+                san = board.san(move).rstrip('+#')
+                # as read off a sheet: no capture x, l for 1, or exactly as written
+                inputs.extend([(board, san), (board, san.replace('x', '')), (board, san.replace('1', 'l'))])
+
+        def cold(item):
+            san_index_module._cache.entries.clear()
+            pipeline.try_parse_move(*item)
+        results['try_parse_move (cold)'] = (timed(cold, inputs, args.repeat), 'call')
+        results['try_parse_move (warm)'] = (timed(lambda item: pipeline.try_parse_move(*item), inputs, args.repeat), 'call')
+
+    print(f"{'benchmark':30s} {'median':>12s}")
+    for name, ((seconds, first_call), unit) in results.items():
+        print(f"{name:30s} {seconds * 1e3:9.3f} ms/{unit}  (first call {first_call * 1e3:.1f} ms)")
+
+
+if __name__ == '__main__':
+    main()
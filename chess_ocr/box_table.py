@@ -0,0 +1,65 @@
+"""
+Columnar box and number tables for steps 1-5
+YOLO boxes and move numbers are numpy structured arrays instead of lists of
+small dicts, so sorting, clustering, medians and neighbor lookups in steps 1-5
+are vectorized. Dicts are only made at the API boundary, for the boxes in the
+rows returned by step 5.
+"""
+
+import numpy as np
+
+BOX_DTYPE = np.dtype([
+    ('x1', 'i4'), ('y1', 'i4'), ('x2', 'i4'), ('y2', 'i4'),
+    ('cx', 'i4'), ('cy', 'i4'), ('w', 'i4'), ('h', 'i4'),
+    ('conf', 'f4'), ('source', 'U16'),
+])
+
+NUMBER_DTYPE = np.dtype([('number', 'i4'), ('x', 'f8'), ('y', 'f8'), ('source', 'U24')])
+
+
+def make_boxes(x1, y1, x2, y2, conf=None, source='yolo'):
+    """Box table from corner coordinates, centers and sizes are derived."""
+    x1, y1, x2, y2 = (np.asarray(v, dtype=np.int64).ravel() for v in (x1, y1, x2, y2))
+    boxes = np.zeros(len(x1), dtype=BOX_DTYPE)
+    boxes['x1'], boxes['y1'], boxes['x2'], boxes['y2'] = x1, y1, x2, y2
+    boxes['cx'] = (x1 + x2) // 2
+    boxes['cy'] = (y1 + y2) // 2
+    boxes['w'] = x2 - x1
+    boxes['h'] = y2 - y1
+    boxes['conf'] = 1.0 if conf is None else conf
+    boxes['source'] = source
+    return boxes
+
+
+def make_numbers(records):
+    """Number table from (number, x, y, source) tuples."""
+    return np.array([tuple(r) for r in records], dtype=NUMBER_DTYPE)
+
+
+def box_dict(box):
+    """Dict view of one box table record, the format rows and the server use."""
+    return {
+        'x1': int(box['x1']), 'y1': int(box['y1']), 'x2': int(box['x2']), 'y2': int(box['y2']),
+        'cx': int(box['cx']), 'cy': int(box['cy']), 'w': int(box['w']), 'h': int(box['h']),
+        'conf': float(box['conf']), 'source': str(box['source']),
+    }
+
+
+def number_dicts(numbers):
+    return [{'number': int(n['number']), 'x': float(n['x']), 'y': float(n['y']), 'source': str(n['source'])}
+            for n in numbers]
+
+
+def gap_groups(values, threshold):
+    """1-D clustering: sort the values, start a new group wherever the gap to the
+    previous value is larger than threshold.
+
+    Returns:
+        list of index arrays, in ascending value order
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return []
+    order = np.argsort(values, kind='stable')
+    splits = np.where(np.diff(values[order]) > threshold)[0] + 1
+    return np.split(order, splits)
@@ -0,0 +1,174 @@
+"""
+CTC decoding helpers for the move recognizer
+Pure numpy so they can be used (and benchmarked) without paddle installed.
+Posterior matrices are (time_steps, num_classes) softmax outputs with the
+blank at class index 0, same as PaddleRecognizer.
+"""
+
+import numpy as np
+
+# multiplier for the rolling prefix hash (uint64 arithmetic wraps around)
+_HASH_MULT = np.uint64(1000003)
+
+
+def ctc_prefix_beam_search(probs, chars, beam_width=20, top_k=5, prune_mass=0.999):
+    """CTC prefix beam search over one posterior matrix.
+
+    Each beam is a label prefix with separate blank-ending and non-blank-ending
+    probabilities, so paths that collapse to the same text are summed instead
+    of competing. At each timestep only the most probable classes covering
+    prune_mass of the probability are expanded.
+
+    Beams live in numpy arrays (labels, lengths, hashes, p_blank, p_nonblank)
+    and prefixes are merged by a rolling hash of their labels.
+
+    Returns:
+        list of (text, prob) for the top_k prefixes, probs normalized over top_k
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    T = probs.shape[0]
+
+    labels = np.zeros((1, max(T, 1)), dtype=np.int16)
+    lengths = np.zeros(1, dtype=np.int64)
+    hashes = np.zeros(1, dtype=np.uint64)
+    p_b = np.ones(1)
+    p_nb = np.zeros(1)
+
+    for t in range(T):
+        row = probs[t]
+
+        # classes covering prune_mass of this timestep, blank is always handled separately
+        order = np.argsort(-row)
+        keep = order[:np.searchsorted(np.cumsum(row[order]), prune_mass) + 1]
+        cls = keep[keep != 0]
+
+        n_beams = len(lengths)
+        last = np.where(lengths > 0, labels[np.arange(n_beams), np.maximum(lengths - 1, 0)], -1)
+        total = p_b + p_nb
+
+        # same prefix: emit blank, or repeat the last label (collapsed)
+        stay_b = total * row[0]
+        stay_nb = p_nb * np.where(last >= 0, row[np.maximum(last, 0)], 0.0)
+
+        # extended prefix: a repeated label only extends from a blank-ending path
+        ext_nb = np.where(cls[None, :] == last[:, None], p_b[:, None], total[:, None]) * row[cls][None, :]
+        ext_hash = hashes[:, None] * _HASH_MULT + (cls[None, :] + 1).astype(np.uint64)
+
+        cand_hash = np.concatenate([hashes, ext_hash.ravel()])
+        cand_b = np.concatenate([stay_b, np.zeros(ext_nb.size)])
+        cand_nb = np.concatenate([stay_nb, ext_nb.ravel()])
+        cand_parent = np.concatenate([np.arange(n_beams), np.repeat(np.arange(n_beams), len(cls))])
+        cand_label = np.concatenate([np.full(n_beams, -1), np.tile(cls, n_beams)])
+
+        # merge candidates that are the same prefix
+        uniq, first, inverse = np.unique(cand_hash, return_index=True, return_inverse=True)
+        merged_b = np.zeros(len(uniq))
+        merged_nb = np.zeros(len(uniq))
+        np.add.at(merged_b, inverse, cand_b)
+        np.add.at(merged_nb, inverse, cand_nb)
+
+        merged_total = merged_b + merged_nb
+        if len(uniq) > beam_width:
+            best = np.argpartition(-merged_total, beam_width - 1)[:beam_width]
+        else:
+            best = np.arange(len(uniq))
+
+        # all mass underflowed, keep the beams of the previous timestep as they are
+        scale = merged_total[best].max()
+        if scale <= 0:
+            break
+
+        src = first[best]
+        parent = cand_parent[src]
+        new_label = cand_label[src]
+        extended = new_label >= 0
+
+        labels = labels[parent].copy()
+        lengths = lengths[parent].copy()
+        labels[extended, lengths[extended]] = new_label[extended]
+        lengths[extended] += 1
+        hashes = uniq[best]
+
+        # rescale so long sequences do not underflow, ranking is unaffected
+        p_b = merged_b[best] / scale
+        p_nb = merged_nb[best] / scale
+
+    total = p_b + p_nb
+    top = np.argsort(-total)[:top_k]
+    results = [(''.join(chars[i] for i in labels[b, :lengths[b]]), float(total[b])) for b in top]
+
+    norm = sum(p for _, p in results)
+    if norm > 0:
+        results = [(text, p / norm) for text, p in results]
+
+    return results
+
+
+def greedy_decode(probs, chars):
+    """Best-path decode, returns (text, log prob of the best path)."""
+    probs = np.asarray(probs, dtype=np.float64)
+    path = probs.argmax(axis=1)
+    text = ''.join(chars[c] for i, c in enumerate(path) if c != 0 and (i == 0 or c != path[i - 1]))
+    return text, float(np.log(probs[np.arange(len(path)), path] + 1e-30).sum())
+
+
+def ctc_word_log_likelihoods(probs, words, char_index):
+    """Batched CTC forward pass: log p(word | posteriors) for every word.
+
+    All words are scored at once over a padded (num_words, 2*max_len+1) lattice
+    of blank-interleaved labels. Words containing characters outside the
+    recognizer dictionary get -inf.
+
+    Args:
+        probs: (time_steps, num_classes) posterior matrix, blank at index 0
+        words: list of strings
+        char_index: dict mapping character -> class index
+
+    Returns:
+        (num_words,) array of log likelihoods
+    """
+    log_probs = np.log(np.asarray(probs, dtype=np.float64) + 1e-30)
+    T = log_probs.shape[0]
+    N = len(words)
+    if N == 0:
+        return np.zeros(0)
+
+    max_len = max(len(w) for w in words)
+    S = 2 * max_len + 2  # one spare column so the first label slot always exists
+
+    # extended label sequences: blank, c1, blank, c2, ..., blank
+    ext = np.zeros((N, S), dtype=np.int64)
+    valid = np.ones(N, dtype=bool)
+    seq_len = np.zeros(N, dtype=np.int64)
+    for i, word in enumerate(words):
+        idx = [char_index.get(c, -1) for c in word]
+        if -1 in idx:
+            valid[i] = False
+            idx = []
+        ext[i, 1:2 * len(idx):2] = idx
+        seq_len[i] = 2 * len(idx) + 1
+
+    in_seq = np.arange(S)[None, :] < seq_len[:, None]
+    # skip transition s-2 -> s allowed onto a label that differs from the label two back
+    can_skip = np.zeros((N, S), dtype=bool)
+    can_skip[:, 2:] = (ext[:, 2:] != 0) & (ext[:, 2:] != ext[:, :-2])
+
+    alpha = np.full((N, S), -np.inf)
+    alpha[:, 0] = log_probs[0, 0]
+    alpha[:, 1] = np.where(seq_len > 1, log_probs[0, ext[:, 1]], -np.inf)
+    alpha[~in_seq] = -np.inf
+
+    neg_inf = np.full((N, 1), -np.inf)
+    neg_inf2 = np.full((N, 2), -np.inf)
+    for t in range(1, T):
+        prev1 = np.concatenate([neg_inf, alpha[:, :-1]], axis=1)
+        prev2 = np.where(can_skip, np.concatenate([neg_inf2, alpha[:, :-2]], axis=1), -np.inf)
+        alpha = np.logaddexp(np.logaddexp(alpha, prev1), prev2) + log_probs[t, ext]
+        alpha[~in_seq] = -np.inf
+
+    rows = np.arange(N)
+    last = alpha[rows, seq_len - 1]
+    last_label = np.where(seq_len > 1, alpha[rows, np.maximum(seq_len - 2, 0)], -np.inf)
+    result = np.logaddexp(last, last_label)
+    result[~valid] = -np.inf
+    return result
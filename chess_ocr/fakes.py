@@ -0,0 +1,177 @@
+"""
+Model-free stand-ins for the cell detector and the recognizers
+FakeDetector replays recorded YOLO box tables and FakeRecognizer replays
+recorded CTC posterior matrices (or posteriors synthesized from strings), in
+call order, so steps 1-6 run deterministically without ultralytics, paddle or
+model files:
+
+    pipeline = ScoresheetPipeline(detector=FakeDetector.load('rec/detections.npz'),
+                                  move_recognizer=FakeRecognizer.load('rec/moves.npz', chars),
+                                  number_recognizer=FakeRecognizer.load('rec/numbers.npz', number_chars),
+                                  template_path=None)
+
+RecordingDetector / RecordingRecognizer wrap the real backends of a pipeline
+to write those recordings.
+"""
+
+import threading
+
+import numpy as np
+
+from ctc_decode import ctc_prefix_beam_search, greedy_decode
+
+
+def text_posteriors(text, chars, time_steps=40, peak=0.9):
+    """(time_steps, len(chars)) CTC posteriors whose best path reads text.
+
+    Each character gets one timestep with probability peak, separated by blanks,
+    the rest of the mass is spread evenly over the other classes.
+    """
+    index = {c: i for i, c in enumerate(chars) if c}
+    labels = [index[c] for c in text if c in index]
+    probs = np.full((time_steps, len(chars)), (1 - peak) / (len(chars) - 1), dtype=np.float32)
+    probs[:, 0] = peak
+    step = max(1, time_steps // (len(labels) + 1))
+    for i, label in enumerate(labels[:time_steps // step]):
+        t = (i + 1) * step - 1
+        probs[t, 0] = (1 - peak) / (len(chars) - 1)
+        probs[t, label] = peak
+    return probs
+
+
+class FakeDetector:
+    """Replays recorded (number boxes, move boxes) tables, one per detect() call.
+
+    After the last recording the last one is repeated (e.g. the re-detection
+    after a large deskew sees the same boxes).
+    """
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def detect(self, img):
+        with self.lock:
+            frame = self.frames[min(self.calls, len(self.frames) - 1)]
+            self.calls += 1
+        return frame[0].copy(), frame[1].copy()
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        n = len([k for k in data.files if k.startswith('num_')])
+        return cls([(data[f'num_{i}'], data[f'move_{i}']) for i in range(n)])
+
+
+class FakeRecognizer:
+    """Replays CTC posterior matrices, one per recognized region, in call order (cycling)."""
+
+    def __init__(self, chars, posteriors):
+        self.chars = chars
+        self.char_index = {c: i for i, c in enumerate(chars) if c}
+        self.posteriors = [np.asarray(p, dtype=np.float32) for p in posteriors]
+        self.next_index = 0
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_texts(cls, chars, texts, time_steps=40):
+        return cls(chars, [text_posteriors(t, chars, time_steps) for t in texts])
+
+    @classmethod
+    def load(cls, path, chars):
+        data = np.load(path)
+        return cls(chars, [data[f'p{i}'] for i in range(len(data.files))])
+
+    def next_posteriors(self, n):
+        with self.lock:
+            out = [self.posteriors[(self.next_index + i) % len(self.posteriors)] for i in range(n)]
+            self.next_index += n
+            self.batches += 1
+        return out
+
+    def take_stats(self):
+        with self.lock:
+            stats = {'queue_wait': 0.0, 'batches': self.batches}
+            self.batches = 0
+        return stats
+
+    def beam_search_decode(self, probs, beam_width=20, top_k=5):
+        return ctc_prefix_beam_search(probs, self.chars, beam_width=beam_width, top_k=top_k)
+
+    def recognize(self, img):
+        probs = self.next_posteriors(1)[0]
+        text, _ = greedy_decode(probs, self.chars)
+        max_probs = probs.max(axis=1)
+        conf = float(np.mean(max_probs[max_probs > 0.1])) if len(max_probs[max_probs > 0.1]) > 0 else 0.0
+        return text, conf
+
+    def beam_search_recognize(self, img, beam_width=20, top_k=5):
+        return self.beam_search_decode(self.next_posteriors(1)[0], beam_width=beam_width, top_k=top_k)
+
+    def recognize_sources(self, sources, beam_width=20, top_k=5, decode=True):
+        posteriors = self.next_posteriors(len(sources))
+        return [(probs, self.beam_search_decode(probs, beam_width, top_k) if decode else None)
+                for probs in posteriors]
+
+    def recognize_regions(self, img, regions, beam_width=20, top_k=5, decode=True):
+        return self.recognize_sources(regions, beam_width=beam_width, top_k=top_k, decode=decode)
+
+    def recognize_batch(self, crops, beam_width=20, top_k=5, decode=True):
+        return self.recognize_sources(crops, beam_width=beam_width, top_k=top_k, decode=decode)
+
+
+class RecordingDetector:
+    """Wraps a detector and keeps every (number boxes, move boxes) result for FakeDetector."""
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.frames = []
+
+    def detect(self, img):
+        num_boxes, move_boxes = self.detector.detect(img)
+        self.frames.append((num_boxes.copy(), move_boxes.copy()))
+        return num_boxes, move_boxes
+
+    def save(self, path):
+        arrays = {}
+        for i, (num_boxes, move_boxes) in enumerate(self.frames):
+            arrays[f'num_{i}'] = num_boxes
+            arrays[f'move_{i}'] = move_boxes
+        np.savez_compressed(path, **arrays)
+
+
+class RecordingRecognizer:
+    """Wraps a recognizer and keeps the posteriors of every recognized region for FakeRecognizer.
+
+    Empty regions (no posteriors) are recorded as all-blank matrices.
+    """
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self.chars = recognizer.chars
+        self.char_index = recognizer.char_index
+        self.posteriors = []
+
+    def __getattr__(self, name):
+        return getattr(self.recognizer, name)
+
+    def record(self, results):
+        for probs, _ in results:
+            if probs is None:
+                probs = np.zeros((1, len(self.chars)), dtype=np.float32)
+                probs[:, 0] = 1.0
+            self.posteriors.append(np.asarray(probs))
+        return results
+
+    def recognize_regions(self, img, regions, beam_width=20, top_k=5, decode=True):
+        return self.record(self.recognizer.recognize_regions(img, regions, beam_width=beam_width,
+                                                             top_k=top_k, decode=decode))
+
+    def recognize_batch(self, crops, beam_width=20, top_k=5, decode=True):
+        return self.record(self.recognizer.recognize_batch(crops, beam_width=beam_width,
+                                                           top_k=top_k, decode=decode))
+
+    def save(self, path):
+        np.savez_compressed(path, **{f'p{i}': p for i, p in enumerate(self.posteriors)})
@@ -0,0 +1,196 @@
+"""
+INT8 post-training quantization for the fine-tuned move recognizer
+
+1. calibrate - run PaddleSlim post-training quantization on a folder of cell crops
+2. evaluate  - compare move-level accuracy and latency of FP32 vs INT8 on labeled
+               crops and write quant_report.json next to the INT8 model, which
+               ScoresheetPipeline checks before it agrees to load the INT8 model
+               (same decoder as the pipeline, CPU only, and the report must
+               belong to the model's current weights)
+
+Labels use the PaddleOCR recognition format, one "relative/path.png<TAB>move" per line.
+The lexicon decoder (MOVE_DECODER, the default) only scores legal moves, so it also
+needs the position before the move: "relative/path.png<TAB>move<TAB>FEN".
+
+Usage:
+    python quantize_recognizer.py calibrate --crops crops/ --output PaddleOCR/output/chess_black_only/inference_int8
+    python quantize_recognizer.py evaluate --labels crops/labels.txt --int8 PaddleOCR/output/chess_black_only/inference_int8
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import chess
+import cv2
+import numpy as np
+
+from fakes import FakeDetector
+from san_index import san_index
+from scoresheet_pipeline import MOVE_DECODER, PaddleRecognizer, QUANT_REPORT_NAME, ScoresheetPipeline, params_digest
+
+FP32_MODEL = 'PaddleOCR/output/chess_black_only/inference'
+# INT8 is CPU only (MKLDNN int8 kernels), calibration and evaluation run there
+DEVICE = 'cpu'
+DICT_PATH = 'data/chess_dict_full.txt'
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def list_crops(crop_dir):
+    paths = []
+    for ext in IMAGE_EXTS:
+        paths.extend(glob.glob(os.path.join(crop_dir, '**', '*' + ext), recursive=True))
+    return sorted(paths)
+
+
+def load_labels(label_path):
+    base = os.path.dirname(label_path)
+    samples = []
+    with open(label_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            path, label, *fen = line.split('\t')
+            samples.append((os.path.join(base, path), label, fen[0] if fen else None))
+    return samples
+
+
+def calibrate(args):
+    import paddle
+    from paddleslim.quant import quant_post_static
+
+    # only used for its preprocessing, calibration batches match what the service feeds
+    recognizer = PaddleRecognizer(model_dir=args.model_dir, dict_path=args.dict, device=DEVICE)
+    width = recognizer.img_shape[2]
+
+    paths = list_crops(args.crops)
+    if not paths:
+        raise SystemExit(f"no crops found in {args.crops}")
+    print(f"Calibrating on {len(paths)} crops, {args.batch_nums} batches of {args.batch_size}")
+
+    def batch_generator():
+        for start in range(0, len(paths), args.batch_size):
+            crops = [cv2.imread(p) for p in paths[start:start + args.batch_size]]
+            crops = [c for c in crops if c is not None]
+            if crops:
+                yield [np.concatenate([recognizer.preprocess(c, pad_width=width) for c in crops])]
+
+    paddle.enable_static()
+    exe = paddle.static.Executor(paddle.CPUPlace())
+    quant_post_static(
+        executor=exe,
+        model_dir=args.model_dir,
+        quantize_model_path=args.output,
+        batch_generator=batch_generator,
+        model_filename='inference.json',
+        params_filename='inference.pdiparams',
+        save_model_filename='inference.json',
+        save_params_filename='inference.pdiparams',
+        batch_size=args.batch_size,
+        batch_nums=args.batch_nums,
+        algo=args.algo,
+    )
+    print(f"Saved INT8 model: {args.output}")
+    print("Run 'evaluate' before enabling it, the pipeline refuses models without a report")
+
+
+# pipeline used only for its step 6 decoding, so no detector or number model is loaded
+def lexicon_pipeline(recognizer):
+    return ScoresheetPipeline(detector=FakeDetector([]), move_recognizer=recognizer,
+                              number_recognizer=recognizer, template_path=None)
+
+
+def read_correct(pipeline, decoder, probs, candidates, label, fen):
+    if decoder == 'beam':
+        return bool(candidates) and candidates[0][0] == label
+    # lexicon: the legal move picked from the posteriors must be the labeled move
+    board = chess.Board(fen)
+    expected = san_index(board).lookup(label)
+    if expected is None:
+        return False
+    expected_san = board.san(expected)
+    san, _, _ = pipeline.resolve_move_lexicon(board, probs)
+    return san == expected_san
+
+
+def evaluate_model(recognizer, samples, batch_size, decoder):
+    pipeline = lexicon_pipeline(recognizer) if decoder == 'lexicon' else None
+    crops = [cv2.imread(p) for p, _, _ in samples]
+    correct = 0
+    elapsed = 0.0
+    for start in range(0, len(samples), batch_size):
+        chunk = crops[start:start + batch_size]
+        t0 = time.perf_counter()
+        results = recognizer.recognize_batch(chunk, beam_width=10, top_k=1, decode=(decoder == 'beam'))
+        elapsed += time.perf_counter() - t0
+        for (probs, candidates), (_, label, fen) in zip(results, samples[start:start + batch_size]):
+            if read_correct(pipeline, decoder, probs, candidates, label, fen):
+                correct += 1
+    return {
+        'accuracy': correct / len(samples),
+        'ms_per_cell': elapsed / len(samples) * 1000,
+    }
+
+
+def evaluate(args):
+    samples = load_labels(args.labels)
+    if not samples:
+        raise SystemExit(f"no labeled crops in {args.labels}")
+    if args.decoder == 'lexicon' and any(fen is None for _, _, fen in samples):
+        raise SystemExit("the lexicon decoder needs the position of every crop (path<TAB>move<TAB>FEN)")
+
+    report = {'num_cells': len(samples), 'decoder': args.decoder, 'device': DEVICE,
+              # the pipeline only trusts this report for these exact weights
+              'params_sha256': params_digest(args.int8)}
+    for name, model_dir, precision in [('fp32', args.fp32, 'fp32'), ('int8', args.int8, 'int8')]:
+        recognizer = PaddleRecognizer(model_dir=model_dir, dict_path=args.dict, device=DEVICE,
+                                      cpu_threads=args.cpu_threads, precision=precision)
+        # warm up so MKLDNN primitive creation is not counted
+        recognizer.recognize_batch([cv2.imread(samples[0][0])])
+        report[name] = evaluate_model(recognizer, samples, args.batch_size, args.decoder)
+        print(f"  {name}: accuracy {report[name]['accuracy'] * 100:.2f}%, {report[name]['ms_per_cell']:.2f} ms/cell")
+
+    report['accuracy_delta'] = report['fp32']['accuracy'] - report['int8']['accuracy']
+    report['speedup'] = report['fp32']['ms_per_cell'] / report['int8']['ms_per_cell']
+    print(f"  accuracy drop: {report['accuracy_delta'] * 100:.2f} pts, speedup: {report['speedup']:.2f}x")
+
+    report_path = os.path.join(args.int8, QUANT_REPORT_NAME)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved: {report_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    cal = sub.add_parser('calibrate', help='post-training quantization from a folder of cell crops')
+    cal.add_argument('--crops', required=True, help='folder of cell crop images')
+    cal.add_argument('--model-dir', default=FP32_MODEL)
+    cal.add_argument('--output', required=True, help='output folder for the INT8 model')
+    cal.add_argument('--dict', default=DICT_PATH)
+    cal.add_argument('--batch-size', type=int, default=16)
+    cal.add_argument('--batch-nums', type=int, default=20)
+    cal.add_argument('--algo', default='hist', help='PaddleSlim calibration algorithm (hist, KL, avg, mse)')
+    cal.set_defaults(func=calibrate)
+
+    ev = sub.add_parser('evaluate', help='FP32 vs INT8 accuracy/latency report')
+    ev.add_argument('--labels', required=True, help='label file, "path<TAB>move" per line')
+    ev.add_argument('--fp32', default=FP32_MODEL)
+    ev.add_argument('--int8', required=True)
+    ev.add_argument('--dict', default=DICT_PATH)
+    ev.add_argument('--decoder', choices=('lexicon', 'beam'), default=MOVE_DECODER,
+                    help='step 6 decoder to measure accuracy with (default: the pipeline\'s MOVE_DECODER)')
+    ev.add_argument('--batch-size', type=int, default=32)
+    ev.add_argument('--cpu-threads', type=int, default=4)
+    ev.set_defaults(func=evaluate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
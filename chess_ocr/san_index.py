@@ -0,0 +1,150 @@
+"""
+Legal SAN index per position
+Matching OCR text to a legal move used to mean calling board.parse_san inside
+try/except for every candidate spelling, plus up to 16 more parses for an
+ambiguous move. A SanIndex is built once per position and maps the ways a move
+gets written on a sheet to the move:
+
+- exact SAN ("Nxf3+")
+- normalized SAN: no check/mate suffix, no capture x or dash before the target
+  square, no = before the promotion piece, 0 for O in castling ("Nf3", "e8Q",
+  "O-O")
+- undisambiguated and over-disambiguated SAN ("Nd2" for Nbd2/Nfd2, "Ng1f3")
+
+Indexes are kept in an LRU keyed by the Zobrist hash of the position and shared
+across requests, the opening positions repeat on nearly every sheet.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+
+# positions kept in the shared index cache
+SAN_INDEX_CACHE_SIZE = 4096
+
+_SUFFIX = re.compile(r'[+#!?]+$')
+_CASTLING = re.compile(r'^[O0o]-?[O0o](-?[O0o])?$')
+# the SAN shape parse_san accepts: x or - only right before the target square,
+# = only right before the promotion piece
+_MOVE = re.compile(r'^([NBRQK]?[a-h]?[1-8]?)[-x]?([a-h][1-8])(?:=?([nbrqNBRQ]))?$')
+
+
+def normalize_san(text):
+    """Normalized spelling of a SAN string, the key the index is searched with."""
+    text = _SUFFIX.sub('', text.strip())
+    if _CASTLING.match(text):
+        return 'O-O-O' if len(text.replace('-', '')) == 3 else 'O-O'
+    match = _MOVE.match(text)
+    if match is None:
+        # not a move ("Q=d2", "f6x"), kept as is so it matches no legal move
+        return text
+    origin, target, promo = match.groups()
+    # promotion piece after the target square, "e8=q" -> "e8Q"
+    return origin + target + (promo or '').upper()
+
+
+class SanIndex:
+    """Every legal move of one position, searchable by its written forms."""
+
+    def __init__(self, board):
+        self.moves = list(board.legal_moves)
+        self.sans = [board.san(m) for m in self.moves]
+        self.by_san = dict(zip(self.sans, self.moves))
+        self.san_of = dict(zip(self.moves, self.sans))
+        # normalized form -> moves it can stand for, in legal move order
+        self.forms = {}
+        for move, san in zip(self.moves, self.sans):
+            for form in self.move_forms(board, move, san):
+                moves = self.forms.setdefault(form, [])
+                if move not in moves:
+                    moves.append(move)
+        # legal_move_lexicon result for this position, filled in by the pipeline
+        self.lexicon = None
+
+    @staticmethod
+    def move_forms(board, move, san):
+        """Normalized spellings parse_san would accept for this move (when unambiguous)."""
+        forms = {normalize_san(san)}
+        piece = board.piece_type_at(move.from_square)
+        frm = chess.square_name(move.from_square)
+        to = chess.square_name(move.to_square)
+        promo = chess.piece_symbol(move.promotion).upper() if move.promotion else ''
+        if piece == chess.PAWN:
+            # pushes may leave out the file, captures may not
+            froms = [frm[0], frm[0] + frm[1]]
+            if frm[0] == to[0]:
+                froms += ['', frm[1]]
+        else:
+            letter = chess.piece_symbol(piece).upper()
+            froms = [letter + frm, frm]
+            # castling is written O-O or with both squares, never "Kg1"
+            if not board.is_castling(move):
+                froms += [letter, letter + frm[0], letter + frm[1]]
+        forms.update(f + to + promo for f in froms)
+        return forms
+
+    def lookup(self, text, disambiguate=False):
+        """Legal move written as text, or None.
+
+        An ambiguous spelling ("Nd2" with two knights) returns None, unless
+        disambiguate is set: then the first move that a file (a-h), then a
+        rank (1-8) disambiguation makes unique is returned.
+        """
+        if not text:
+            return None
+        move = self.by_san.get(text)
+        if move is not None:
+            return move
+        moves = self.forms.get(normalize_san(text))
+        if not moves:
+            return None
+        if len(moves) == 1:
+            return moves[0]
+        if not disambiguate:
+            return None
+        for key in (chess.square_file, chess.square_rank):
+            for value in range(8):
+                hits = [m for m in moves if key(m.from_square) == value]
+                if len(hits) == 1:
+                    return hits[0]
+        return None
+
+
+class SanIndexCache:
+    """Bounded, thread-safe LRU of SanIndex objects keyed by Zobrist hash."""
+
+    def __init__(self, maxsize=SAN_INDEX_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board):
+        key = chess.polyglot.zobrist_hash(board)
+        with self.lock:
+            index = self.entries.get(key)
+            if index is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return index
+            self.misses += 1
+        # built outside the lock, two requests racing on a new position both build it
+        index = SanIndex(board)
+        with self.lock:
+            self.entries[key] = index
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return index
+
+
+_cache = SanIndexCache()
+
+
+def san_index(board):
+    """SanIndex of the board's position, from the shared cache."""
+    return _cache.get(board)
@@ -11,75 +11,295 @@ These are the steps for the scoresheet OCR pipeline
 """
 
 import os
+import json
+import hashlib
 import cv2
 import numpy as np
 import time
+import queue
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from ultralytics import YOLO
-from paddleocr import PaddleOCR
-import pytesseract
-import paddle
-from paddle import inference
 import chess
-from scipy.optimize import linear_sum_assignment
-
-paddle.set_device('gpu:0')
+import chess.polyglot
+from ctc_decode import ctc_prefix_beam_search, ctc_word_log_likelihoods, greedy_decode
+from templates import TemplateRegistry
+from box_table import make_boxes, make_numbers, box_dict, number_dicts, gap_groups
+from san_index import san_index
 
 #True means use PaddleOCR while False will give Tesseract
 USE_PADDLE_FOR_NUMBERS = True
 
+#'lexicon' scores the legal moves of the current position directly on the CTC
+#posteriors, 'beam' decodes free text with beam search and then parses it
+MOVE_DECODER = 'lexicon'
+#log p(best legal move) - log p(best CTC path) below this means no legal move
+#fits the cell (empty cell, illegal move on the sheet, or an earlier misread)
+LEXICON_MIN_FIT = -15.0
+
+#step 6 reads move cells this many rows at a time and stops once the game has
+#ended (0 reads every cell in one go)
+OCR_CHUNK_ROWS = 10
+
+#step 6 keeps this many move sequences across rows instead of committing to the
+#first legal reading of each cell, expanding each hypothesis with its
+#GAME_SEARCH_MOVES best legal moves per cell. 1 is the greedy validator, each
+#extra hypothesis costs about as much search time again as the greedy pass
+GAME_SEARCH_BEAM = 1
+GAME_SEARCH_MOVES = 3
+#per-request budgets of the search, once either is spent the remaining cells are
+#resolved greedily from the best hypothesis. Scoring a position costs about 3 ms
+#on CPU (measured at beam 2-4 on 40-row sheets), so the positions budget is about
+#the time budget and normally runs out first, which keeps the moves repeatable;
+#the time budget caps latency on a slower or loaded host
+GAME_SEARCH_TIME_BUDGET = 0.5
+GAME_SEARCH_MAX_SCORED = 150
+
+#written next to a quantized model by quantize_recognizer.py evaluate
+QUANT_REPORT_NAME = 'quant_report.json'
+
+#number cells are read with a recognition-only model and scored against "1".."60"
+NUMBER_LEXICON = [str(n) for n in range(1, 61)]
+#same idea as LEXICON_MIN_FIT, below this the crop doesn't look like a move number
+NUMBER_MIN_FIT = -10.0
+
+#'hungarian' matches each number column's white/black slots to move boxes with one
+#optimal assignment, 'heuristic' picks the closest box per number and lane greedily
+ASSOCIATION = 'hungarian'
+#assignment cost = |dy| / row spacing + ASSOC_LANE_WEIGHT * (box not in the slot's lane)
+#                  + ASSOC_CONF_WEIGHT * (1 - YOLO confidence)
+ASSOC_LANE_WEIGHT = 0.5
+ASSOC_CONF_WEIGHT = 0.2
+
+#'ocr' reads every number cell, 'geometry' numbers rows from the move box grid and
+#only reads GEOMETRY_SAMPLE_CELLS number cells to confirm the first number of each
+#column block (falls back to 'ocr' when the grid is irregular or the reads disagree)
+NUMBER_MODE = 'ocr'
+GEOMETRY_SAMPLE_CELLS = 6
+#row gaps must be a whole number of row spacings, within this fraction of a spacing
+GEOMETRY_MAX_ROW_RESIDUAL = 0.2
+
+#YOLO runs on the photo downscaled to at most this many pixels on the longest side
+DETECT_MAX_SIDE = 1280
+#page zoom is picked so the median move cell is about this tall (what zoom=2 gave
+#on typical uploads), clipped to [MIN_ZOOM, MAX_ZOOM]
+TARGET_CELL_HEIGHT = 40
+MIN_ZOOM = 1.0
+MAX_ZOOM = 4.0
+
+#warmup() renders a sheet in this layout with a random game of this many plies
+WARMUP_LAYOUT = 4
+WARMUP_PLIES = 80
+
+#index of known scoresheet designs, a matching sheet skips steps 3-5
+TEMPLATE_PATH = 'data/templates.npz'
+#a sheet is learned as a template once at least this many plies replay as a legal game
+TEMPLATE_MIN_LEGAL_PLIES = 20
+
+
+class PageImage:
+    """Original photo plus the affine transform into pipeline (zoomed, deskewed) coordinates.
+    
+    The full page is never materialized, regions are sampled from the original
+    pixels with one warpAffine each, at whatever output size the caller needs.
+    """
+    
+    def __init__(self, img, matrix=None, size=None):
+        self.img = img
+        self.matrix = np.eye(3) if matrix is None else matrix
+        w, h = size if size is not None else (img.shape[1], img.shape[0])
+        self.shape = (h, w) + img.shape[2:]
+    
+    # page with an extra 2x3 transform applied after this one, size is (w, h)
+    def warp(self, matrix, size):
+        return PageImage(self.img, np.vstack([matrix, [0, 0, 1]]) @ self.matrix, size)
+    
+    def sample(self, region, out_size=None):
+        """Pixels of page region (x1, y1, x2, y2), resized to out_size (w, h)."""
+        x1, y1, x2, y2 = region
+        out_w, out_h = out_size if out_size is not None else (int(x2 - x1), int(y2 - y1))
+        sx, sy = out_w / (x2 - x1), out_h / (y2 - y1)
+        to_out = np.array([[sx, 0, -x1 * sx], [0, sy, -y1 * sy], [0, 0, 1]])
+        matrix = (to_out @ self.matrix)[:2]
+        
+        # upsampling uses cubic like the old full-page zoom
+        interp = cv2.INTER_CUBIC if abs(np.linalg.det(matrix[:, :2])) > 1 else cv2.INTER_LINEAR
+        return cv2.warpAffine(self.img, matrix, (out_w, out_h), flags=interp,
+                              borderMode=cv2.BORDER_REPLICATE)
+    
+    # the whole page, scaled by scale (used for detection and visualization)
+    def render(self, scale=1.0):
+        h, w = self.shape[:2]
+        out_size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        m = self.matrix
+        if m[0, 1] == 0 and m[1, 0] == 0 and m[0, 2] == 0 and m[1, 2] == 0:
+            # no rotation, a plain resize of the original is enough
+            if out_size == (self.img.shape[1], self.img.shape[0]):
+                return self.img
+            interp = cv2.INTER_AREA if m[0, 0] * scale < 1 else cv2.INTER_CUBIC
+            return cv2.resize(self.img, out_size, interpolation=interp)
+        return self.sample((0, 0, w, h), out_size)
+
+# model backends are imported when first constructed, so the non-model steps
+# (and fakes.py stand-ins) work without ultralytics, paddle or paddleocr installed
+class YoloDetector:
+    """Cell detector: detect(img) -> (number box table, move box table) in img pixels."""
+    
+    def __init__(self, yolo_path, device='cpu', conf=0.25):
+        from ultralytics import YOLO
+        self.yolo = YOLO(yolo_path)
+        self.device = 'cpu' if device == 'cpu' else int(device.split(':')[1]) if ':' in device else 0
+        self.conf = conf
+        # YOLO keeps per-call state, serialize its use
+        self.lock = threading.Lock()
+    
+    def detect(self, img):
+        with self.lock:
+            results = self.yolo(img, conf=self.conf, verbose=False, device=self.device)
+        
+        det = results[0].boxes
+        xyxy = det.xyxy.cpu().numpy().astype(int).reshape(-1, 4)
+        cls = det.cls.cpu().numpy().astype(int).ravel()
+        boxes = make_boxes(xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3], conf=det.conf.cpu().numpy().ravel())
+        
+        # class 0 is number, the rest are moves
+        return boxes[cls == 0], boxes[cls != 0]
+
+
+# sha256 of a model's weights file, ties a quant_report.json to the weights it measured
+def params_digest(model_dir):
+    digest = hashlib.sha256()
+    with open(os.path.join(model_dir, 'inference.pdiparams'), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_charset(dict_path, use_space_char=False):
+    """Recognizer classes: blank at index 0, then the dictionary (plus a space class)."""
+    with open(dict_path, 'r') as f:
+        chars = [''] + [line.strip() for line in f.readlines()]
+    if use_space_char:
+        # PP-OCR English models have an extra space class after the dictionary
+        chars.append(' ')
+    return chars
+
+
 #Fine tuned Paddle OCR model using HCS
+# recognizer interface (also implemented by fakes.FakeRecognizer): chars, char_index,
+# recognize, beam_search_recognize, recognize_regions, take_stats
 class PaddleRecognizer:
     
     def __init__(self, 
                  model_dir='PaddleOCR/output/chess_scoresheet/inference',
-                 dict_path='data/chess_dict_full.txt'):
+                 dict_path='data/chess_dict_full.txt',
+                 device='cpu', cpu_threads=4, use_mkldnn=True, ir_optim=True,
+                 pool_size=1, precision='fp32', use_space_char=False):
+        
+        from paddle import inference
         
         # Load character dictionary
-        with open(dict_path, 'r') as f:
-            self.chars = [line.strip() for line in f.readlines()]
-        self.chars = [''] + self.chars  # Add blank at index 0
+        self.chars = load_charset(dict_path, use_space_char)
+        self.char_index = {c: i for i, c in enumerate(self.chars) if c}
         
         # Create predictor
         model_file = os.path.join(model_dir, 'inference.json')
+        if not os.path.exists(model_file):
+            # models exported before paddle 3 use the old program format
+            model_file = os.path.join(model_dir, 'inference.pdmodel')
         params_file = os.path.join(model_dir, 'inference.pdiparams')
         
         config = inference.Config(model_file, params_file)
-        config.enable_use_gpu(500, 0)
+        if device.startswith('gpu'):
+            gpu_id = int(device.split(':')[1]) if ':' in device else 0
+            config.enable_use_gpu(500, gpu_id)
+        else:
+            config.disable_gpu()
+            config.set_cpu_math_library_num_threads(cpu_threads)
+            if use_mkldnn or precision == 'int8':
+                config.enable_mkldnn()
+                # cache primitives for a few input shapes (one per width bucket and batch size)
+                config.set_mkldnn_cache_capacity(10)
+            if precision == 'int8':
+                # model_dir holds a post-training-quantized model (quantize_recognizer.py)
+                config.enable_mkldnn_int8()
+        config.switch_ir_optim(ir_optim)
+        config.enable_memory_optim()
         config.disable_glog_info()
         
-        self.predictor = inference.create_predictor(config)
+        predictor = inference.create_predictor(config)
         
-        self.input_names = self.predictor.get_input_names()
-        self.output_names = self.predictor.get_output_names()
+        self.input_names = predictor.get_input_names()
+        self.output_names = predictor.get_output_names()
         
-        self.img_shape = [3, 48, 320]  
-    
-    def preprocess(self, img):
-        if img is None or img.size == 0:
-            return None
+        # a predictor's input/output handles are not safe to share between threads,
+        # so keep a pool of clones (they share weights) and check one out per run
+        self.predictors = queue.Queue()
+        self.predictors.put(predictor)
+        for _ in range(pool_size - 1):
+            self.predictors.put(predictor.clone())
         
-        if len(img.shape) == 2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        self.img_shape = [3, 48, 320]  
         
-        # Resize maintaining aspect ratio
-        h, w = img.shape[:2]
-        ratio = self.img_shape[1] / h
-        new_w = int(w * ratio)
-        if new_w > self.img_shape[2]:
-            new_w = self.img_shape[2]
+        # batched recognition pads each crop to the smallest bucket that fits it
+        # (last bucket is the full training width), max_batch_size caps one run()
+        self.width_buckets = [192, 256, 320]
+        self.max_batch_size = 64
+        # batch buffers are per thread since requests share the recognizer
+        self.local = threading.local()
+    
+    # width of a h x w region after resizing to model height, capped at model width
+    def resized_width(self, h, w):
+        new_w = int(w * self.img_shape[1] / h)
+        return max(1, min(new_w, self.img_shape[2]))
+    
+    # per-thread float32 batch buffer of shape (n, 3, 48, width), reused across calls
+    def batch_buffer(self, n, width):
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        buf = buffers.get(width)
+        if buf is None or buf.shape[0] < n:
+            buf = buffers[width] = np.empty((max(n, self.max_batch_size), self.img_shape[0], self.img_shape[1], width), dtype=np.float32)
+        return buf[:n]
+    
+    def fill_slot(self, slot, img, region):
+        """Resize one region of img straight into a (3, 48, width) batch slot.
         
-        resized = cv2.resize(img, (new_w, self.img_shape[1]))
+        The region is resized once to model height (keeping aspect ratio),
+        normalized to [-1, 1] and written as CHW; the rest of the slot is
+        white padding (1.0) to match training data.
+        """
+        x1, y1, x2, y2 = region
+        out_h = self.img_shape[1]
+        new_w = min(self.resized_width(y2 - y1, x2 - x1), slot.shape[2])
         
-        # pad to target width with white (255) to match training data
-        padded = np.ones((self.img_shape[1], self.img_shape[2], 3), dtype=np.float32) * 255
-        padded[:, :new_w, :] = resized
+        if isinstance(img, PageImage):
+            # page zoom/deskew and the resize to model input are one warp
+            resized = img.sample(region, (new_w, out_h))
+        else:
+            interp = cv2.INTER_AREA if (y2 - y1) > out_h else cv2.INTER_LINEAR
+            resized = cv2.resize(img[y1:y2, x1:x2], (new_w, out_h), interpolation=interp)
+        if resized.ndim == 2:
+            resized = cv2.cvtColor(resized, cv2.COLOR_GRAY2BGR)
+        
+        # (x / 255 - 0.5) / 0.5 == x * 2/255 - 1
+        view = slot[:, :, :new_w]
+        np.multiply(resized.transpose(2, 0, 1), 2.0 / 255.0, out=view, casting='unsafe')
+        view -= 1.0
+        slot[:, :, new_w:] = 1.0
+    
+    def preprocess(self, img, pad_width=None):
+        if img is None or img.size == 0:
+            return None
         
-        padded = padded.astype(np.float32) / 255.0
-        padded = (padded - 0.5) / 0.5
-        padded = padded.transpose((2, 0, 1))  
+        if pad_width is None:
+            pad_width = self.img_shape[2]
         
-        return padded[np.newaxis, :, :, :]  
+        batch = np.empty((1, self.img_shape[0], self.img_shape[1], pad_width), dtype=np.float32)
+        self.fill_slot(batch[0], img, (0, 0, img.shape[1], img.shape[0]))
+        return batch
 
     #decode the ctc to text    
     def decode(self, preds):
@@ -94,21 +314,40 @@ class PaddleRecognizer:
         
         return ''.join(chars)
     
+    # per-thread counters since the last call ({'queue_wait': seconds waited for a
+    # predictor, 'batches': predictor runs}), reset on read
+    def take_stats(self):
+        stats = getattr(self.local, 'stats', None) or {'queue_wait': 0.0, 'batches': 0}
+        self.local.stats = {'queue_wait': 0.0, 'batches': 0}
+        return stats
+    
+    # run the predictor on a NCHW batch, returns (N, time_steps, num_classes) posteriors
+    def run_batch(self, input_data):
+        t0 = time.perf_counter()
+        predictor = self.predictors.get()
+        stats = getattr(self.local, 'stats', None)
+        if stats is None:
+            stats = self.local.stats = {'queue_wait': 0.0, 'batches': 0}
+        stats['queue_wait'] += time.perf_counter() - t0
+        stats['batches'] += 1
+        try:
+            input_handle = predictor.get_input_handle(self.input_names[0])
+            input_handle.reshape(input_data.shape)
+            input_handle.copy_from_cpu(np.ascontiguousarray(input_data))
+            
+            predictor.run()
+            
+            output_handle = predictor.get_output_handle(self.output_names[0])
+            return output_handle.copy_to_cpu()
+        finally:
+            self.predictors.put(predictor)
+    
     def recognize(self, img):
         input_data = self.preprocess(img)
         if input_data is None:
             return '', 0.0
         
-        # Set input
-        input_handle = self.predictor.get_input_handle(self.input_names[0])
-        input_handle.reshape(input_data.shape)
-        input_handle.copy_from_cpu(input_data)
-        
-        # inference
-        self.predictor.run()
-        
-        output_handle = self.predictor.get_output_handle(self.output_names[0])
-        output = output_handle.copy_to_cpu()
+        output = self.run_batch(input_data)
         
         text = self.decode(output)
         
@@ -125,81 +364,446 @@ class PaddleRecognizer:
         if input_data is None:
             return [('', 0.0)]
         
-        input_handle = self.predictor.get_input_handle(self.input_names[0])
-        input_handle.reshape(input_data.shape)
-        input_handle.copy_from_cpu(input_data)
-        self.predictor.run()
-        
-        output_handle = self.predictor.get_output_handle(self.output_names[0])
-        probs = output_handle.copy_to_cpu()[0]  # Shape: (time_steps, num_classes)
-        
-        # beam search using log probs
-        log_probs = np.log(probs + 1e-10)
-        beams = [{'text': '', 'score': 0.0, 'last': -1}]
-        
-        for t in range(log_probs.shape[0]):
-            new_beams = []
-            for beam in beams:
-                for idx in range(len(self.chars)):
-                    lp = log_probs[t, idx]
-                    if idx == 0:  # blank
-                        new_beams.append({'text': beam['text'], 'score': beam['score'] + lp, 'last': idx})
-                    elif idx != beam['last']:
-                        new_beams.append({'text': beam['text'] + self.chars[idx], 'score': beam['score'] + lp, 'last': idx})
-                    else:
-                        new_beams.append({'text': beam['text'], 'score': beam['score'] + lp, 'last': idx})
-            
-            # erge same (text, last), keep best
-            merged = {}
-            for b in new_beams:
-                key = (b['text'], b['last'])
-                if key not in merged or b['score'] > merged[key]:
-                    merged[key] = b['score']
-            
-            beams = [{'text': k[0], 'score': v, 'last': k[1]} for k, v in merged.items()]
-            beams.sort(key=lambda x: -x['score'])
-            beams = beams[:beam_width]
-        
-        # Get unique texts with best scores
-        unique = {}
-        for b in beams:
-            if b['text'] not in unique or b['score'] > unique[b['text']]:
-                unique[b['text']] = b['score']
-        
-        # onvert log probs to normalized probs
-        results = [(text, np.exp(score)) for text, score in sorted(unique.items(), key=lambda x: -x[1])[:top_k]]
-        total = sum(p for _, p in results)
-        if total > 0:
-            results = [(t, p/total) for t, p in results]
+        probs = self.run_batch(input_data)[0, :, :len(self.chars)]  # Shape: (time_steps, num_classes)
+        return self.beam_search_decode(probs, beam_width=beam_width, top_k=top_k)
+    
+    #CTC prefix beam search over one posterior matrix, returns top-K (text, prob)
+    def beam_search_decode(self, probs, beam_width=20, top_k=5):
+        return ctc_prefix_beam_search(probs, self.chars, beam_width=beam_width, top_k=top_k)
+    
+    def recognize_batch(self, crops, beam_width=20, top_k=5, decode=True):
+        """Recognize many crops with one predictor run per width bucket.
+        
+        Same as recognize_regions, with each crop taken whole.
+        """
+        sources = [(crop, (0, 0, crop.shape[1], crop.shape[0])) if crop is not None else None for crop in crops]
+        return self.recognize_sources(sources, beam_width=beam_width, top_k=top_k, decode=decode)
+    
+    def recognize_regions(self, img, regions, beam_width=20, top_k=5, decode=True):
+        """Recognize (x1, y1, x2, y2) regions of one page image, without cropping copies.
+        
+        Each region is resized once, straight into its slot of a reused batch
+        buffer, see fill_slot.
+        """
+        return self.recognize_sources([(img, r) for r in regions], beam_width=beam_width, top_k=top_k, decode=decode)
+    
+    def recognize_sources(self, sources, beam_width=20, top_k=5, decode=True):
+        """Batched recognition of (img, region) sources.
+        
+        Sources are grouped by their resized width, padded to the bucket width
+        and stacked into NCHW batches (at most max_batch_size per run).
+        
+        Returns:
+            list of (probs, candidates) in input order, where probs is the
+            (time_steps, num_classes) CTC posterior matrix (None for empty
+            regions) and candidates is the top-K [(text, prob)] list, or None
+            when decode is False
+        """
+        results = [(None, [('', 0.0)]) for _ in sources]
+        
+        clipped = {}
+        buckets = {}
+        for i, source in enumerate(sources):
+            if source is None:
+                continue
+            img, (x1, y1, x2, y2) = source
+            h_img, w_img = img.shape[:2]
+            x1, y1, x2, y2 = max(0, int(x1)), max(0, int(y1)), min(w_img, int(x2)), min(h_img, int(y2))
+            if x2 <= x1 or y2 <= y1:
+                continue
+            clipped[i] = (img, (x1, y1, x2, y2))
+            new_w = self.resized_width(y2 - y1, x2 - x1)
+            width = next(b for b in self.width_buckets if b >= new_w)
+            buckets.setdefault(width, []).append(i)
+        
+        for width, idxs in sorted(buckets.items()):
+            for start in range(0, len(idxs), self.max_batch_size):
+                chunk = idxs[start:start + self.max_batch_size]
+                batch = self.batch_buffer(len(chunk), width)
+                for slot, i in zip(batch, chunk):
+                    self.fill_slot(slot, *clipped[i])
+                # drop any output classes beyond the dictionary (e.g. a trailing space class)
+                output = self.run_batch(batch)[:, :, :len(self.chars)]
+                for probs, i in zip(output, chunk):
+                    candidates = self.beam_search_decode(probs, beam_width=beam_width, top_k=top_k) if decode else None
+                    results[i] = (probs, candidates)
         
         return results
 
 
+class MoveValidator:
+    """Board replay state for step 6, fed one row at a time in move order.
+    
+    add_row returns a copy of the row with the validated texts and candidates
+    (also kept in self.rows), once the game has ended (max_consecutive_invalid
+    zero-confidence black moves in a row) every further row gets empty texts.
+    """
+    
+    def __init__(self, pipeline, corrections=None, min_fit=LEXICON_MIN_FIT, max_consecutive_invalid=2):
+        self.pipeline = pipeline
+        self.corrections = corrections or {}
+        self.min_fit = min_fit
+        self.max_consecutive_invalid = max_consecutive_invalid
+        self.board = chess.Board()
+        # check number of consecnutivey invalid notations
+        self.consecutive_invalid = 0
+        self.rows = {}
+    
+    @property
+    def ended(self):
+        return self.consecutive_invalid >= self.max_consecutive_invalid
+    
+    def add_row(self, num, row):
+        row = dict(row)
+        
+        # game has ended, remaining rows are cleared
+        self.rows[num] = row
+        if self.ended:
+            row['white_text'] = ''
+            row['black_text'] = ''
+            return row
+        
+        conf = {'white': 0.0, 'black': 0.0}
+        
+        # validate white move, then black move
+        for ctype in ('white', 'black'):
+            if (num, ctype) in self.corrections:
+                best_text, candidates, conf[ctype] = self.pipeline.apply_correction(self.board, self.corrections[(num, ctype)])
+            elif row.get(f'{ctype}_box'):
+                ocr = row.get(f'{ctype}_ocr') or {'probs': None, 'candidates': [('', 0.0)]}
+                best_text, candidates, conf[ctype] = self.pipeline.resolve_move(
+                    self.board, ocr['probs'], ocr['candidates'], self.min_fit)
+            else:
+                continue
+            row[f'{ctype}_text'] = best_text
+            row[f'{ctype}_candidates'] = candidates[:5]
+        
+        # Stop after 2 consecutive zero-confidence black moves (indicates game ended)
+        if conf['black'] == 0.0:
+            self.consecutive_invalid += 1
+        else:
+            self.consecutive_invalid = 0  # Reset if we see any black move with confidence
+        return row
+
+
+class GameSearch:
+    """Game-level beam search for step 6, a drop-in for MoveValidator (lexicon decoder).
+    
+    Keeps the beam_width best move sequences (board, cumulative score) across rows
+    instead of committing to the first legal reading of each cell, so one misread
+    early move no longer makes every later move illegal. A legal move adds
+    log p(move) - log p(best CTC path) to the score, keeping the free-form reading
+    (board unchanged) adds min_fit, the same trade-off the greedy validator makes
+    per cell. Hypotheses that reach the same position are merged and a position's
+    move scores are computed once per cell (legal moves come from the shared
+    SanIndex cache). Once max_scored positions have been scored or time_budget
+    seconds of search spent (None: no time limit), the remaining cells are
+    resolved greedily.
+    
+    The texts of a row are only final once every row has been added, read them
+    from self.rows.
+    """
+    
+    def __init__(self, pipeline, corrections=None, min_fit=LEXICON_MIN_FIT, max_consecutive_invalid=2,
+                 beam_width=GAME_SEARCH_BEAM, moves_per_cell=GAME_SEARCH_MOVES,
+                 time_budget=GAME_SEARCH_TIME_BUDGET, max_scored=GAME_SEARCH_MAX_SCORED):
+        self.pipeline = pipeline
+        self.corrections = corrections or {}
+        self.min_fit = min_fit
+        self.max_consecutive_invalid = max_consecutive_invalid
+        self.beam_width = beam_width
+        self.moves_per_cell = moves_per_cell
+        self.time_budget = time_budget
+        self.max_scored = max_scored
+        # hypotheses: (score, board, zobrist key, consecutive invalid, path), best first
+        # path is a linked list (parent, (num, ctype), text, candidates) of choices
+        board = chess.Board()
+        self.beam = [(0.0, board, chess.polyglot.zobrist_hash(board), 0, None)]
+        self.inputs = {}
+        self.cleared = set()
+        self.elapsed = 0.0
+        self.scored = 0
+    
+    @property
+    def ended(self):
+        return self.beam[0][3] >= self.max_consecutive_invalid
+    
+    @property
+    def exhausted(self):
+        if self.time_budget is not None and self.elapsed >= self.time_budget:
+            return True
+        return self.scored >= self.max_scored
+    
+    def add_row(self, num, row):
+        self.inputs[num] = row
+        if self.ended:
+            self.cleared.add(num)
+            return
+        t0 = time.perf_counter()
+        for ctype in ('white', 'black'):
+            if (num, ctype) in self.corrections:
+                options = self.correction_options(num, ctype)
+            elif row.get(f'{ctype}_box'):
+                ocr = row.get(f'{ctype}_ocr') or {'probs': None}
+                options = self.cell_options(num, ctype, ocr['probs'])
+            elif ctype == 'black':
+                # no black cell counts as a zero-confidence black move
+                self.beam = [(score, board, key, invalid + 1, path) for score, board, key, invalid, path in self.beam]
+                continue
+            else:
+                continue
+            self.beam = self.advance(options)
+        self.elapsed += time.perf_counter() - t0
+    
+    # expand every hypothesis, merge transpositions and keep the best
+    def advance(self, options):
+        width = 1 if self.exhausted else self.beam_width
+        expanded = [child for hyp in self.beam for child in options(hyp)]
+        expanded.sort(key=lambda h: -h[0])
+        beam, seen = [], set()
+        for hyp in expanded:
+            if (hyp[2], hyp[3]) in seen:
+                continue
+            seen.add((hyp[2], hyp[3]))
+            beam.append(hyp)
+            if len(beam) == width:
+                break
+        return beam
+    
+    # hypothesis extended by one cell, board is the new position (None if unchanged)
+    def extend(self, hyp, num, ctype, text, candidates, conf, gain=0.0, board=None):
+        score, old_board, key, invalid, path = hyp
+        if board is None:
+            board = old_board
+        else:
+            key = chess.polyglot.zobrist_hash(board)
+        # Stop after consecutive zero-confidence black moves (indicates game ended)
+        if ctype == 'black':
+            invalid = 0 if conf > 0 else invalid + 1
+        return (score + gain, board, key, invalid, (path, (num, ctype), text, candidates))
+    
+    def correction_options(self, num, ctype):
+        san = self.corrections[(num, ctype)]
+        def options(hyp):
+            board = hyp[1].copy(stack=False)
+            text, candidates, conf = self.pipeline.apply_correction(board, san)
+            return [self.extend(hyp, num, ctype, text, candidates, conf, board=board)]
+        return options
+    
+    def cell_options(self, num, ctype, probs):
+        # the best path is all blanks (or nothing was read), the cell is empty
+        raw_text = greedy_decode(probs, self.pipeline.move_ocr.chars)[0] if probs is not None else ''
+        if not raw_text:
+            return lambda hyp: [self.extend(hyp, num, ctype, '', [('', 0.0)], 0.0)]
+        
+        # free-form reading kept when no legal move fits, same confidence as resolve_move_lexicon
+        max_probs = probs.max(axis=1)
+        raw_conf = float(np.mean(max_probs[max_probs > 0.1])) if len(max_probs[max_probs > 0.1]) > 0 else 0.0
+        moves_per_cell = 1 if self.exhausted else self.moves_per_cell
+        # transposition cache for this cell: position key -> (ranked moves, fits)
+        cache = {}
+        
+        def options(hyp):
+            board, key = hyp[1], hyp[2]
+            out = [self.extend(hyp, num, ctype, raw_text, [(raw_text, raw_conf)], raw_conf, gain=self.min_fit)]
+            if key not in cache:
+                self.scored += 1
+                cache[key] = self.pipeline.rank_legal_moves(board, probs)
+            ranked, fits = cache[key]
+            index = san_index(board)
+            for (san, prob), fit in zip(ranked[:moves_per_cell], fits):
+                if fit < self.min_fit:
+                    break
+                child = board.copy(stack=False)
+                child.push(index.by_san[san])
+                out.append(self.extend(hyp, num, ctype, san, ranked[:10], prob, gain=float(fit), board=child))
+            return out
+        return options
+    
+    @property
+    def rows(self):
+        choices = {}
+        path = self.beam[0][4]
+        while path is not None:
+            path, (num, ctype), text, candidates = path
+            choices[(num, ctype)] = (text, candidates)
+        rows = {}
+        for num, row in self.inputs.items():
+            row = dict(row)
+            if num in self.cleared:
+                row['white_text'] = ''
+                row['black_text'] = ''
+            for ctype in ('white', 'black'):
+                if (num, ctype) in choices:
+                    text, candidates = choices[(num, ctype)]
+                    row[f'{ctype}_text'] = text
+                    row[f'{ctype}_candidates'] = candidates[:5]
+            rows[num] = row
+        return rows
+
+
 class ScoresheetPipeline:
     def __init__(self, yolo_path='runs/detect/multiclass_v15_hpad40/weights/best.pt',
                  finetuned_ocr_path='PaddleOCR/output/chess_black_only/inference',
-                 dict_path='data/chess_dict_full.txt'):
-        self.yolo = YOLO(yolo_path)
-        # Pretrained OCR for number detection
-        self.ocr = PaddleOCR(lang='en')
-        # Fine-tuned OCR for chess move recognition
-        self.move_ocr = PaddleRecognizer(model_dir=finetuned_ocr_path, dict_path=dict_path)
+                 dict_path='data/chess_dict_full.txt',
+                 device='cpu', cpu_threads=4, use_mkldnn=True, pool_size=1,
+                 move_ocr_precision='fp32', quantized_ocr_path=None, max_int8_accuracy_drop=0.01,
+                 redetect_angle=5.0,
+                 number_ocr_path='PaddleOCR/inference/en_PP-OCRv4_rec',
+                 number_dict_path='PaddleOCR/ppocr/utils/en_dict.txt',
+                 template_path=TEMPLATE_PATH, learn_templates=True,
+                 search_beam=GAME_SEARCH_BEAM, search_time_budget=GAME_SEARCH_TIME_BUDGET,
+                 search_max_scored=GAME_SEARCH_MAX_SCORED,
+                 detector=None, move_recognizer=None, number_recognizer=None):
+        # detector / move_recognizer / number_recognizer replace the model backends
+        # (e.g. with fakes.FakeDetector / fakes.FakeRecognizer), only missing ones are loaded
+        if move_recognizer is None or (number_recognizer is None and os.path.isdir(number_ocr_path)):
+            import paddle
+            # device is 'cpu' or 'gpu:N'
+            paddle.set_device(device)
+        self.detector = detector if detector is not None else YoloDetector(yolo_path, device)
+        # Pretrained OCR for number detection, the full detection+recognition pipelines
+        # are only built when first needed, up to pool_size of them (see pooled_ocr)
+        self.ocr_args = {'lang': 'en', 'device': device, 'enable_mkldnn': use_mkldnn, 'cpu_threads': cpu_threads}
+        self.ocr_pool = queue.Queue()
+        self.ocr_pool_size = pool_size
+        self.ocr_created = 0
+        # Pretrained recognition-only model for YOLO number cells (no text detection),
+        # falls back to the full PaddleOCR pipeline if the model isn't there
+        self.number_ocr = number_recognizer
+        if self.number_ocr is None and os.path.isdir(number_ocr_path):
+            self.number_ocr = PaddleRecognizer(model_dir=number_ocr_path, dict_path=number_dict_path,
+                                               device=device, cpu_threads=cpu_threads,
+                                               use_mkldnn=use_mkldnn, pool_size=pool_size,
+                                               use_space_char=True)
+        elif self.number_ocr is None:
+            print(f"  No number recognition model at {number_ocr_path}, using PaddleOCR detection+recognition")
+        # Fine-tuned OCR for chess move recognition, pool_size predictors so
+        # pool_size requests can recognize cells at the same time
+        self.move_ocr = move_recognizer
+        if self.move_ocr is None:
+            ocr_path, precision = finetuned_ocr_path, 'fp32'
+            if move_ocr_precision == 'int8':
+                if self.check_quantized_model(quantized_ocr_path, max_int8_accuracy_drop, device):
+                    ocr_path, precision = quantized_ocr_path, 'int8'
+            self.move_ocr = PaddleRecognizer(model_dir=ocr_path, dict_path=dict_path,
+                                             device=device, cpu_threads=cpu_threads,
+                                             use_mkldnn=use_mkldnn, pool_size=pool_size,
+                                             precision=precision)
+        # deskew angles (degrees) above this re-run YOLO instead of mapping the boxes
+        self.redetect_angle = redetect_angle
+        # known scoresheet layouts (None disables template matching)
+        self.templates = TemplateRegistry(template_path) if template_path else None
+        self.learn_templates = learn_templates
+        # step 6 game search, search_beam=1 validates greedily
+        self.search_beam = search_beam
+        self.search_time_budget = search_time_budget
+        self.search_max_scored = search_max_scored
+        self.ocr_init_lock = threading.Lock()
         print("done loading")
     
-    def process(self, img_path, zoom=2):
+    # a PaddleOCR pipeline keeps per-call state, so each one is used by one thread at a
+    # time: check one out of the pool, building a new one while fewer than pool_size exist
+    @contextlib.contextmanager
+    def pooled_ocr(self):
+        try:
+            ocr = self.ocr_pool.get_nowait()
+        except queue.Empty:
+            with self.ocr_init_lock:
+                create = self.ocr_created < self.ocr_pool_size
+                if create:
+                    self.ocr_created += 1
+            if create:
+                try:
+                    from paddleocr import PaddleOCR
+                    ocr = PaddleOCR(**self.ocr_args)
+                except Exception:
+                    with self.ocr_init_lock:
+                        self.ocr_created -= 1
+                    raise
+            else:
+                ocr = self.ocr_pool.get()
+        try:
+            yield ocr
+        finally:
+            self.ocr_pool.put(ocr)
+    
+    def warmup(self, full=False):
+        """Run a synthetic scoresheet through every stage before serving requests.
+        
+        The first inference of each predictor builds its kernels and MKLDNN primitives,
+        this pays for that up front. full=True also builds and runs the PaddleOCR
+        detection+recognition pipeline that is otherwise only loaded on the first
+        number fallback. Returns the timings of the warmup run.
+        """
+        import tempfile
+        from synth_scoresheet import random_game, write_game
+        
+        rng = np.random.default_rng(0)
+        templates, learn = self.templates, self.learn_templates
+        # no template shortcut (steps 3-5 must run) and the synthetic sheet is never learned
+        self.templates, self.learn_templates = None, False
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                truth = write_game(tmp, 'warmup', rng, random_game(rng, WARMUP_PLIES), WARMUP_LAYOUT)
+                img_path = os.path.join(tmp, truth['image'])
+                _, page, timings = self.process(img_path)
+                if full or self.number_ocr is None:
+                    regions = [c['box'] for c in truth['cells'] if c['kind'] == 'number'][:5]
+                    with self.pooled_ocr() as ocr:
+                        ocr.predict([page.img[y1:y2, x1:x2] for x1, y1, x2, y2 in regions])
+        finally:
+            self.templates, self.learn_templates = templates, learn
+        return timings
+    
+    # only use the INT8 move model if its evaluation report shows a small enough accuracy drop
+    def check_quantized_model(self, model_dir, max_accuracy_drop, device='cpu'):
+        # calibration targets the MKLDNN int8 kernels, on GPU the model has none of them
+        if device != 'cpu':
+            print(f"  INT8 move model refused: it is CPU only, device is {device}, using FP32")
+            return False
+        report_path = os.path.join(model_dir or '', QUANT_REPORT_NAME)
+        if not model_dir or not os.path.exists(report_path) or \
+                not os.path.exists(os.path.join(model_dir, 'inference.pdiparams')):
+            print(f"  INT8 move model refused: no {QUANT_REPORT_NAME} in {model_dir}, using FP32")
+            return False
+        
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+        # a report from an earlier calibration or another decoder says nothing about this model
+        if report.get('params_sha256') != params_digest(model_dir):
+            print(f"  INT8 move model refused: {QUANT_REPORT_NAME} is for other weights, re-run evaluate, using FP32")
+            return False
+        if report.get('device') != device:
+            print(f"  INT8 move model refused: evaluated on {report.get('device')}, not {device}, using FP32")
+            return False
+        if report.get('decoder') != MOVE_DECODER:
+            print(f"  INT8 move model refused: evaluated with the {report.get('decoder')} decoder, "
+                  f"pipeline uses {MOVE_DECODER}, using FP32")
+            return False
+        drop = report['accuracy_delta']
+        if drop > max_accuracy_drop:
+            print(f"  INT8 move model refused: accuracy drop {drop:.3f} > {max_accuracy_drop:.3f}, using FP32")
+            return False
+        
+        print(f"  Using INT8 move model (accuracy drop {drop:.3f}, "
+              f"{report['fp32']['ms_per_cell']:.2f} -> {report['int8']['ms_per_cell']:.2f} ms/cell)")
+        return True
+    
+    # record_dir: save the step 5 inputs and rows as a JSON fixture for benchmarks/bench_association.py
+    def process(self, img_path, zoom=None, record_dir=None):
         timings = {}
         starttime = time.time()
+        # predictor pool waits of this request (recognizer stats are per thread)
+        recognizers = [r for r in (self.move_ocr, self.number_ocr) if r is not None]
+        for r in recognizers:
+            r.take_stats()
         
-        # Load image
+        # Load image, it stays at original resolution. Zoom and deskew are composed
+        # into one transform (PageImage) that is only applied when regions are sampled
         pil_img = Image.open(img_path).convert('RGB')
-        img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        h_orig, w_orig = img.shape[:2]
-        
-        if zoom > 1:
-            img = cv2.resize(img, (w_orig * zoom, h_orig * zoom), interpolation=cv2.INTER_CUBIC)
-        
-        h, w = img.shape[:2]
-        print(f"Image: {w_orig}x{h_orig} -> {w}x{h} (zoom={zoom}x)")
+        page = PageImage(cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR))
+        h_orig, w_orig = page.shape[:2]
         
         #Step1: YOLO detection
         print("\n" + "="*60)
@@ -207,8 +811,19 @@ class ScoresheetPipeline:
         print("="*60)
         
         t0 = time.time()
-        num_boxes, move_boxes = self.step1_yolo_detection(img)
+        num_boxes, move_boxes = self.detect_page(page)
+        
+        # zoom from the measured cell height unless the caller fixed it
+        if zoom is None:
+            zoom = self.choose_zoom(move_boxes)
+        zoom_matrix = np.array([[zoom, 0, 0], [0, zoom, 0]], dtype=np.float64)
+        page = page.warp(zoom_matrix, (int(w_orig * zoom), int(h_orig * zoom)))
+        num_boxes = self.transform_boxes(num_boxes, zoom_matrix)
+        move_boxes = self.transform_boxes(move_boxes, zoom_matrix)
         timings['step1_yolo'] = time.time() - t0
+        
+        h, w = page.shape[:2]
+        print(f"  Image: {w_orig}x{h_orig} -> {w}x{h} (zoom={zoom:.2f}x)")
         print(f"  Detected: {len(num_boxes)} number boxes, {len(move_boxes)} move boxes")
         print(f"  Time: {timings['step1_yolo']:.2f}s")
         
@@ -216,50 +831,95 @@ class ScoresheetPipeline:
         print("Step 2: Deskew")
         
         t0 = time.time()
-        img, angle = self.step2_deskew(img, move_boxes)
-        if abs(angle) > 0.1:
+        page, angle, rotation_matrix = self.step2_deskew(page, move_boxes)
+        timings['yolo_redetections'] = 0
+        if rotation_matrix is None:
+            print(f"  Image already straight (angle={angle:.2f}°)")
+        elif abs(angle) > self.redetect_angle:
             print(f"  Rotated image by {angle:.2f}° to straighten")
-            # run YOLO again after deskew to get corrected box positions
-            num_boxes, move_boxes = self.step1_yolo_detection(img)
+            # large rotation, mapped boxes are too loose, run YOLO again on the deskewed image
+            num_boxes, move_boxes = self.detect_page(page)
+            timings['yolo_redetections'] = 1
             print(f" found: {len(num_boxes)} number boxes, {len(move_boxes)} move boxes")
         else:
-            print(f"  Image already straight (angle={angle:.2f}°)")
+            print(f"  Rotated image by {angle:.2f}° to straighten, mapping YOLO boxes")
+            num_boxes = self.transform_boxes(num_boxes, rotation_matrix)
+            move_boxes = self.transform_boxes(move_boxes, rotation_matrix)
         timings['step2_deskew'] = time.time() - t0
         print(f"  Time: {timings['step2_deskew']:.2f}s")
         
+        img = page
         h, w = img.shape[:2]  # Update dimensions after rotation
         
-        #Step 3: NUMBER DETECTION + LAYOUT ===
-        print("\n" + "="*60)
-        print("STEP 3: Number Detection + Column Layout")
-        print("="*60)
-        
-        t0 = time.time()
-        numbers, num_columns, layout = self.step3_number_detection(img, num_boxes, move_boxes, w)
-        timings['step3_numbers'] = time.time() - t0
-        print(f"  Layout: {num_columns} move columns ({layout})")
-        print(f"  Detected: {len(numbers)} numbers")
-        print(f"  Time: {timings['step3_numbers']:.2f}s")
-        
-        #step 4 - number extrapolation
-        print("step 4: number extrapolation")
-        
-        t0 = time.time()
-        numbers = self.step4_extrapolate_numbers(numbers)
-        timings['step4_extrap'] = time.time() - t0
-        print(f"  After extrapolation: {len(numbers)} numbers")
-        print(f"  Time: {timings['step4_extrap']:.2f}s")
-        
-        # step 5 - associate moves
-        print("step 5: associate moves")
-        
-        t0 = time.time()
-        rows = self.step5_associate_moves(numbers, move_boxes)
-        timings['step5_assoc'] = time.time() - t0
-        matched_white = sum(1 for r in rows.values() if r.get('white_box'))
-        matched_black = sum(1 for r in rows.values() if r.get('black_box'))
-        print(f"  Matched: {matched_white} white, {matched_black} black")
-        print(f"  Time: {timings['step5_assoc']:.2f}s")
+        # known sheet design: number anchors and move cells come from the template
+        template_match = None
+        timings['template_hit'] = 0
+        if self.templates is not None:
+            t0 = time.time()
+            template_match = self.templates.match(move_boxes)
+            timings['template_match'] = time.time() - t0
+        
+        if template_match is not None:
+            numbers, rows = template_match
+            timings['template_hit'] = 1
+            timings['step3_numbers'] = timings['step4_extrap'] = timings['step5_assoc'] = 0.0
+            matched_white = sum(1 for r in rows.values() if r['white_box'].get('source') != 'template')
+            matched_black = sum(1 for r in rows.values() if r['black_box'].get('source') != 'template')
+            print("\n" + "="*60)
+            print("STEPS 3-5: skipped, matched a known scoresheet template")
+            print("="*60)
+            print(f"  Rows: {len(rows)}, detected boxes used: {matched_white} white, {matched_black} black")
+            print(f"  Time: {timings['template_match']:.2f}s")
+        else:
+            #Step 3: NUMBER DETECTION + LAYOUT ===
+            print("\n" + "="*60)
+            print("STEP 3: Number Detection + Column Layout")
+            print("="*60)
+            
+            numbers = None
+            timings['geometry_fallback'] = 0
+            if NUMBER_MODE == 'geometry':
+                t0 = time.time()
+                numbers, saved = self.step3_geometry_numbers(img, num_boxes, move_boxes)
+                if numbers is not None:
+                    timings['step3_numbers'] = time.time() - t0
+                    timings['step4_extrap'] = 0.0
+                    timings['saved_step3_est'] = saved
+                    print(f"  Geometry numbering: {len(numbers)} numbers")
+                    print(f"  Time: {timings['step3_numbers']:.2f}s (about {saved:.2f}s of number OCR skipped)")
+                else:
+                    timings['geometry_fallback'] = 1
+            
+            if numbers is None:
+                t0 = time.time()
+                numbers, num_columns, layout = self.step3_number_detection(img, num_boxes, move_boxes, w, timings)
+                timings['step3_numbers'] = time.time() - t0
+                print(f"  Layout: {num_columns} move columns ({layout})")
+                print(f"  Detected: {len(numbers)} numbers")
+                print(f"  Time: {timings['step3_numbers']:.2f}s")
+                
+                #step 4 - number extrapolation
+                print("step 4: number extrapolation")
+                
+                t0 = time.time()
+                numbers = self.step4_extrapolate_numbers(numbers)
+                timings['step4_extrap'] = time.time() - t0
+                print(f"  After extrapolation: {len(numbers)} numbers")
+                print(f"  Time: {timings['step4_extrap']:.2f}s")
+            
+            # step 5 - associate moves
+            print("step 5: associate moves")
+            
+            t0 = time.time()
+            rows = self.step5_associate_moves(numbers, move_boxes)
+            timings['step5_assoc'] = time.time() - t0
+            matched_white = sum(1 for r in rows.values() if r.get('white_box'))
+            matched_black = sum(1 for r in rows.values() if r.get('black_box'))
+            print(f"  Matched: {matched_white} white, {matched_black} black")
+            print(f"  Time: {timings['step5_assoc']:.2f}s")
+            
+            if record_dir:
+                self.record_association(record_dir, img_path, numbers, move_boxes, rows)
         
         #step 6: ocr 
         print("\n" + "="*60)
@@ -267,92 +927,122 @@ class ScoresheetPipeline:
         print("="*60)
         
         t0 = time.time()
-        rows = self.step6_ocr_moves(img, rows)
+        rows = self.step6_ocr_moves(img, rows, timings)
         timings['step6_ocr'] = time.time() - t0
+        timings['ocr_rows_read'] = sum(1 for r in rows.values() if 'white_ocr' in r or 'black_ocr' in r)
+        timings['cells_recognized'] = sum(('white_ocr' in r) + ('black_ocr' in r) for r in rows.values())
         found_white = sum(1 for r in rows.values() if r.get('white_text'))
         found_black = sum(1 for r in rows.values() if r.get('black_text'))
+        print(f"  Read {timings['ocr_rows_read']} of {len(rows)} rows")
         print(f"  Found: {found_white} white, {found_black} black moves")
         print(f"  Time: {timings['step6_ocr']:.2f}s")
         
+        # a sheet that replays as a legal game has a trustworthy layout, remember it
+        if template_match is None and self.templates is not None and self.learn_templates:
+            if self.count_legal_plies(rows) >= TEMPLATE_MIN_LEGAL_PLIES:
+                self.templates.learn(numbers, rows, move_boxes)
+        
         #timing results
         total_time = time.time() - starttime
         print("\n" + "="*60)
         print("timing summary")
         print("="*60)
         for step, t in sorted(timings.items()):
+            if not step.startswith('step'):
+                continue
             pct = (t / total_time) * 100
             print(f"  {step:20s}: {t:6.2f}s ({pct:5.1f}%)")
         print(f"  {'TOTAL':20s}: {total_time:6.2f}s")
-        
-        return rows, img
+        print(f"  YOLO re-detections: {timings['yolo_redetections']}")
+        print(f"  Template hit: {timings['template_hit']}")
+        if 'saved_step3_est' in timings:
+            print(f"  Step 3 OCR skipped (est.): {timings['saved_step3_est']:.2f}s")
+        timings['total'] = total_time
+        timings['queue_wait'] = sum(r.take_stats()['queue_wait'] for r in recognizers)
+        
+        return rows, page, timings
+    
+    # association fixture: step 5 inputs, and the rows it produced as the editable "truth"
+    def record_association(self, record_dir, img_path, numbers, move_boxes, rows):
+        os.makedirs(record_dir, exist_ok=True)
+        def corners(box):
+            return [box['x1'], box['y1'], box['x2'], box['y2']] if box and box.get('source') != 'virtual_fill' else None
+        fixture = {
+            'image': os.path.basename(img_path),
+            'numbers': number_dicts(numbers),
+            'move_boxes': [box_dict(b) for b in move_boxes],
+            'truth': {str(num): {'white': corners(r.get('white_box')), 'black': corners(r.get('black_box'))}
+                      for num, r in rows.items()},
+        }
+        out_path = os.path.join(record_dir, os.path.splitext(os.path.basename(img_path))[0] + '.json')
+        with open(out_path, 'w') as f:
+            json.dump(fixture, f)
+        print(f"  Recorded association fixture: {out_path}")
     
-    #step 1 - run yolo and find number/move cells
+    # number of plies from the start of the game that replay legally from the OCR text
+    def count_legal_plies(self, rows):
+        board = chess.Board()
+        for num in sorted(rows.keys()):
+            for ctype in ('white', 'black'):
+                move = san_index(board).lookup(rows[num].get(f'{ctype}_text'))
+                if move is None:
+                    return len(board.move_stack)
+                board.push(move)
+        return len(board.move_stack)
+    
+    # run YOLO on the page rendered at detection resolution (longest side at most
+    # DETECT_MAX_SIDE, YOLO letterboxes to its own input size anyway), boxes are
+    # returned in page coordinates
+    def detect_page(self, page):
+        h, w = page.shape[:2]
+        scale = min(1.0, DETECT_MAX_SIDE / max(h, w))
+        num_boxes, move_boxes = self.step1_yolo_detection(page.render(scale))
+        if scale == 1.0:
+            return num_boxes, move_boxes
+        to_page = np.array([[1 / scale, 0, 0], [0, 1 / scale, 0]])
+        return self.transform_boxes(num_boxes, to_page), self.transform_boxes(move_boxes, to_page)
+    
+    # zoom so move cells come out about TARGET_CELL_HEIGHT px tall, the pixel
+    # thresholds in steps 2-5 were tuned on cells of that size
+    def choose_zoom(self, move_boxes):
+        if len(move_boxes) == 0:
+            return 2.0
+        cell_h = max(1.0, float(np.median(move_boxes['h'])))
+        return float(np.clip(TARGET_CELL_HEIGHT / cell_h, MIN_ZOOM, MAX_ZOOM))
+
+    #step 1 - run yolo and find number/move cells, returned as box tables
     def step1_yolo_detection(self, img):
-        results = self.yolo(img, conf=0.25, verbose=False)
-        
-        num_boxes = []
-        move_boxes = []
-        
-        for b in results[0].boxes:
-            x1, y1, x2, y2 = map(int, b.xyxy[0].cpu().numpy())
-            cls = int(b.cls)
-            conf = float(b.conf)
-            
-            box = {
-                'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
-                'cx': (x1 + x2) // 2, 'cy': (y1 + y2) // 2,
-                'w': x2 - x1, 'h': y2 - y1,
-                'conf': conf
-            }
-            
-            if cls == 0:  # number
-                num_boxes.append(box)
-            else:  # move
-                move_boxes.append(box)
-        
-        return num_boxes, move_boxes
+        return self.detector.detect(img)
     
     #step 2 - dedkew the image to reduce orientation angle
+    # returns (image, angle, rotation matrix), the matrix is None if the image was not rotated
     def step2_deskew(self, img, move_boxes):
         if len(move_boxes) < 10:
-            return img, 0.0
+            return img, 0.0, None
         
         h, w = img.shape[:2]
         
         # wecan use box centers but only from the SAME ROW (horizontally aligned boxes)
-        # Sort boxes by Y, group into rows, then check if boxes in same row are horizontally aligned
-        sorted_by_y = sorted(move_boxes, key=lambda m: m['cy'])
-        
-        heights = [m['y2'] - m['y1'] for m in move_boxes]
-        median_height = np.median(heights)
-        
-        # Group boxes into rows
-        rows = []
-        current_row = [sorted_by_y[0]]
-        
-        for i in range(1, len(sorted_by_y)):
-            if sorted_by_y[i]['cy'] - sorted_by_y[i-1]['cy'] > median_height * 0.5:
-                rows.append(current_row)
-                current_row = [sorted_by_y[i]]
-            else:
-                current_row.append(sorted_by_y[i])
-        rows.append(current_row)
-        
+        # Group boxes into rows by Y, then check if boxes in same row are horizontally aligned
+        median_height = np.median(move_boxes['y2'] - move_boxes['y1'])
+        rows = gap_groups(move_boxes['cy'], median_height * 0.5)
+        cx, cy = move_boxes['cx'], move_boxes['cy']
+
         # For each row with multiple boxes, compute the angle between leftmost and rightmost box
         # Only use first 10 rows to avoid multi-column perspective distortion
         row_angles = []
         for row in rows[:10]:  # Limit to first 10 rows
             if len(row) < 2:
                 continue
-            
+
             # Sort row by x
-            row_sorted = sorted(row, key=lambda m: m['cx'])
+            row_sorted = row[np.argsort(cx[row], kind='stable')]
             left_box = row_sorted[0]
             right_box = row_sorted[-1]
-            
+
             # Compute angle between box centers
-            dx = right_box['cx'] - left_box['cx']
-            dy = right_box['cy'] - left_box['cy']
+            dx = int(cx[right_box]) - int(cx[left_box])
+            dy = int(cy[right_box]) - int(cy[left_box])
             
             if dx < 100:  # Boxes too close
                 continue
@@ -361,7 +1051,7 @@ class ScoresheetPipeline:
             row_angles.append(angle_deg)
         
         if not row_angles:
-            return img, 0.0
+            return img, 0.0, None
         
         # Take the 5 angles closest to 0° (most vertical rows) and use their median
         angles_arr = np.array(row_angles)
@@ -371,7 +1061,7 @@ class ScoresheetPipeline:
         
         # Only deskew if angle is significant (> 1.0 degrees)
         if abs(skew_angle) < 1.0:
-            return img, skew_angle
+            return img, skew_angle, None
         
         # Rotate image to correct skew
         # Positive angle means right side is lower, so rotate counter-clockwise (positive in cv2)
@@ -388,20 +1078,40 @@ class ScoresheetPipeline:
         rotation_matrix[0, 2] += (new_w - w) / 2
         rotation_matrix[1, 2] += (new_h - h) / 2
         
-        rotated = cv2.warpAffine(img, rotation_matrix, (new_w, new_h), 
-                                  borderMode=cv2.BORDER_REPLICATE)
+        # composed into the page transform, pixels are only resampled per region
+        rotated = img.warp(rotation_matrix, (new_w, new_h))
         
-        return rotated, skew_angle
+        return rotated, skew_angle, rotation_matrix
+    
+    # map boxes through a 2x3 similarity transform (zoom and/or rotation), box centers move
+    # and sizes only scale (the rotation straightens the boxes, so they stay axis-aligned)
+    def transform_boxes(self, boxes, matrix):
+        if len(boxes) == 0:
+            return boxes
+        matrix = np.asarray(matrix, dtype=np.float64)
+        scale = float(np.sqrt(abs(np.linalg.det(matrix[:, :2]))))
+        cx = boxes['cx'] * matrix[0, 0] + boxes['cy'] * matrix[0, 1] + matrix[0, 2]
+        cy = boxes['cx'] * matrix[1, 0] + boxes['cy'] * matrix[1, 1] + matrix[1, 2]
+        w = np.round(boxes['w'] * scale).astype(np.int64)
+        h = np.round(boxes['h'] * scale).astype(np.int64)
+        x1 = np.round(cx - w / 2).astype(np.int64)
+        y1 = np.round(cy - h / 2).astype(np.int64)
+        mapped = make_boxes(x1, y1, x1 + w, y1 + h)
+        mapped['conf'] = boxes['conf']
+        mapped['source'] = boxes['source']
+        return mapped
     
     #step 3 - find the column layout
-    def step3_number_detection(self, img, num_boxes, move_boxes, img_width):
-        numbers = []
+    def step3_number_detection(self, img, num_boxes, move_boxes, img_width, timings=None):
+        numbers = make_numbers([])
+        if timings is not None:
+            timings['number_fallback'] = 0
         
         # First, detect column layout from move boxes
         num_columns, layout, columns = self.detect_column_layout(move_boxes)
         
         # Method 1: Use YOLO number boxes with OCR
-        if num_boxes:
+        if len(num_boxes):
             if USE_PADDLE_FOR_NUMBERS:
                 print("  Method A: Using YOLO number boxes with PaddleOCR...")
                 numbers = self.ocr_number_boxes_paddle(img, num_boxes)
@@ -418,23 +1128,170 @@ class ScoresheetPipeline:
         
         # Fallback - find number regions from move boxes and run PaddleOCR
         print("  Method B: Fallback - using move box edges for number detection...")
+        if timings is not None:
+            timings['number_fallback'] = 1
         fallback_numbers = self.fallback_number_detection(img, move_boxes, img_width, columns)
         print(f"  Fallback detected: {len(fallback_numbers)} numbers")
         
         # Merge results (prefer YOLO if same number detected)
-        numbers.extend(fallback_numbers)
+        numbers = np.concatenate([numbers, fallback_numbers])
         return self.deduplicate_numbers(numbers), num_columns, layout
 
+    #step 3, geometry mode
+    def step3_geometry_numbers(self, img, num_boxes, move_boxes):
+        """Number the rows of a regular grid from move box positions.
+        
+        Lanes of move boxes are paired left to right into column blocks
+        (white lane, black lane), rows are clustered by y inside each block and
+        a row's number is the first number of its block plus its row index.
+        The first number of each block is confirmed by reading a few sampled
+        number cells.
+        
+        Returns:
+            (numbers, estimated seconds of number OCR skipped), numbers is None
+            when the grid is irregular or the sampled reads don't agree
+        """
+        if self.number_ocr is None:
+            print("  Geometry numbering needs the number recognition model, using OCR")
+            return None, 0.0
+        
+        _, _, lanes = self.detect_column_layout(move_boxes)
+        if len(lanes) < 2 or len(lanes) % 2:
+            print(f"  Geometry numbering: {len(lanes)} lanes, not a white/black grid, using OCR")
+            return None, 0.0
+        row_h = np.median(move_boxes['h'])
+        
+        # rows of every block, as y positions on a common spacing
+        blocks = []
+        for white_lane, black_lane in zip(lanes[0::2], lanes[1::2]):
+            rows_y = self.grid_rows(move_boxes['cy'][np.concatenate([white_lane, black_lane])], row_h)
+            if rows_y is None:
+                print("  Geometry numbering: irregular row spacing, using OCR")
+                return None, 0.0
+            blocks.append({'lanes': (move_boxes[white_lane], move_boxes[black_lane]), 'rows_y': rows_y})
+        
+        spacings = [np.median(np.diff(b['rows_y'])) for b in blocks]
+        if max(spacings) > min(spacings) * 1.15:
+            print("  Geometry numbering: blocks have different row spacing, using OCR")
+            return None, 0.0
+        spacing = float(np.median(spacings))
+        
+        # number column of each block: YOLO number boxes between the previous block and
+        # this block's black lane, else the strip left of the white lane (fallback span)
+        max_move_width = int((move_boxes['x2'] - move_boxes['x1']).max())
+        prev_right = 0
+        for b in blocks:
+            white_lane, black_lane = b['lanes']
+            right = np.median(black_lane['x1'])
+            b['num_boxes'] = num_boxes[(num_boxes['cx'] >= prev_right) & (num_boxes['cx'] < right)]
+            prev_right = np.median(black_lane['x2'])
+            if len(b['num_boxes']):
+                b['num_x'] = float(np.median(b['num_boxes']['cx']))
+            else:
+                median_x1 = int(np.median(white_lane['x1']))
+                b['span'] = (max(0, median_x1 - int(max_move_width * 0.5)), median_x1 + int(max_move_width * 0.1))
+                b['num_x'] = (b['span'][0] + b['span'][1]) / 2
+        
+        # sample a few rows of every block, spread over the block
+        per_block = max(2, GEOMETRY_SAMPLE_CELLS // len(blocks))
+        samples = []
+        for bi, b in enumerate(blocks):
+            rows_y = b['rows_y']
+            picks = np.unique(np.linspace(0, len(rows_y) - 1, per_block).round().astype(int))
+            for idx in picks:
+                y = rows_y[idx]
+                if len(b['num_boxes']):
+                    dist = np.abs(b['num_boxes']['cy'] - y)
+                    if dist.min() > spacing * 0.5:
+                        continue
+                    nb = b['num_boxes'][dist.argmin()]
+                    region = (int(nb['x1']), int(nb['y1']), int(nb['x2']), int(nb['y2']))
+                else:
+                    region = (b['span'][0], int(y - row_h / 2), b['span'][1], int(y + row_h / 2))
+                samples.append((bi, idx, region))
+        
+        t0 = time.time()
+        readings = self.read_numbers(img, [region for _, _, region in samples])
+        per_cell = (time.time() - t0) / max(len(samples), 1)
+        
+        # first number of each block by majority of (number - row index), needs 2 agreeing reads
+        first_numbers = []
+        for bi in range(len(blocks)):
+            votes = [num - idx for (sbi, idx, _), (num, _) in zip(samples, readings) if sbi == bi and num is not None]
+            if not votes:
+                print(f"  Geometry numbering: no readable sample in block {bi}, using OCR")
+                return None, 0.0
+            first, count = max(((v, votes.count(v)) for v in set(votes)), key=lambda x: x[1])
+            if count < 2 or count * 2 <= len(votes):
+                print(f"  Geometry numbering: samples disagree in block {bi} ({votes}), using OCR")
+                return None, 0.0
+            first_numbers.append(first)
+        
+        records = []
+        for b, first in zip(blocks, first_numbers):
+            if records and first <= records[-1][0]:
+                print("  Geometry numbering: blocks overlap in numbering, using OCR")
+                return None, 0.0
+            for idx, y in enumerate(b['rows_y']):
+                if 1 <= first + idx <= 60:
+                    records.append((first + idx, b['num_x'], y, 'geometry'))
+        
+        # the OCR path reads every YOLO number box, or one fallback cell per white move box
+        ocr_cells = len(num_boxes) if len(num_boxes) else sum(len(b['lanes'][0]) for b in blocks)
+        print(f"  Blocks: {len(blocks)}, row spacing {spacing:.1f}px, read {len(samples)} of {ocr_cells} number cells")
+        return make_numbers(records), per_cell * max(ocr_cells - len(samples), 0)
+    
+    def grid_rows(self, ys, row_h):
+        """Row y positions of one column block on a regular spacing, None if irregular.
+        
+        Box centers closer than half a box height are one row. Rows missing from
+        the detection are filled in, a stray row above or below the grid
+        (header, signature) is dropped.
+        """
+        ys = np.asarray(ys, dtype=np.float64)
+        rows_y = np.array([np.median(ys[g]) for g in gap_groups(ys, row_h * 0.5)])
+        if len(rows_y) < 3:
+            return None
+        
+        spacing = np.median(np.diff(rows_y))
+        def regular(gap):
+            steps = gap / spacing
+            return round(steps) >= 1 and abs(steps - round(steps)) <= GEOMETRY_MAX_ROW_RESIDUAL
+        
+        for _ in range(2):
+            if len(rows_y) > 3 and not regular(rows_y[1] - rows_y[0]):
+                rows_y = rows_y[1:]
+            if len(rows_y) > 3 and not regular(rows_y[-1] - rows_y[-2]):
+                rows_y = rows_y[:-1]
+        gaps = np.diff(rows_y)
+        if not all(regular(g) for g in gaps):
+            return None
+        
+        # refit the spacing over the whole block, then place every row index on it
+        steps = np.concatenate([[0], np.cumsum(np.round(gaps / spacing))])
+        slope, intercept = np.polyfit(steps, rows_y, 1)
+        return intercept + slope * np.arange(int(steps[-1]) + 1)
+    
+    # pixels of a box on the page, clipped to the page, None if nothing is left
+    def crop_box(self, img, box):
+        h, w = img.shape[:2]
+        x1, y1 = max(0, box['x1']), max(0, box['y1'])
+        x2, y2 = min(w, box['x2']), min(h, box['y2'])
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return img.sample((x1, y1, x2, y2))
+    
     # do number ocr using tesseract
     def ocr_number_boxes_tesseract(self, img, num_boxes):
-        numbers = []
+        records = []
         for box in num_boxes:
-            crop = img[box['y1']:box['y2'], box['x1']:box['x2']]
-            if crop.size == 0:
+            crop = self.crop_box(img, box)
+            if crop is None:
                 continue
             
             gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
             _, proc = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            import pytesseract
             text = pytesseract.image_to_string(proc, config='--psm 7 -c tessedit_char_whitelist=0123456789').strip()
             
             digits = ''.join(c for c in text if c.isdigit())
@@ -442,26 +1299,24 @@ class ScoresheetPipeline:
                 try:
                     num = int(digits)
                     if 1 <= num <= 60:
-                        numbers.append({
-                            'number': num,
-                            'y': box['cy'],
-                            'x': box['cx'],
-                            'box': box,
-                            'source': 'yolo+tesseract'
-                        })
+                        records.append((num, box['cx'], box['cy'], 'yolo+tesseract'))
                 except:
                     pass
-        return numbers
+        return make_numbers(records)
     
     # do number ocr using paddleOCR
     def ocr_number_boxes_paddle(self, img, num_boxes):
-        numbers = []
+        if self.number_ocr is not None:
+            return self.ocr_number_boxes_batched(img, num_boxes)
+        
+        records = []
         for box in num_boxes:
-            crop = img[box['y1']:box['y2'], box['x1']:box['x2']]
-            if crop.size == 0:
+            crop = self.crop_box(img, box)
+            if crop is None:
                 continue
             
-            result = self.ocr.predict(crop)
+            with self.pooled_ocr() as ocr:
+                result = ocr.predict(crop)
             if result and result[0]:
                 rec_texts = result[0].get('rec_texts', [])
                 if rec_texts:
@@ -471,16 +1326,39 @@ class ScoresheetPipeline:
                         try:
                             num = int(digits)
                             if 1 <= num <= 60:
-                                numbers.append({
-                                    'number': num,
-                                    'y': box['cy'],
-                                    'x': box['cx'],
-                                    'box': box,
-                                    'source': 'yolo+paddleocr'
-                                })
+                                records.append((num, box['cx'], box['cy'], 'yolo+paddleocr'))
                         except:
                             pass
-        return numbers
+        return make_numbers(records)
+    
+    # recognition-only number ocr, all YOLO number boxes go through the model in one batch
+    def ocr_number_boxes_batched(self, img, num_boxes):
+        regions = [tuple(int(v) for v in box[['x1', 'y1', 'x2', 'y2']]) for box in num_boxes]
+        readings = self.read_numbers(img, regions)
+        return make_numbers([(num, box['cx'], box['cy'], 'yolo+paddleocr')
+                             for box, (num, prob) in zip(num_boxes, readings) if num is not None])
+    
+    # read move numbers from page regions, returns (number, prob) per region
+    # number is None when no entry of NUMBER_LEXICON fits the crop
+    def read_numbers(self, img, regions):
+        if not regions:
+            return []
+        results = self.number_ocr.recognize_regions(img, regions, decode=False)
+        
+        readings = []
+        for probs, _ in results:
+            if probs is None:
+                readings.append((None, 0.0))
+                continue
+            raw_text, path_ll = greedy_decode(probs, self.number_ocr.chars)
+            word_ll = ctc_word_log_likelihoods(probs, NUMBER_LEXICON, self.number_ocr.char_index)
+            best = int(np.argmax(word_ll))
+            if not any(c.isdigit() for c in raw_text) or word_ll[best] - path_ll < NUMBER_MIN_FIT:
+                readings.append((None, 0.0))
+                continue
+            post = np.exp(word_ll - word_ll[best])
+            readings.append((int(NUMBER_LEXICON[best]), float(1.0 / post.sum())))
+        return readings
 
     
     def detect_column_layout(self, move_boxes):
@@ -489,26 +1367,14 @@ class ScoresheetPipeline:
         Returns:
             num_columns: number of move columns (2, 4, or 6)
             layout: description string
-            columns: list of column box groups
+            columns: list of column index arrays into move_boxes, left to right
         """
-        if not move_boxes:
+        if len(move_boxes) == 0:
             return 2, "2-col (default)", []
         
         # Cluster move boxes by x-position
-        move_widths = [m['x2'] - m['x1'] for m in move_boxes]
-        avg_width = np.median(move_widths) if move_widths else 100
-        
-        sorted_moves = sorted(move_boxes, key=lambda m: m['cx'])
-        columns = []
-        current_col = [sorted_moves[0]]
-        
-        for i in range(1, len(sorted_moves)):
-            if sorted_moves[i]['cx'] - sorted_moves[i-1]['cx'] > avg_width * 0.7:
-                columns.append(current_col)
-                current_col = [sorted_moves[i]]
-            else:
-                current_col.append(sorted_moves[i])
-        columns.append(current_col)
+        avg_width = np.median(move_boxes['x2'] - move_boxes['x1'])
+        columns = gap_groups(move_boxes['cx'], avg_width * 0.7)
         
         # Filter significant columns (at least 3 moves)
         columns = [c for c in columns if len(c) >= 3]
@@ -525,21 +1391,24 @@ class ScoresheetPipeline:
         return num_columns, layout, columns
     
     def fallback_number_detection(self, img, move_boxes, img_width, columns=None):
-        """Fallback: detect numbers from vertical strips using median x1 per column.
+        """Fallback: detect numbers left of each move column using median x1 per column.
         
-        For each column: calculate median x1, then create strip from 
+        For each column: calculate median x1, then take the span from
         (median_x1 - 50% of move width) to (median_x1 + 10% of move width).
-        Run PaddleOCR on each strip.
+        With the number recognition model, every move box in the column gives
+        one candidate number cell on that span (its row), and all cells are
+        read in one batch. Without it, the full-height strips go through
+        PaddleOCR detection+recognition concurrently, one strip per pooled
+        pipeline.
         """
-        if not move_boxes:
-            return []
+        if len(move_boxes) == 0:
+            return make_numbers([])
         
-        numbers = []
         h = img.shape[0]
         
         # Strip params based on move box dimensions
-        move_widths = [m['x2'] - m['x1'] for m in move_boxes]
-        max_move_width = max(move_widths)
+        move_widths = move_boxes['x2'] - move_boxes['x1']
+        max_move_width = int(move_widths.max())
         avg_move_width = np.median(move_widths)
         
         strip_left_extend = int(max_move_width * 0.5)  # 50% left of median x1
@@ -547,50 +1416,66 @@ class ScoresheetPipeline:
         
         # Compute columns if not provided
         if columns is None or len(columns) == 0:
-            sorted_moves = sorted(move_boxes, key=lambda m: m['cx'])
-            columns = []
-            current_col = [sorted_moves[0]]
-            
-            for i in range(1, len(sorted_moves)):
-                if sorted_moves[i]['cx'] - sorted_moves[i-1]['cx'] > avg_move_width * 0.5:
-                    columns.append(current_col)
-                    current_col = [sorted_moves[i]]
-                else:
-                    current_col.append(sorted_moves[i])
-            columns.append(current_col)
+            columns = gap_groups(move_boxes['cx'], avg_move_width * 0.5)
             
             # Filter significant columns (at least 3 moves)
             columns = [c for c in columns if len(c) >= 3]
         
         if not columns:
-            return []
+            return make_numbers([])
         
         # For each column, create strip based on MEDIAN x1
+        spans = []
         for col_idx, col in enumerate(columns):
             # Get median x1 for this column (robust to outliers)
-            x1_values = [m['x1'] for m in col]
-            median_x1 = int(np.median(x1_values))
+            median_x1 = int(np.median(move_boxes['x1'][col]))
             
             # Strip: from (median_x1 - 50% of move width) to (median_x1 + 10% overlap)
             region_start = max(0, median_x1 - strip_left_extend)
             region_end = min(img_width, median_x1 + strip_overlap)
             
             if region_end > region_start + 10:
-                region = img[:, region_start:region_end]
-                found = self.ocr_number_region(region, region_start)
-                numbers.extend(found)
-        
-        return numbers
+                spans.append((move_boxes[col], region_start, region_end))
+        
+        if self.number_ocr is None:
+            regions = [img.sample((start, 0, end, h)) for _, start, end in spans]
+            found = self.ocr_number_regions(regions, [start for _, start, _ in spans])
+            return make_numbers([r for records in found for r in records])
+        
+        # one candidate cell per row, the rows are the move boxes of the column
+        cells = np.concatenate([make_boxes(np.full(len(col), start), col['y1'], np.full(len(col), end), col['y2'])
+                                for col, start, end in spans]) if spans else make_boxes([], [], [], [])
+        regions = [(int(c['x1']), int(c['y1']), int(c['x2']), int(c['y2'])) for c in cells]
+        readings = self.read_numbers(img, regions)
+        return make_numbers([(num, cell['cx'], cell['cy'], 'paddleocr_fallback')
+                             for cell, (num, prob) in zip(cells, readings) if num is not None])
     
-    def ocr_number_region(self, region, x_offset):
-        """Run PaddleOCR on a number region."""
-        numbers = []
+    def ocr_number_regions(self, regions, x_offsets):
+        """Run PaddleOCR on several number regions in parallel, one region per pooled pipeline.
+        
+        PaddleOCR runs the images of one predict(list) call one after another, so
+        the strips are spread over threads that each check out their own pipeline.
+        """
+        if not regions:
+            return []
         
-        result = self.ocr.predict(region)
-        if result and result[0]:
-            rec_texts = result[0].get('rec_texts', [])
-            rec_scores = result[0].get('rec_scores', [])
-            rec_polys = result[0].get('rec_polys', [])
+        def read(region):
+            with self.pooled_ocr() as ocr:
+                result = ocr.predict(region)
+            return result[0] if result else None
+        
+        with ThreadPoolExecutor(max_workers=min(len(regions), self.ocr_pool_size)) as executor:
+            results = list(executor.map(read, regions))
+        return [self.parse_number_region(result, x_offset) for result, x_offset in zip(results, x_offsets)]
+    
+    def parse_number_region(self, result, x_offset):
+        """Numbers from one PaddleOCR detection+recognition result, as (number, x, y, source) records."""
+        records = []
+        
+        if result:
+            rec_texts = result.get('rec_texts', [])
+            rec_scores = result.get('rec_scores', [])
+            rec_polys = result.get('rec_polys', [])
             
             for txt, score, poly in zip(rec_texts, rec_scores, rec_polys):
                 if score < 0.5:
@@ -606,28 +1491,22 @@ class ScoresheetPipeline:
                             x_coords = [p[0] for p in poly]
                             x_center = x_offset + (min(x_coords) + max(x_coords)) / 2
                             
-                            numbers.append({
-                                'number': num,
-                                'y': y_center,
-                                'x': x_center,
-                                'source': 'paddleocr_fallback'
-                            })
+                            records.append((num, x_center, y_center, 'paddleocr_fallback'))
                     except:
                         pass
         
-        return numbers
+        return records
     
     def deduplicate_numbers(self, numbers):
         """Remove duplicate numbers, keeping highest confidence."""
-        seen = {}
-        for n in numbers:
-            num = n['number']
-            if num not in seen:
-                seen[num] = n
-            elif n.get('source') == 'yolo+tesseract':
-                # Prefer YOLO source
-                seen[num] = n
-        return sorted(seen.values(), key=lambda x: x['number'])
+        if len(numbers) == 0:
+            return numbers
+        # Prefer YOLO source (last one wins), otherwise the first one seen
+        order = np.arange(len(numbers))
+        preferred = numbers['source'] == 'yolo+tesseract'
+        idx = np.lexsort((np.where(preferred, -order, order), ~preferred, numbers['number']))
+        _, first = np.unique(numbers['number'][idx], return_index=True)
+        return numbers[idx[first]]
     
     #step 4
     def step4_extrapolate_numbers(self, numbers):
@@ -652,43 +1531,36 @@ class ScoresheetPipeline:
         
         for col_numbers in columns_pre:
             if len(col_numbers) < 3:
-                filtered_numbers.extend(col_numbers)
+                filtered_numbers.append(col_numbers)
                 continue
             
-            # Get median Y for this column
-            sorted_by_num = sorted(col_numbers, key=lambda n: n['number'])
+            # columns come sorted by number, closest lower / higher neighbors by binary search
+            nums, ys = col_numbers['number'], col_numbers['y']
+            prev_i = np.searchsorted(nums, nums, side='left') - 1
+            next_i = np.searchsorted(nums, nums, side='right')
+            has_prev = prev_i >= 0
+            has_next = next_i < len(nums)
+            prev_i = np.clip(prev_i, 0, len(nums) - 1)
+            next_i = np.clip(next_i, 0, len(nums) - 1)
             
-            for n in col_numbers:
-                # Find expected Y based on neighbors
-                prev_nums = [x for x in sorted_by_num if x['number'] < n['number']]
-                next_nums = [x for x in sorted_by_num if x['number'] > n['number']]
-                
-                # Estimate expected Y
-                if prev_nums and next_nums:
-                    prev_n = prev_nums[-1]  # Closest lower
-                    next_n = next_nums[0]   # Closest higher
-                    if next_n['number'] != prev_n['number']:
-                        ratio = (n['number'] - prev_n['number']) / (next_n['number'] - prev_n['number'])
-                        expected_y = prev_n['y'] + ratio * (next_n['y'] - prev_n['y'])
-                    else:
-                        expected_y = n['y']
-                elif prev_nums:
-                    prev_n = prev_nums[-1]
-                    expected_y = prev_n['y'] + (n['number'] - prev_n['number']) * row_spacing
-                elif next_nums:
-                    next_n = next_nums[0]
-                    expected_y = next_n['y'] - (next_n['number'] - n['number']) * row_spacing
-                else:
-                    expected_y = n['y']
-                
-                # Check if actual Y is within tolerance (3x row spacing)
-                deviation = abs(n['y'] - expected_y)
-                if deviation < row_spacing * 3:
-                    filtered_numbers.append(n)
-                else:
-                    print(f"  [Outlier] Filtered number {n['number']}: y={n['y']:.0f}, expected ~{expected_y:.0f}, deviation={deviation:.0f}")
+            # Estimate expected Y: interpolate between neighbors, or step from the one neighbor
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = (nums - nums[prev_i]) / (nums[next_i] - nums[prev_i])
+                expected_y = np.select(
+                    [has_prev & has_next, has_prev, has_next],
+                    [ys[prev_i] + ratio * (ys[next_i] - ys[prev_i]),
+                     ys[prev_i] + (nums - nums[prev_i]) * row_spacing,
+                     ys[next_i] - (nums[next_i] - nums) * row_spacing],
+                    default=ys)
+            
+            # Check if actual Y is within tolerance (3x row spacing)
+            deviation = np.abs(ys - expected_y)
+            keep = deviation < row_spacing * 3
+            for n, exp, dev in zip(col_numbers[~keep], expected_y[~keep], deviation[~keep]):
+                print(f"  [Outlier] Filtered number {n['number']}: y={n['y']:.0f}, expected ~{exp:.0f}, deviation={dev:.0f}")
+            filtered_numbers.append(col_numbers[keep])
         
-        numbers = filtered_numbers
+        numbers = np.concatenate(filtered_numbers)
         
         # Group numbers by column based on X-coordinate binning
         columns = self.group_by_columns(numbers)
@@ -703,34 +1575,30 @@ class ScoresheetPipeline:
         print(f"  Number columns: {len(columns)}")
         
         result = []
-        all_detected = sorted([n['number'] for n in numbers])
-        global_max = max(all_detected)
+        global_max = int(numbers['number'].max())
         
-        # Track the end of the previous column to start the next one correctly
-        prev_end_tracker = 0
+        # rows per column, local so concurrent requests don't share it
+        row_split = None
         
         for col_idx, col_numbers in enumerate(columns):
-            if not col_numbers:
+            if len(col_numbers) == 0:
                 continue
             
-            # Anchor used to estimate Y positions for missing moves in this strip
-            anchor = min(col_numbers, key=lambda n: n['y'])
-            
             # --- PERIODICITY-BASED BOUNDARY LOGIC ---
             # Determine the standard layout (e.g., 20 rows per column) based on the first transition
             # and apply it uniformly to all columns.
             
             # 1. Determine the split size (rows per column)
-            if not hasattr(self, '_cached_row_split'):
+            if row_split is None:
                 # Default to end of detected numbers if single column
                 if len(columns) == 1:
-                    max_num = max(n['number'] for n in columns[0])
+                    max_num = int(columns[0]['number'].max())
                     # Snap to nearest 10
-                    self.cached_row_split = ((max_num + 9) // 10) * 10
+                    row_split = ((max_num + 9) // 10) * 10
                 else:
                     # Look at the gap between Col 0 max and Col 1 min
-                    c0_max = max(n['number'] for n in columns[0])
-                    c1_min = min(n['number'] for n in columns[1])
+                    c0_max = int(columns[0]['number'].max())
+                    c1_min = int(columns[1]['number'].min())
                     
                     # Find the best standard split candidate
                     candidates = [15, 20, 25, 30, 35, 40, 50, 60]
@@ -748,9 +1616,7 @@ class ScoresheetPipeline:
                          best_split = c0_max
                          print(f"  [Extrapolation] Non-standard gap {c0_max}-{c1_min}. Using {best_split}")
                     
-                    self.cached_row_split = best_split
-
-            row_split = self.cached_row_split
+                    row_split = best_split
             
             # 2. Apply the split
             col_start = (col_idx * row_split) + 1
@@ -762,88 +1628,69 @@ class ScoresheetPipeline:
 
             print(f"    Column {col_idx}: range {col_start}-{col_end}")
             
-            # --- EXTRAPOLATION LOOP ---
-            # Sort detected numbers in this column for interpolation
-            sorted_detected = sorted(col_numbers, key=lambda n: n['number'])
+            # --- EXTRAPOLATION ---
+            # detected numbers in this column are sorted, every target number is either
+            # present or lies between its closest detected neighbors
+            nums, xs, ys = col_numbers['number'], col_numbers['x'], col_numbers['y']
+            targets = np.arange(col_start, col_end + 1)
+            pos = np.searchsorted(nums, targets, side='left')
+            at = np.clip(pos, 0, len(nums) - 1)
+            exists = (pos < len(nums)) & (nums[at] == targets)
             
-            for num in range(col_start, col_end + 1):
-                existing = next((n for n in col_numbers if n['number'] == num), None)
-                if existing:
-                    result.append(existing)
-                else:
-                    # Interpolation Logic: Find neighbors
-                    prev_n = max((n for n in sorted_detected if n['number'] < num), key=lambda n: n['number'], default=None)
-                    next_n = min((n for n in sorted_detected if n['number'] > num), key=lambda n: n['number'], default=None)
-                    
-                    if prev_n and next_n:
-                         # Linear Interpolation
-                         ratio = (num - prev_n['number']) / (next_n['number'] - prev_n['number'])
-                         y_est = prev_n['y'] + ratio * (next_n['y'] - prev_n['y'])
-                         x_est = prev_n['x'] + ratio * (next_n['x'] - prev_n['x']) # Also interpolate X drift
-                    elif prev_n:
-                        # Extrapolate forward from last detected
-                        y_est = prev_n['y'] + (num - prev_n['number']) * row_spacing
-                        x_est = prev_n['x'] # Assume constant X for tail
-                    elif next_n:
-                        # Extrapolate backward from first detected
-                        y_est = next_n['y'] - (next_n['number'] - num) * row_spacing
-                        x_est = next_n['x']
-                    else:
-                         # No detected numbers in this col? Fallback to anchor
-                         y_est = anchor['y'] + (num - anchor['number']) * row_spacing
-                         x_est = anchor['x']
-
-                    result.append({
-                        'number': num,
-                        'y': y_est,
-                        'x': x_est,
-                        'source': 'extrapolated'
-                    })
+            # existing numbers keep their detection
+            result.append(col_numbers[at[exists]])
+            
+            missing = targets[~exists]
+            if len(missing) == 0:
+                continue
+            pos = pos[~exists]
+            has_prev = pos > 0
+            has_next = pos < len(nums)
+            prev_i = np.clip(pos - 1, 0, len(nums) - 1)
+            next_i = np.clip(pos, 0, len(nums) - 1)
+            
+            both = has_prev & has_next
+            # Linear Interpolation between neighbors (also interpolate X drift), else
+            # extrapolate forward from last detected / backward from first detected
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = (missing - nums[prev_i]) / (nums[next_i] - nums[prev_i])
+                y_est = np.where(both, ys[prev_i] + ratio * (ys[next_i] - ys[prev_i]),
+                                 np.where(has_prev, ys[prev_i] + (missing - nums[prev_i]) * row_spacing,
+                                          ys[next_i] - (nums[next_i] - missing) * row_spacing))
+                x_est = np.where(both, xs[prev_i] + ratio * (xs[next_i] - xs[prev_i]),
+                                 np.where(has_prev, xs[prev_i], xs[next_i]))
+            
+            extrapolated = np.zeros(len(missing), dtype=numbers.dtype)
+            extrapolated['number'] = missing
+            extrapolated['x'] = x_est
+            extrapolated['y'] = y_est
+            extrapolated['source'] = 'extrapolated'
+            result.append(extrapolated)
         
         # Final pass to ensure Y-positions are strictly increasing
-        result = self.check_monotonicity(result)
+        result = self.check_monotonicity(np.concatenate(result))
         
-        return sorted(result, key=lambda x: x['number'])
+        return result[np.argsort(result['number'], kind='stable')]
     
     def estimate_row_spacing(self, numbers):
         """Estimate row spacing from detected numbers."""
-        spacings = []
-        sorted_nums = sorted(numbers, key=lambda x: x['number'])
+        sorted_nums = numbers[np.argsort(numbers['number'], kind='stable')]
+        num_diff = np.diff(sorted_nums['number'])
+        y_diff = np.diff(sorted_nums['y'])
         
-        for i in range(len(sorted_nums) - 1):
-            n1, n2 = sorted_nums[i], sorted_nums[i+1]
-            num_diff = n2['number'] - n1['number']
-            y_diff = n2['y'] - n1['y']
-            
-            if num_diff > 0 and y_diff > 0:
-                spacings.append(y_diff / num_diff)
-        
-        return np.median(spacings) if spacings else 48
+        ok = (num_diff > 0) & (y_diff > 0)
+        return np.median(y_diff[ok] / num_diff[ok]) if ok.any() else 48
     
     def group_by_columns(self, numbers):
         """Group numbers into columns using X-coordinate histogram binning."""
-        if not numbers:
+        if len(numbers) == 0:
             return []
         
-        # Sort by X position
-        sorted_nums = sorted(numbers, key=lambda n: n['x'])
-        x_values = [n['x'] for n in sorted_nums]
-        
         # Find gaps in X to identify column boundaries
         # A gap > 100px between consecutive numbers indicates a new column
         GAP_THRESHOLD = 100
         
-        columns = []
-        current_col = [sorted_nums[0]]
-        
-        for i in range(1, len(sorted_nums)):
-            gap = sorted_nums[i]['x'] - sorted_nums[i-1]['x']
-            if gap > GAP_THRESHOLD:
-                # Start new column
-                columns.append(current_col)
-                current_col = []
-            current_col.append(sorted_nums[i])
-        columns.append(current_col)
+        columns = [numbers[idx] for idx in gap_groups(numbers['x'], GAP_THRESHOLD)]
         
         # If two adjacent columns have 80%+ overlap in numbers, keep only the rightmost
         if len(columns) >= 2:
@@ -851,10 +1698,8 @@ class ScoresheetPipeline:
             i = 0
             while i < len(columns):
                 if i + 1 < len(columns):
-                    nums1 = set(n['number'] for n in columns[i])
-                    nums2 = set(n['number'] for n in columns[i + 1])
-                    overlap = len(nums1 & nums2)
-                    union = len(nums1 | nums2)
+                    overlap = len(np.intersect1d(columns[i]['number'], columns[i + 1]['number']))
+                    union = len(np.union1d(columns[i]['number'], columns[i + 1]['number']))
                     overlap_ratio = overlap / union if union > 0 else 0
                     
                     if overlap_ratio > 0.8:
@@ -868,17 +1713,13 @@ class ScoresheetPipeline:
                 i += 1
             columns = deduped_columns
         
+        # Sort each column by number
+        columns = [col[np.argsort(col['number'], kind='stable')] for col in columns]
+        
         # Debug output
         print(f"    [Binning] Found {len(columns)} number column(s):")
         for i, col in enumerate(columns):
-            x_min = min(n['x'] for n in col)
-            x_max = max(n['x'] for n in col)
-            nums = sorted([n['number'] for n in col])
-            print(f"      Col {i}: x={x_min:.0f}-{x_max:.0f}, nums={nums}")
-        
-        # Sort each column by number
-        for i in range(len(columns)):
-            columns[i] = sorted(columns[i], key=lambda x: x['number'])
+            print(f"      Col {i}: x={col['x'].min():.0f}-{col['x'].max():.0f}, nums={col['number'].tolist()}")
         
         return columns
     
@@ -889,47 +1730,32 @@ class ScoresheetPipeline:
         
         result = []
         for col in columns:
-            sorted_col = sorted(col, key=lambda x: x['y'])
-            
-            # Numbers should increase with y
-            corrected = []
-            for i, n in enumerate(sorted_col):
-                expected_num = sorted_col[0]['number'] + i
-                if n['number'] != expected_num:
-                    # Correct the number
-                    n = n.copy()
-                    n['number'] = expected_num
-                    n['source'] = 'monotonicity_corrected'
-                corrected.append(n)
+            sorted_col = col[np.argsort(col['y'], kind='stable')]
             
-            result.extend(corrected)
-        
-        return result
+            # Numbers should increase with y, correct the ones that don't
+            expected_num = sorted_col['number'][0] + np.arange(len(sorted_col))
+            wrong = sorted_col['number'] != expected_num
+            sorted_col['number'] = expected_num
+            sorted_col['source'][wrong] = 'monotonicity_corrected'
+            result.append(sorted_col)
+        
+        return np.concatenate(result) if result else numbers[:0]
 
 
     #step 4 helper
     def cluster_into_vertical_strips(self, boxes):
         """Clusters move boxes into vertical lanes based on X-order."""
-        if not boxes: return []
-        sorted_boxes = sorted(boxes, key=lambda b: b['cx'])
+        if len(boxes) == 0: return []
         
         # Gap threshold to separate move lanes. 
         gap_threshold = 65 
         
-        strips = []
-        current_strip = [sorted_boxes[0]]
-        for i in range(1, len(sorted_boxes)):
-            if sorted_boxes[i]['cx'] - sorted_boxes[i-1]['cx'] > gap_threshold:
-                strips.append(current_strip)
-                current_strip = []
-            current_strip.append(sorted_boxes[i])
-        strips.append(current_strip)
-        
+        strips = [boxes[idx] for idx in gap_groups(boxes['cx'], gap_threshold)]
         return [{
             'boxes': s, 
-            'x_center': np.median([b['cx'] for b in s]),
-            'avg_width': np.median([b['w'] for b in s]),
-            'avg_height': np.median([b['h'] for b in s])
+            'x_center': np.median(s['cx']),
+            'avg_width': np.median(s['w']),
+            'avg_height': np.median(s['h'])
         } for s in strips]
 
 
@@ -938,26 +1764,30 @@ class ScoresheetPipeline:
     #
     #Links move strips to number columns by first identifying the page topology.
     #    Enforces 2 strips per number column and fills all Step 3 rows.
-    def step5_associate_moves(self, numbers, move_boxes):
+    def step5_associate_moves(self, numbers, move_boxes, method=None):
         """
+        method is 'hungarian' or 'heuristic', ASSOCIATION if not given
         """
-        if not numbers: return {}
+        method = method or ASSOCIATION
+        if len(numbers) == 0: return {}
 
         # 1. remove header boxes above the first number
-        min_num_y = min(n['y'] for n in numbers)
-        valid_boxes = [b for b in move_boxes if b['cy'] >= (min_num_y - 20)]
+        min_num_y = numbers['y'].min()
+        valid_boxes = move_boxes[move_boxes['cy'] >= (min_num_y - 20)]
         
         # 2.find strips of moves
         raw_lanes = self.cluster_into_vertical_strips(valid_boxes)
         # filter tiny noise strips (< 2 boxes)
         all_move_strips = sorted([s for s in raw_lanes if len(s['boxes']) >= 2], key=lambda s: s['x_center'])
-        number_cols = sorted(self.group_by_columns(numbers), key=lambda c: np.median([n['x'] for n in c]))
+        number_cols = sorted(self.group_by_columns(numbers), key=lambda c: np.median(c['x']))
         
         row_h = self.estimate_row_spacing(numbers)
-        rows = {n['number']: {'white_box': None, 'black_box': None, 'y': n['y']} for n in numbers}
+        # rows are the API boundary, plain dicts and python numbers from here on
+        rows = {int(num): {'white_box': None, 'black_box': None, 'y': float(y)}
+                for num, y in zip(numbers['number'], numbers['y'])}
 
         # 3. do histgram check
-        first_num_x = np.median([n['x'] for n in number_cols[0]])
+        first_num_x = np.median(number_cols[0]['x'])
         first_move_x = all_move_strips[0]['x_center'] if all_move_strips else 0
         
         # Format is White-Number-Black if a move strip exists to the left of the numbers
@@ -971,7 +1801,7 @@ class ScoresheetPipeline:
             end_idx = start_idx + 2
             assigned_lanes = all_move_strips[start_idx:end_idx]
             
-            ns_x = np.median([n['x'] for n in ns_nums])
+            ns_x = np.median(ns_nums['x'])
             num_range = f"{ns_nums[0]['number']}-{ns_nums[-1]['number']}"
             print(f"  Block {i} ({num_range}): Strips {list(range(start_idx, min(end_idx, len(all_move_strips))))}")
 
@@ -990,188 +1820,286 @@ class ScoresheetPipeline:
                 white_lane = assigned_lanes[0]
 
             # 5. assign lanes to rows
-            for n in ns_nums:
-                num_num = n['number']
-                num_y = n['y']
-
-                for ctype, lane in [('white', white_lane), ('black', black_lane)]:
-                    if not lane: continue
-                    
-                    # Find box in THIS lane closest to THIS number's Y
-                    best_box = min(lane['boxes'], key=lambda b: abs(b['cy'] - num_y), default=None)
-                    
-                    if best_box and abs(best_box['cy'] - num_y) < row_h * 0.5:
-                        rows[num_num][f"{ctype}_box"] = best_box
-                    else:
-                        # 6. EXTRAPOLATION: Create virtual box for e5, d4, etc.
-                        rows[num_num][f"{ctype}_box"] = {
-                            'cx': lane['x_center'], 'cy': num_y,
-                            'w': lane['avg_width'], 'h': lane['avg_height'],
-                            'source': 'virtual_fill',
-                            'x1': int(lane['x_center'] - lane['avg_width']/2),
-                            'x2': int(lane['x_center'] + lane['avg_width']/2),
-                            'y1': int(num_y - lane['avg_height']/2),
-                            'y2': int(num_y + lane['avg_height']/2)
-                        }
+            lanes = [('white', white_lane), ('black', black_lane)]
+            if method == 'hungarian':
+                self.assign_block_hungarian(rows, ns_nums, lanes, row_h)
+            else:
+                self.assign_block_greedy(rows, ns_nums, lanes, row_h)
         return rows
 
+    # closest box in the lane per number, independently for every number (a box
+    # can end up in two rows), numbers without a box within half a row get a virtual box
+    def assign_block_greedy(self, rows, ns_nums, lanes, row_h):
+        for ctype, lane in lanes:
+            if not lane: continue
+            
+            # Find box in THIS lane closest to each number's Y
+            dist = np.abs(lane['boxes']['cy'][None, :] - ns_nums['y'][:, None])
+            best = dist.argmin(axis=1)
+            best_dist = dist[np.arange(len(ns_nums)), best]
+            
+            for num_num, num_y, b, d in zip(ns_nums['number'].tolist(), ns_nums['y'].tolist(),
+                                            best.tolist(), best_dist.tolist()):
+                if d < row_h * 0.5:
+                    rows[num_num][f"{ctype}_box"] = box_dict(lane['boxes'][b])
+                else:
+                    # 6. EXTRAPOLATION: Create virtual box for e5, d4, etc.
+                    rows[num_num][f"{ctype}_box"] = self.virtual_box(lane, num_y)
+    
+    # one white and one black slot per number, matched to the block's boxes with a single
+    # min-cost assignment so every box fills at most one slot, unmatched slots get a virtual box
+    def assign_block_hungarian(self, rows, ns_nums, lanes, row_h):
+        lanes = [(ctype, lane) for ctype, lane in lanes if lane]
+        if not lanes:
+            return
+        n = len(ns_nums)
+        boxes = np.concatenate([lane['boxes'] for _, lane in lanes])
+        box_lane = np.repeat(np.arange(len(lanes)), [len(lane['boxes']) for _, lane in lanes])
+        
+        # slots are lane-major: lane 0 for every number, then lane 1
+        slot_lane = np.repeat(np.arange(len(lanes)), n)
+        slot_y = np.tile(ns_nums['y'], len(lanes))
+        lane_x = np.array([lane['x_center'] for _, lane in lanes])[slot_lane]
+        lane_w = np.array([lane['avg_width'] for _, lane in lanes])[slot_lane]
+        
+        dy = np.abs(boxes['cy'][None, :] - slot_y[:, None]) / row_h
+        dx = np.abs(boxes['cx'][None, :] - lane_x[:, None]) / lane_w[:, None]
+        cost = (dy + ASSOC_LANE_WEIGHT * (box_lane[None, :] != slot_lane[:, None])
+                + ASSOC_CONF_WEIGHT * (1.0 - boxes['conf'])[None, :])
+        # a box can only fill a slot within half a row and half a lane width of it
+        feasible = (dy < 0.5) & (dx < 0.5)
+        cost = np.where(feasible, cost, 1e6)
+        
+        # scipy is only imported by the association method that needs it
+        from scipy.optimize import linear_sum_assignment
+        slot_idx, box_idx = linear_sum_assignment(cost)
+        matched = {s: b for s, b in zip(slot_idx.tolist(), box_idx.tolist()) if feasible[s, b]}
+        
+        for s in range(len(slot_lane)):
+            ctype, lane = lanes[slot_lane[s]]
+            num_num, num_y = int(ns_nums['number'][s % n]), float(ns_nums['y'][s % n])
+            if s in matched:
+                rows[num_num][f"{ctype}_box"] = box_dict(boxes[matched[s]])
+            else:
+                rows[num_num][f"{ctype}_box"] = self.virtual_box(lane, num_y)
+    
+    # box at the lane's x position and the number's y, for a row the detector missed
+    def virtual_box(self, lane, num_y):
+        return {
+            'cx': float(lane['x_center']), 'cy': num_y,
+            'w': float(lane['avg_width']), 'h': float(lane['avg_height']),
+            'source': 'virtual_fill',
+            'x1': int(lane['x_center'] - lane['avg_width']/2),
+            'x2': int(lane['x_center'] + lane['avg_width']/2),
+            'y1': int(num_y - lane['avg_height']/2),
+            'y2': int(num_y + lane['avg_height']/2)
+        }
+
     #step 6
-    # run paddle ocr on each move box and also do chess validation
-    # use beam search to get multiple candidates and then validate using
-    # against hte current board position using python-chess
+    # run paddle ocr on each move box and also do chess validation, in two phases:
+    # recognize_cells reads every cell in batched calls (recognition does not depend
+    # on the board), then validate_moves replays the readings in move order.
+    # with the lexicon decoder the legal moves of the current position are scored
+    # directly on the CTC posteriors (GameSearch keeps the best few move sequences
+    # rather than the first legal reading), with the beam decoder we get multiple
+    # candidates and then validate them against hte current board using python-chess
     # also increaes the width and height a bit to get a better read
-    def step6_ocr_moves(self, img, rows):
-        h, w = img.shape[:2]
-        board = chess.Board() 
-        
-        # check number of consecnutivey invalid notations
-        consecutive_invalid = 0
-        # Stop after 2 consecutive zero-confidence black moves
-        MAX_CONSECUTIVE_INVALID = 2  
-        # Below this, treat as junk or game ended
-        MIN_OCR_CONFIDENCE = 0.3 
-        
-        # do moves in order for validation
+    # timings (optional) gets the game search counters
+    def step6_ocr_moves(self, img, rows, timings=None):
+        nums = sorted(rows.keys())
+        chunk = OCR_CHUNK_ROWS or max(len(nums), 1)
+        validator = self.make_validator()
+        
+        # read a chunk of rows, validate it, and only read the next chunk if the game goes on
+        for start in range(0, len(nums), chunk):
+            chunk_nums = nums[start:start + chunk]
+            if not validator.ended:
+                self.recognize_cells(img, rows, chunk_nums)
+            for num in chunk_nums:
+                validator.add_row(num, rows[num])
+        if isinstance(validator, GameSearch):
+            spent = " (budget spent, rest greedy)" if validator.exhausted else ""
+            print(f"  Game search: beam {validator.beam_width}, {validator.scored} positions scored "
+                  f"in {validator.elapsed:.2f}s{spent}")
+            if timings is not None:
+                timings['search_scored'] = validator.scored
+                timings['search_exhausted'] = int(validator.exhausted)
+        return validator.rows
+    
+    # posteriors (and beam candidates) for the associated cells of the given rows (all
+    # rows by default), cached on the row as rows[num]['white_ocr'] / ['black_ocr'] = {'probs', 'candidates'}
+    def recognize_cells(self, img, rows, nums=None):
+        h = img.shape[0]
+        nums = sorted(rows.keys()) if nums is None else nums
+        cells = [(num, ctype) for num in nums for ctype in ('white', 'black')
+                 if rows[num].get(f'{ctype}_box')]
+        if not cells:
+            return rows
+        regions = [self.get_expanded_region(img, rows[num][f'{ctype}_box'], h) for num, ctype in cells]
+        results = self.ocr_regions(img, regions, decode=(MOVE_DECODER == 'beam'))
+        for (num, ctype), (probs, candidates) in zip(cells, results):
+            rows[num][f'{ctype}_ocr'] = {'probs': probs, 'candidates': candidates}
+        return rows
+    
+    def validate_moves(self, rows, corrections=None, min_fit=LEXICON_MIN_FIT, max_consecutive_invalid=2):
+        """Replay the cached cell readings through python-chess in move order.
+        
+        Only reads the rows (the *_ocr entries from recognize_cells), the result is
+        a new dict of rows, so validation can be re-run cheaply with other
+        thresholds or after a user correction.
+        
+        Args:
+            corrections: {(move number, 'white'|'black'): san} moves fixed by the user
+            min_fit: lexicon decoder threshold, see LEXICON_MIN_FIT
+            max_consecutive_invalid: stop after this many consecutive zero-confidence
+                black moves (the game has ended)
+        """
+        # no time budget, the same readings must always validate to the same rows
+        validator = self.make_validator(corrections, min_fit, max_consecutive_invalid, deterministic=True)
         for num in sorted(rows.keys()):
-            row = rows[num]
-            
-            # Check for early stopping
-            if consecutive_invalid >= MAX_CONSECUTIVE_INVALID:
-                # Remove remaining rows - game has ended
-                for remove_num in sorted(rows.keys()):
-                    if remove_num >= num:
-                        rows[remove_num]['white_text'] = ''
-                        rows[remove_num]['black_text'] = ''
-                break
-            
-            white_valid_san = False
-            black_valid_san = False
-            white_conf = 0.0
-            black_conf = 0.0
-            
-            # OCR and validate white move
-            if row.get('white_box'):
-                crop = self.get_expanded_crop(img, row['white_box'], h)
-                candidates = self.ocr_single_box(crop, return_candidates=True)
-                
-                best_text = ''
-                if candidates:
-                    raw_text, raw_prob = candidates[0]
-                    white_conf = float(raw_prob)  # Store for early stopping check
-                    
-                    # First, try to validate the raw OCR text directly (no expansion)
-                    direct_move = None
-                    try:
-                        direct_move = board.parse_san(raw_text)
-                        white_valid_san = True  # Valid SAN syntax
-                    except:
-                        pass
-                    
-                    if direct_move and direct_move in board.legal_moves:
-                        # Raw OCR validates directly - use it
-                        best_text = board.san(direct_move)
-                        board.push(direct_move)
-                        white_valid_san = True
-                    elif raw_prob > 0.95:
-                        # High confidence but doesn't validate - trust OCR anyway
-                        best_text = raw_text
-                        # Check if it's at least valid SAN syntax
-                        try:
-                            board.parse_san(raw_text)
-                            white_valid_san = True
-                        except:
-                            pass
-                    else:
-                        # Try candidates with expansion
-                        for text, prob in candidates:
-                            move = self.try_parse_move(board, text)
-                            if move:
-                                best_text = board.san(move)
-                                board.push(move)
-                                white_valid_san = True
-                                break
-                        else:
-                            best_text = raw_text
-                
-                rows[num]['white_text'] = best_text
-                rows[num]['white_candidates'] = candidates[:5]
+            validator.add_row(num, rows[num])
+        return validator.rows
+    
+    # game search for the lexicon decoder when the beam is wider than 1, else the greedy validator
+    # deterministic drops the time budget, the search then only stops at search_max_scored
+    def make_validator(self, corrections=None, min_fit=LEXICON_MIN_FIT, max_consecutive_invalid=2,
+                       deterministic=False):
+        if MOVE_DECODER == 'lexicon' and self.search_beam > 1:
+            return GameSearch(self, corrections, min_fit, max_consecutive_invalid,
+                              beam_width=self.search_beam,
+                              time_budget=None if deterministic else self.search_time_budget,
+                              max_scored=self.search_max_scored)
+        return MoveValidator(self, corrections, min_fit, max_consecutive_invalid)
+    
+    # a move typed in by the user, pushed if legal and kept as typed otherwise
+    def apply_correction(self, board, san):
+        index = san_index(board)
+        move = index.lookup(san)
+        if move is None:
+            return san, [(san, 1.0)], 1.0
+        text = index.san_of[move]
+        board.push(move)
+        return text, [(text, 1.0)], 1.0
+
+    # pick the move for one cell and push it on the board if legal
+    # returns (text, candidates, confidence), confidence feeds the early stop check
+    def resolve_move(self, board, probs, candidates, min_fit=LEXICON_MIN_FIT):
+        if MOVE_DECODER == 'lexicon':
+            return self.resolve_move_lexicon(board, probs, min_fit)
+        
+        best_text = ''
+        conf = 0.0
+        if candidates:
+            raw_text, raw_prob = candidates[0]
+            conf = float(raw_prob)
             
-            # OCR and validate black move
-            if row.get('black_box'):
-                crop = self.get_expanded_crop(img, row['black_box'], h)
-                candidates = self.ocr_single_box(crop, return_candidates=True)
-                
-                best_text = ''
-                if candidates:
-                    raw_text, raw_prob = candidates[0]
-                    black_conf = float(raw_prob)  # Store for early stopping check
-                    
-                    # First, try to validate the raw OCR text directly (no expansion)
-                    direct_move = None
-                    try:
-                        direct_move = board.parse_san(raw_text)
-                        black_valid_san = True  # Valid SAN syntax
-                    except:
-                        pass
-                    
-                    if direct_move and direct_move in board.legal_moves:
-                        # Raw OCR validates directly - use it
-                        best_text = board.san(direct_move)
-                        board.push(direct_move)
-                        black_valid_san = True
-                    elif raw_prob > 0.95:
-                        # High confidence but doesn't validate - trust OCR anyway
-                        best_text = raw_text
-                        # Check if it's at least valid SAN syntax
-                        try:
-                            board.parse_san(raw_text)
-                            black_valid_san = True
-                        except:
-                            pass
-                    else:
-                        # Try candidates with expansion
-                        for text, prob in candidates:
-                            move = self.try_parse_move(board, text)
-                            if move:
-                                best_text = board.san(move)
-                                board.push(move)
-                                black_valid_san = True
-                                break
-                        else:
-                            best_text = raw_text
-                
-                rows[num]['black_text'] = best_text
-                rows[num]['black_candidates'] = candidates[:5]
+            # First, try to validate the raw OCR text directly (no expansion)
+            index = san_index(board)
+            direct_move = index.lookup(raw_text)
             
-            # Update consecutive invalid counter
-            # Stop after 2 consecutive zero-confidence black moves (indicates game ended)
-            if black_conf == 0.0:
-                consecutive_invalid += 1
+            if direct_move:
+                # Raw OCR validates directly - use it
+                best_text = index.san_of[direct_move]
+                board.push(direct_move)
+            elif raw_prob > 0.95:
+                # High confidence but doesn't validate - trust OCR anyway
+                best_text = raw_text
             else:
-                consecutive_invalid = 0  # Reset if we see any black move with confidence
+                # Try candidates with expansion
+                for text, prob in candidates:
+                    move = self.try_parse_move(board, text)
+                    if move:
+                        best_text = index.san_of[move]
+                        board.push(move)
+                        break
+                else:
+                    best_text = raw_text
         
-        return rows
-
-    #expanded crop resizeto match training ratio    
-    def get_expanded_crop(self, img, box, h):
+        return best_text, candidates, conf
+    
+    # lexicon decoder: candidates are the legal moves ranked by their CTC likelihood
+    def resolve_move_lexicon(self, board, probs, min_fit=LEXICON_MIN_FIT):
+        if probs is None:
+            return '', [('', 0.0)], 0.0
+        
+        # the best path is all blanks, the cell is empty
+        raw_text, _ = greedy_decode(probs, self.move_ocr.chars)
+        if not raw_text:
+            return '', [('', 0.0)], 0.0
+        
+        ranked, fit = self.score_legal_moves(board, probs)
+        if ranked and fit >= min_fit:
+            best_san, best_prob = ranked[0]
+            board.push(san_index(board).by_san[best_san])
+            return best_san, ranked[:10], best_prob
+        
+        # nothing legal fits, keep the free-form reading so it shows up as invalid
+        max_probs = probs.max(axis=1)
+        conf = float(np.mean(max_probs[max_probs > 0.1])) if len(max_probs[max_probs > 0.1]) > 0 else 0.0
+        return raw_text, [(raw_text, conf)], conf
+    
+    def score_legal_moves(self, board, probs):
+        """Score every legal move against one cell's CTC posteriors.
+        
+        Returns:
+            ranked: [(san, prob)] over legal moves, best first (probs sum to 1)
+            fit: log p(best move) - log p(best CTC path), how well the best
+                 legal move explains the cell at all
+        """
+        ranked, fits = self.rank_legal_moves(board, probs)
+        return ranked, (float(fits[0]) if ranked else -np.inf)
+    
+    # (ranked, fits) with the fit of every ranked move, fits[i] belongs to ranked[i]
+    def rank_legal_moves(self, board, probs):
+        sans, words, owners = self.legal_move_lexicon(board)
+        if not sans:
+            return [], np.zeros(0)
+        
+        word_ll = ctc_word_log_likelihoods(probs, words, self.move_ocr.char_index)
+        move_ll = np.full(len(sans), -np.inf)
+        np.logaddexp.at(move_ll, owners, word_ll)
+        
+        best = move_ll.max()
+        if not np.isfinite(best):
+            return [], np.zeros(0)
+        _, path_ll = greedy_decode(probs, self.move_ocr.chars)
+        
+        post = np.exp(move_ll - best)
+        post /= post.sum()
+        order = np.argsort(-post)
+        return [(sans[i], float(post[i])) for i in order], move_ll[order] - path_ll
+    
+    # legal SAN strings plus the common ways they get written on a sheet
+    # (no check/mate suffix, no capture x, 0 for O in castling, promotion without =)
+    # returns (sans, words, owners) where owners[i] is the index in sans of words[i]
+    # built once per position and kept on the position's SanIndex
+    def legal_move_lexicon(self, board):
+        index = san_index(board)
+        if index.lexicon is not None:
+            return index.lexicon
+        sans = index.sans
+        words = []
+        owners = []
+        for i, san in enumerate(sans):
+            bare = san.rstrip('+#')
+            variants = {san, bare, bare.replace('x', ''), bare.replace('=', '')}
+            if bare.startswith('O-O'):
+                variants.add(bare.replace('O', '0'))
+            for v in variants:
+                words.append(v)
+                owners.append(i)
+        index.lexicon = (sans, words, np.array(owners, dtype=np.int64))
+        return index.lexicon
+    
+    # cell region expanded by 10px height, 3px width on each side, clipped to the image
+    # the recognizer resizes it once, straight to model input size
+    def get_expanded_region(self, img, box, h):
         w_img = img.shape[1]
-        # Expand by 10px height, 3px width on each side
         y1 = max(0, box['y1'] - 10)
         y2 = min(h, box['y2'] + 10)
         x1 = max(0, box['x1'] - 3)
         x2 = min(w_img, box['x2'] + 3)
-        crop = img[y1:y2, x1:x2]
-        
-        if crop.size > 0:
-            # Resize to match training data dimensions
-            # Training is around907x170 avg so weneed height=170 with same aspect ratio
-            target_height = 170
-            crop_h, crop_w = crop.shape[:2]
-            scale = target_height / crop_h
-            target_width = int(crop_w * scale)
-            crop = cv2.resize(crop, (target_width, target_height), 
-                              interpolation=cv2.INTER_CUBIC)
-        return crop
+        return x1, y1, x2, y2
 
     #check if OCR returned valid chess move    
     def try_parse_move(self, board, text):
@@ -1209,36 +2137,13 @@ class ScoresheetPipeline:
                 text + '#',  # Missing mate
             ])
         
+        # ambiguous moves like "Nd2" are resolved to the first file (a-h), then rank (1-8)
+        # disambiguation that makes them unique
+        index = san_index(board)
         for cand in candidates:
-            try:
-                move = board.parse_san(cand)
-                if move in board.legal_moves:
-                    return move
-            except ValueError as e:
-                # Handle ambiguous moves like "Nd2" -> try "Nbd2", "Nfd2", etc.
-                if 'ambiguous' in str(e).lower() and len(cand) >= 2:
-                    piece = cand[0]
-                    rest = cand[1:]
-                    # Try adding file disambiguation (a-h)
-                    for file_char in 'abcdefgh':
-                        try:
-                            disambig = piece + file_char + rest
-                            move = board.parse_san(disambig)
-                            if move in board.legal_moves:
-                                return move
-                        except:
-                            pass
-                    # Try adding rank disambiguation (1-8)
-                    for rank_char in '12345678':
-                        try:
-                            disambig = piece + rank_char + rest
-                            move = board.parse_san(disambig)
-                            if move in board.legal_moves:
-                                return move
-                        except:
-                            pass
-            except:
-                pass
+            move = index.lookup(cand, disambiguate=True)
+            if move is not None:
+                return move
         
         return None
 
@@ -1255,8 +2160,16 @@ class ScoresheetPipeline:
         except Exception as e:
             return [('', 0.0)] if return_candidates else ''
     
+    # batched version of ocr_single_box(return_candidates=True) over regions of img,
+    # one (probs, candidates) per region, with decode=False candidates is None
+    def ocr_regions(self, img, regions, decode=True):
+        try:
+            return self.move_ocr.recognize_regions(img, regions, beam_width=30, top_k=10, decode=decode)
+        except Exception as e:
+            return [(None, [('', 0.0)]) for _ in regions]
+    
     def visualize(self, img, rows, output_path):
-        viz = img.copy()
+        viz = img.render().copy()
         
         for num, row in rows.items():
             y = int(row['y'])            
@@ -1279,7 +2192,7 @@ def main():
     
     pipeline = ScoresheetPipeline()
     
-    rows, img = pipeline.process(img_path, zoom=2)
+    rows, img, timings = pipeline.process(img_path)
     pipeline.visualize(img, rows, 'viz_clean_pipeline.jpg')
     
     print(f"Final: Total rows: {len(rows)}")
@@ -1,6 +1,6 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, send_file
 from flask_cors import CORS
-import tempfile, os, io, base64, sys, re
+import tempfile, os, io, base64, sys, re, time, uuid, threading, contextlib
 import chess.pgn, chess
 from datetime import datetime
 import cv2
@@ -8,7 +8,10 @@ import numpy as np
 from PIL import Image
 
 sys.path.insert(0, '.')
-from scoresheet_pipeline import ScoresheetPipeline as SP
+from scoresheet_pipeline import ScoresheetPipeline as SP, MOVE_DECODER
+from san_index import san_index
+from metrics import REGISTRY, COUNT_BUCKETS
+from batching import MicroBatcher
 
 app = Flask(__name__)
 
@@ -22,15 +25,168 @@ CORS(app, resources={
             "http://127.0.0.1:*"
         ],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "X-Profile-Token"]
     }
 })
 
-pipe = SP()
+# inference backend, 'cpu' or 'gpu:N'
+OCR_DEVICE = os.environ.get('OCR_DEVICE', 'cpu')
+# math threads per predictor and number of requests that can recognize cells at once
+OCR_CPU_THREADS = int(os.environ.get('OCR_CPU_THREADS', 4))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', 2))
+# 'int8' loads the quantized move model from OCR_INT8_MODEL if it passed its accuracy gate
+OCR_PRECISION = os.environ.get('OCR_PRECISION', 'fp32')
+OCR_INT8_MODEL = os.environ.get('OCR_INT8_MODEL', 'PaddleOCR/output/chess_black_only/inference_int8')
+# scoresheet template index, loaded at startup and extended with sheets that read as legal games
+OCR_TEMPLATES = os.environ.get('OCR_TEMPLATES', 'data/templates.npz')
+OCR_LEARN_TEMPLATES = os.environ.get('OCR_LEARN_TEMPLATES', '1') == '1'
+# step 6 game search: move sequences kept (1 = greedy, each extra one adds about a greedy
+# pass of search time) and per-request budgets, search time and positions scored (~3 ms each)
+OCR_SEARCH_BEAM = int(os.environ.get('OCR_SEARCH_BEAM', 1))
+OCR_SEARCH_BUDGET_MS = float(os.environ.get('OCR_SEARCH_BUDGET_MS', 500))
+OCR_SEARCH_MAX_SCORED = int(os.environ.get('OCR_SEARCH_MAX_SCORED', 150))
+# admin token for profile=true on /ocr (sent as X-Profile-Token), profiling is off when unset
+OCR_PROFILE_TOKEN = os.environ.get('OCR_PROFILE_TOKEN', '')
+OCR_PROFILE_DIR = os.environ.get('OCR_PROFILE_DIR', 'profiles')
+# profiles of this many most recent profiled requests are kept, older ones are deleted
+OCR_PROFILE_KEEP = int(os.environ.get('OCR_PROFILE_KEEP', 50))
+# step 6 cells of concurrent requests are recognized together: a batch waits at most
+# OCR_BATCH_WAIT_MS for other requests' cells or until OCR_BATCH_CELLS are queued (0 ms disables)
+OCR_BATCH_WAIT_MS = float(os.environ.get('OCR_BATCH_WAIT_MS', 5))
+OCR_BATCH_CELLS = int(os.environ.get('OCR_BATCH_CELLS', 64))
+# a request fails (500) if its cells were not recognized within this many seconds
+OCR_BATCH_TIMEOUT_S = float(os.environ.get('OCR_BATCH_TIMEOUT_S', 60))
+# warmup before /ready: 'stages' runs a synthetic sheet through every stage, 'full' also
+# builds the PaddleOCR number fallback, 'off' skips it
+OCR_WARMUP = os.environ.get('OCR_WARMUP', 'stages')
+# how long an /ocr request that arrives during startup waits for the pipeline
+OCR_STARTUP_WAIT_S = float(os.environ.get('OCR_STARTUP_WAIT_S', 120))
+
+# the pipeline is loaded and warmed up in the background, the server answers /ready
+# and /metrics right away and /ocr waits for it
+pipe = None
+pipe_ready = threading.Event()
+startup = {'status': 'starting', 'error': None, 'load_s': None, 'warmup_s': None}
+
+def load_pipeline():
+    global pipe
+    try:
+        t0 = time.perf_counter()
+        p = SP(device=OCR_DEVICE, cpu_threads=OCR_CPU_THREADS, pool_size=OCR_WORKERS,
+               move_ocr_precision=OCR_PRECISION, quantized_ocr_path=OCR_INT8_MODEL,
+               template_path=OCR_TEMPLATES or None, learn_templates=OCR_LEARN_TEMPLATES,
+               search_beam=OCR_SEARCH_BEAM, search_time_budget=OCR_SEARCH_BUDGET_MS / 1000,
+               search_max_scored=OCR_SEARCH_MAX_SCORED)
+        if OCR_BATCH_WAIT_MS > 0:
+            p.move_ocr = MicroBatcher(p.move_ocr, max_wait=OCR_BATCH_WAIT_MS / 1000, max_cells=OCR_BATCH_CELLS,
+                                      workers=OCR_WORKERS, on_batch=record_batch, timeout=OCR_BATCH_TIMEOUT_S)
+        startup['load_s'] = round(time.perf_counter() - t0, 2)
+        if OCR_WARMUP != 'off':
+            t0 = time.perf_counter()
+            p.warmup(full=OCR_WARMUP == 'full')
+            startup['warmup_s'] = round(time.perf_counter() - t0, 2)
+        pipe = p
+        startup['status'] = 'ready'
+        print(f"pipeline ready (load {startup['load_s']}s, warmup {startup['warmup_s']}s)")
+    except Exception as e:
+        startup['status'] = 'failed'
+        startup['error'] = str(e)
+        print(f"pipeline failed to load: {e}")
+    finally:
+        pipe_ready.set()
+
+# pipeline timings that are stage latencies, reported as ocr_stage_seconds{stage=...}
+STAGES = ['step1_yolo', 'step2_deskew', 'template_match', 'step3_numbers', 'step4_extrap', 'step5_assoc', 'step6_ocr']
+# fallback paths flagged in the timings, reported as ocr_fallback_total{path=...}
+FALLBACKS = {'number_fallback': 'number_ocr_fallback', 'geometry_fallback': 'geometry_to_ocr',
+             'search_exhausted': 'search_budget_greedy'}
+
+# status is ok, error (500) or the HTTP code of a rejected request (400, 403, 429, 503)
+REQ_LAT = REGISTRY.histogram('ocr_request_seconds', 'End-to-end /ocr request latency', ['status'])
+STAGE_LAT = REGISTRY.histogram('ocr_stage_seconds', 'Pipeline stage latency', ['stage'])
+QUEUE_WAIT = REGISTRY.histogram('ocr_queue_wait_seconds', 'Time a request waited for a recognizer predictor or batch')
+CELLS = REGISTRY.histogram('ocr_cells_recognized', 'Move cells recognized per request', buckets=COUNT_BUCKETS)
+REDETECT = REGISTRY.counter('ocr_yolo_redetections_total', 'YOLO runs repeated on the deskewed page')
+FALLBACK = REGISTRY.counter('ocr_fallback_total', 'Requests that took a fallback path', ['path'])
+TEMPLATE = REGISTRY.counter('ocr_template_hits_total', 'Requests whose layout came from a scoresheet template')
+MOVES = REGISTRY.counter('ocr_moves_total', 'Validated moves by outcome', ['outcome'])
+BATCH_CELLS = REGISTRY.histogram('ocr_batch_cells', 'Move cells per recognizer batch', buckets=COUNT_BUCKETS)
+BATCH_REQUESTS = REGISTRY.histogram('ocr_batch_requests', 'Request submissions merged into one recognizer batch',
+                                    buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+
+def record_batch(cells, submissions):
+    BATCH_CELLS.observe(cells)
+    BATCH_REQUESTS.observe(submissions)
+
+def record_metrics(timings, vals):
+    for stage in STAGES:
+        if stage in timings:
+            STAGE_LAT.observe(timings[stage], stage=stage)
+    QUEUE_WAIT.observe(timings.get('queue_wait', 0.0))
+    CELLS.observe(timings.get('cells_recognized', 0))
+    REDETECT.inc(timings.get('yolo_redetections', 0))
+    TEMPLATE.inc(timings.get('template_hit', 0))
+    for key, path in FALLBACKS.items():
+        if timings.get(key):
+            FALLBACK.inc(path=path)
+    for m in vals:
+        for side in ('white', 'black'):
+            ent = m[side]
+            if not ent: continue
+            if not ent.get('valid'): MOVES.inc(outcome='invalid')
+            elif ent.get('original'): MOVES.inc(outcome='fixed')
+            else: MOVES.inc(outcome='valid')
+
+# one profiled request at a time, a profiler hooks the whole interpreter
+prof_lock = threading.Lock()
+
+def profile_allowed():
+    return bool(OCR_PROFILE_TOKEN) and request.headers.get('X-Profile-Token') == OCR_PROFILE_TOKEN
+
+def run_profiled(req_id, fn, *args, **kwargs):
+    """Run fn under cProfile and store the profile as PROFILE_DIR/<req_id>.prof
+    (pstats format, e.g. for snakeviz) plus a .txt summary: stage timings, then
+    the call tree sorted by cumulative time. The pipeline stages are methods of
+    ScoresheetPipeline, so they show up as nested entries under process().
+    cProfile only sees the calling thread, so the request recognizes its own cells
+    instead of handing them to the MicroBatcher threads."""
+    import cProfile, pstats
+    batcher = pipe.move_ocr if isinstance(pipe.move_ocr, MicroBatcher) else None
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        with batcher.direct() if batcher else contextlib.nullcontext():
+            res = fn(*args, **kwargs)
+    finally:
+        prof.disable()
+        os.makedirs(OCR_PROFILE_DIR, exist_ok=True)
+        prof.dump_stats(os.path.join(OCR_PROFILE_DIR, f'{req_id}.prof'))
+        prune_profiles()
+    with open(os.path.join(OCR_PROFILE_DIR, f'{req_id}.txt'), 'w') as out:
+        out.write(f"request {req_id}\n\nstage timings (s):\n")
+        for k, v in sorted(res[2].items()):
+            out.write(f"  {k:20s} {float(v):.4f}\n")
+        out.write("\n")
+        pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(80)
+    return res
+
+def prune_profiles():
+    # .prof/.txt pairs by request id, newest first, everything past OCR_PROFILE_KEEP goes
+    stamps = {}
+    for name in os.listdir(OCR_PROFILE_DIR):
+        stem, ext = os.path.splitext(name)
+        if ext in ('.prof', '.txt') and re.fullmatch(r'[0-9a-f]{32}', stem):
+            mtime = os.path.getmtime(os.path.join(OCR_PROFILE_DIR, name))
+            stamps[stem] = max(stamps.get(stem, 0.0), mtime)
+    for stem in sorted(stamps, key=stamps.get, reverse=True)[OCR_PROFILE_KEEP:]:
+        for ext in ('.prof', '.txt'):
+            try: os.unlink(os.path.join(OCR_PROFILE_DIR, stem + ext))
+            except FileNotFoundError: pass
 
 def fix_mv(txt, b):
-    # try to match valid moves if ocr messed up
-    legals = [b.san(m) for m in b.legal_moves]
+    # try to match valid moves if ocr messed up, 'beam' decoder only: a lexicon
+    # reading that is not a legal move was rejected on purpose
+    legals = san_index(b).by_san
     
     if txt in legals: return txt, 1.0
     
@@ -75,26 +231,22 @@ def gen_pgn(rows):
             ok = False
             real = wt
             
-            try:
-                m = b.parse_san(wt)
-                if m in b.legal_moves:
-                    node = node.add_variation(m)
-                    b.push(m)
-                    ok = True
-            except: pass
+            m = san_index(b).lookup(wt)
+            if m:
+                node = node.add_variation(m)
+                b.push(m)
+                ok = True
             
-            if not ok:
+            if not ok and MOVE_DECODER == 'beam':
                 f, score = fix_mv(wt, b)
                 if f:
-                    try:
-                        m = b.parse_san(f)
-                        node = node.add_variation(m)
-                        b.push(m)
-                        real = f
-                        ok = True
-                        fix_cnt += 1
-                        print(f" fixed: {wt} -> {f}")
-                    except: pass
+                    m = san_index(b).by_san[f]
+                    node = node.add_variation(m)
+                    b.push(m)
+                    real = f
+                    ok = True
+                    fix_cnt += 1
+                    print(f" fixed: {wt} -> {f}")
             
             if ok:
                 ent['white'] = {'text': real, 'valid': True, 'original': wt if real != wt else None}
@@ -107,26 +259,22 @@ def gen_pgn(rows):
             ok = False
             real = bt
             
-            try:
-                m = b.parse_san(bt)
-                if m in b.legal_moves:
-                    node = node.add_variation(m)
-                    b.push(m)
-                    ok = True
-            except: pass
+            m = san_index(b).lookup(bt)
+            if m:
+                node = node.add_variation(m)
+                b.push(m)
+                ok = True
             
-            if not ok:
+            if not ok and MOVE_DECODER == 'beam':
                 f, score = fix_mv(bt, b)
                 if f:
-                    try:
-                        m = b.parse_san(f)
-                        node = node.add_variation(m)
-                        b.push(m)
-                        real = f
-                        ok = True
-                        fix_cnt += 1
-                        print(f" fixed: {bt} -> {f}")
-                    except: pass
+                    m = san_index(b).by_san[f]
+                    node = node.add_variation(m)
+                    b.push(m)
+                    real = f
+                    ok = True
+                    fix_cnt += 1
+                    print(f" fixed: {bt} -> {f}")
             
             if ok:
                 ent['black'] = {'text': real, 'valid': True, 'original': bt if real != bt else None}
@@ -186,6 +334,17 @@ def get_move_details(rows):
 
 @app.route('/ocr', methods=['POST'])
 def process():
+    # every exit is timed, rejected requests included
+    t_req = time.perf_counter()
+    resp = None
+    try:
+        resp = ocr_request()
+        return resp
+    finally:
+        code = resp[1] if isinstance(resp, tuple) else 200 if resp is not None else 500
+        REQ_LAT.observe(time.perf_counter() - t_req, status={200: 'ok', 500: 'error'}.get(code, str(code)))
+
+def ocr_request():
     if 'image' not in request.files: return jsonify({'error': 'no img'}), 400
     
     f = request.files['image']
@@ -193,7 +352,14 @@ def process():
     
     inc_mv = request.form.get('include_moves', 'false').lower() == 'true'
     inc_viz = request.form.get('include_viz', 'false').lower() == 'true'
-    zoom = int(request.form.get('zoom', 2))
+    inc_tm = request.form.get('include_timings', 'false').lower() == 'true'
+    prof = request.form.get('profile', 'false').lower() == 'true'
+    if prof and not profile_allowed(): return jsonify({'error': 'profiling not allowed'}), 403
+    if not pipe_ready.wait(OCR_STARTUP_WAIT_S) or pipe is None:
+        return jsonify({'error': f"pipeline {startup['status']}"}), 503
+    # page zoom is picked from the measured cell height unless the client fixes it
+    zoom = request.form.get('zoom')
+    zoom = float(zoom) if zoom else None
     
     tmp_path = None
     try:
@@ -202,16 +368,26 @@ def process():
             f.save(tmp.name)
             tmp_path = tmp.name
         
-        # viz img load
-        img = cv2.imread(tmp_path)
-        
         print("running pipeline...")
-        res = pipe.process(tmp_path, zoom=zoom)
+        req_id = None
+        if prof:
+            if not prof_lock.acquire(blocking=False):
+                os.unlink(tmp_path)
+                return jsonify({'error': 'profiler busy'}), 429
+            try:
+                req_id = uuid.uuid4().hex
+                res = run_profiled(req_id, pipe.process, tmp_path, zoom=zoom)
+            finally:
+                prof_lock.release()
+        else:
+            res = pipe.process(tmp_path, zoom=zoom)
         rows = res[0]
         img = res[1]
+        tm = res[2]
         
         # make pgn
         pgn, vals = gen_pgn(rows)
+        record_metrics(tm, vals)
         
         # stats calculation
         tot = 0
@@ -259,13 +435,19 @@ def process():
             'ocr_method': 'paddle'
         }
         
+        if req_id:
+            resp['profile_id'] = req_id
+        
+        if inc_tm:
+            resp['timings'] = {k: round(float(v), 4) for k, v in tm.items()}
+        
         if inc_mv:
             w_mvs, b_mvs = get_move_details(rows)
             resp['white_moves'] = w_mvs
             resp['black_moves'] = b_mvs
         
         if inc_viz:
-            v_img = img.copy()
+            v_img = img.render().copy()
             for n, r in rows.items():
                 # w box
                 if r.get('white_box'):
@@ -297,6 +479,28 @@ def process():
             except: pass
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # 200 once the pipeline is loaded and warmed up, 503 while starting or if loading failed
+    return jsonify(startup), 200 if startup['status'] == 'ready' else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles/<req_id>', methods=['GET'])
+def get_profile(req_id):
+    if not profile_allowed(): return jsonify({'error': 'profiling not allowed'}), 403
+    if not re.fullmatch(r'[0-9a-f]{32}', req_id): return jsonify({'error': 'bad id'}), 400
+    # ?format=prof for the raw pstats file, txt summary by default
+    ext = 'prof' if request.args.get('format') == 'prof' else 'txt'
+    path = os.path.abspath(os.path.join(OCR_PROFILE_DIR, f'{req_id}.{ext}'))
+    if not os.path.exists(path): return jsonify({'error': 'not found'}), 404
+    return send_file(path, as_attachment=True, download_name=f'{req_id}.{ext}')
+
+# started once everything it uses is defined
+threading.Thread(target=load_pipeline, name='pipeline-loader', daemon=True).start()
+
 if __name__ == '__main__':
     print("Start server :8080")
-    app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
\ No newline at end of file
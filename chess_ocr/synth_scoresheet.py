@@ -0,0 +1,334 @@
+"""
+Synthetic scoresheet generator for load and scaling tests
+
+Renders PGN games (or random legal games) as scoresheet photos in the 2-, 4- and
+6-column layouts that detect_column_layout recognizes (1, 2 or 3 blocks of
+number / white / black columns). Moves are written with handwriting-like fonts
+(the Hershey script fonts, or TTF fonts given with --fonts) with per-character
+jitter, and each page gets random skew, perspective, blur, noise and lighting.
+Rows after the last move stay empty.
+
+Every game goes on one sheet of at most MAX_MOVES moves from the initial
+position, the most the pipeline reads (step 6 only knows move numbers 1-60 and
+replays from the starting board). Moves past the sheet are left out, 4- and
+6-column sheets of a 120+ ply game are full 60-move sheets, the worst case for
+step 6 latency.
+
+For every image there is a .pgn with the game as written on the sheet (what
+benchmarks/bench_corpus.py scores against) and a .json with the ground truth:
+layout, moves, and the box of every number, white and black cell in image
+pixels (after distortion).
+
+Usage:
+    python synth_scoresheet.py --pgn games.pgn --out synth/ --layouts 2 4 6
+    python synth_scoresheet.py --random 20 --plies 160 --layouts 4 6 --out synth_full/ --seed 1
+"""
+
+import argparse
+import json
+import os
+
+import chess
+import chess.pgn
+import cv2
+import numpy as np
+
+from scoresheet_pipeline import NUMBER_LEXICON
+
+# A4 portrait at 150 dpi
+PAGE_W, PAGE_H = 1240, 1754
+MARGIN = 60
+HEADER_H = 170
+# blocks of (number, white, black) columns and rows per block for each layout
+LAYOUTS = {2: (1, 40), 4: (2, 30), 6: (3, 20)}
+# number column width as a fraction of the block width, the rest is split white/black
+NUMBER_FRAC = 0.16
+# moves per sheet, step 6 reads move numbers 1-60 only
+MAX_MOVES = len(NUMBER_LEXICON)
+HERSHEY_FONTS = (cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, cv2.FONT_HERSHEY_SCRIPT_COMPLEX,
+                 cv2.FONT_HERSHEY_SIMPLEX | cv2.FONT_ITALIC, cv2.FONT_HERSHEY_PLAIN)
+
+
+def read_games(pgn_path):
+    """SAN move lists of every game in a PGN file that starts from the initial position."""
+    games = []
+    with open(pgn_path) as f:
+        while True:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            board = game.board()
+            if board.fen() != chess.STARTING_FEN:
+                print(f"  skipping a game from a set-up position ({board.fen()}), step 6 starts from the initial board")
+                continue
+            sans = []
+            for move in game.mainline_moves():
+                sans.append(board.san(move))
+                board.push(move)
+            games.append(sans)
+    return games
+
+
+def random_game(rng, plies):
+    """Random legal game of up to plies half-moves (shorter if it ends early)."""
+    board = chess.Board()
+    sans = []
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = moves[int(rng.integers(len(moves)))]
+        sans.append(board.san(move))
+        board.push(move)
+    return sans
+
+
+def sheet_rows(layout, rows=None):
+    """Rows per block: the layout default or rows, at most MAX_MOVES moves on the sheet."""
+    blocks, default_rows = LAYOUTS[layout]
+    return min(rows or default_rows, MAX_MOVES // blocks)
+
+
+def cell_grid(layout, rows):
+    """Undistorted cell boxes: {(move number, 'number'|'white'|'black'): (x1, y1, x2, y2)}."""
+    blocks = LAYOUTS[layout][0]
+    block_w = (PAGE_W - 2 * MARGIN) / blocks
+    row_h = (PAGE_H - HEADER_H - 2 * MARGIN) / rows
+    num_w = block_w * NUMBER_FRAC
+    move_w = (block_w - num_w) / 2
+    cells = {}
+    for b in range(blocks):
+        x0 = MARGIN + b * block_w
+        for r in range(rows):
+            num = 1 + b * rows + r
+            y1 = MARGIN + HEADER_H + r * row_h
+            y2 = y1 + row_h
+            cells[(num, 'number')] = (x0, y1, x0 + num_w, y2)
+            cells[(num, 'white')] = (x0 + num_w, y1, x0 + num_w + move_w, y2)
+            cells[(num, 'black')] = (x0 + num_w + move_w, y1, x0 + block_w, y2)
+    return cells, blocks * rows
+
+
+class Handwriting:
+    """Writes strings into cells with one of the fonts, jittering every character."""
+
+    def __init__(self, rng, ttf_paths=()):
+        self.rng = rng
+        self.ttf_paths = list(ttf_paths)
+        # one writer per sheet: font, size, slant and stroke stay consistent on a page
+        self.use_ttf = bool(self.ttf_paths) and rng.random() < 0.7
+        self.font = self.ttf_paths[int(rng.integers(len(self.ttf_paths)))] if self.use_ttf \
+            else HERSHEY_FONTS[int(rng.integers(len(HERSHEY_FONTS)))]
+        self.size = rng.uniform(0.55, 0.75)
+        self.slant = rng.uniform(-0.35, 0.1)
+        self.thickness = int(rng.integers(1, 3))
+        self.ink = tuple(int(c) for c in rng.integers(0, 90, 3))
+
+    # text on a white patch of the given height, characters jittered in size and baseline
+    def render(self, text, height):
+        if self.use_ttf:
+            return self.render_ttf(text, height)
+        scale = height / 40 * self.size * 1.6
+        pad = int(height * 0.3)
+        width = int(len(text) * height * 0.9) + 2 * pad
+        patch = np.full((height + 2 * pad, width), 255, dtype=np.uint8)
+        x = pad
+        for ch in text:
+            s = scale * self.rng.uniform(0.85, 1.15)
+            (cw, ch_h), _ = cv2.getTextSize(ch, self.font, s, self.thickness)
+            y = pad + int(height * 0.75 + self.rng.normal(0, height * 0.04))
+            cv2.putText(patch, ch, (x, y), self.font, s, 0, self.thickness, cv2.LINE_AA)
+            x += cw + int(self.rng.normal(1, 1.5))
+        return self.shear(patch[:, :max(x + pad, 1)])
+
+    def render_ttf(self, text, height):
+        from PIL import Image, ImageDraw, ImageFont
+        pad = int(height * 0.3)
+        size = max(8, int(height * self.size * 1.1))
+        font = ImageFont.truetype(self.font, size)
+        width = int(len(text) * size * 0.9) + 2 * pad
+        img = Image.new('L', (width, height + 2 * pad), 255)
+        draw = ImageDraw.Draw(img)
+        x = pad
+        for ch in text:
+            s = max(8, int(size * self.rng.uniform(0.85, 1.15)))
+            f = font if s == size else ImageFont.truetype(self.font, s)
+            y = pad + int(height * 0.1 + self.rng.normal(0, height * 0.04))
+            draw.text((x, y), ch, font=f, fill=0)
+            x += int(draw.textlength(ch, font=f)) + int(self.rng.normal(1, 1.5))
+        return self.shear(np.array(img)[:, :max(x + pad, 1)])
+
+    def shear(self, patch):
+        h, w = patch.shape
+        m = np.array([[1, self.slant, -self.slant * h / 2], [0, 1, 0]], dtype=np.float64)
+        return cv2.warpAffine(patch, m, (w, h), borderValue=255)
+
+    def write(self, page, box, text):
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        patch = self.render(text, max(8, int((y2 - y1) * 0.7)))
+        # fit into the cell, leave some room, then offset randomly like a real writer
+        cw, ch = x2 - x1 - 4, y2 - y1 - 2
+        scale = min(1.0, cw / patch.shape[1], ch / patch.shape[0])
+        patch = cv2.resize(patch, (max(1, int(patch.shape[1] * scale)), max(1, int(patch.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+        ph, pw = patch.shape
+        ox = x1 + 2 + int(self.rng.uniform(0, max(0, cw - pw)) * 0.5)
+        oy = y1 + 1 + int(self.rng.uniform(0, max(0, ch - ph)))
+        region = page[oy:oy + ph, ox:ox + pw]
+        alpha = (255 - patch[:region.shape[0], :region.shape[1]]).astype(np.float32)[..., None] / 255
+        region[:] = (region * (1 - alpha) + np.array(self.ink) * alpha).astype(np.uint8)
+
+
+def draw_sheet(rng, plies, layout, rows, ttf_paths=()):
+    """Undistorted page image and its cell boxes, plies[0] is white's first move."""
+    cells, capacity = cell_grid(layout, rows)
+    page = np.full((PAGE_H, PAGE_W, 3), 255, dtype=np.uint8)
+    line = (90, 90, 90)
+
+    # header fields and the printed grid
+    cv2.putText(page, 'CHESS SCORESHEET', (MARGIN, MARGIN + 40), cv2.FONT_HERSHEY_DUPLEX, 1.2, (30, 30, 30), 2)
+    for i, field in enumerate(('Event:', 'White:', 'Black:')):
+        y = MARGIN + 85 + i * 28
+        cv2.putText(page, field, (MARGIN, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (40, 40, 40), 1)
+        cv2.line(page, (MARGIN + 80, y + 2), (PAGE_W // 2, y + 2), line, 1)
+    for (num, kind), (x1, y1, x2, y2) in cells.items():
+        cv2.rectangle(page, (int(x1), int(y1)), (int(x2), int(y2)), line, 1)
+        if kind == 'number':
+            cv2.putText(page, str(num), (int(x1) + 6, int(y2) - int((y2 - y1) * 0.25)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+
+    writer = Handwriting(rng, ttf_paths)
+    for i, san in enumerate(plies[:2 * capacity]):
+        writer.write(page, cells[(1 + i // 2, 'white' if i % 2 == 0 else 'black')], san)
+    return page, cells
+
+
+def distortion(rng, max_skew=4.0, max_perspective=0.04):
+    """Homography of a photo taken slightly rotated and off-axis, plus output size."""
+    angle = rng.uniform(-max_skew, max_skew)
+    rot = np.vstack([cv2.getRotationMatrix2D((PAGE_W / 2, PAGE_H / 2), angle, 1.0), [0, 0, 1]])
+    src = np.float32([[0, 0], [PAGE_W, 0], [PAGE_W, PAGE_H], [0, PAGE_H]])
+    jitter = rng.uniform(-max_perspective, max_perspective, (4, 2)) * [PAGE_W, PAGE_H]
+    persp = cv2.getPerspectiveTransform(src, (src + jitter).astype(np.float32))
+    H = persp @ rot
+    # shift so the whole page stays inside the photo, with a bit of background around it
+    corners = cv2.perspectiveTransform(src.reshape(-1, 1, 2), H).reshape(-1, 2)
+    border = 40
+    shift = np.array([[1, 0, border - corners[:, 0].min()], [0, 1, border - corners[:, 1].min()], [0, 0, 1]])
+    size = (int(corners[:, 0].max() - corners[:, 0].min()) + 2 * border,
+            int(corners[:, 1].max() - corners[:, 1].min()) + 2 * border)
+    return shift @ H, size, angle
+
+
+def photograph(rng, page, H, size):
+    """Warp the page into a photo, then lighting, blur, noise and JPEG artifacts."""
+    background = tuple(int(c) for c in rng.integers(60, 160, 3))
+    photo = cv2.warpPerspective(page, H, size, flags=cv2.INTER_LINEAR, borderValue=background)
+    # uneven lighting, brighter on one side
+    h, w = photo.shape[:2]
+    gx = np.linspace(rng.uniform(0.75, 1.0), rng.uniform(0.9, 1.05), w, dtype=np.float32)
+    gy = np.linspace(rng.uniform(0.85, 1.0), rng.uniform(0.9, 1.05), h, dtype=np.float32)
+    photo = np.clip(photo * (gy[:, None] * gx[None, :])[..., None], 0, 255)
+    if rng.random() < 0.7:
+        k = int(rng.choice([3, 5]))
+        photo = cv2.GaussianBlur(photo, (k, k), rng.uniform(0.4, 1.4))
+    photo = np.clip(photo + rng.normal(0, rng.uniform(2, 8), photo.shape), 0, 255).astype(np.uint8)
+    quality = int(rng.integers(55, 90))
+    _, buf = cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def warp_box(H, box):
+    x1, y1, x2, y2 = box
+    corners = np.float64([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]).reshape(-1, 1, 2)
+    pts = cv2.perspectiveTransform(corners, H).reshape(-1, 2)
+    return [int(round(pts[:, 0].min())), int(round(pts[:, 1].min())),
+            int(round(pts[:, 0].max())), int(round(pts[:, 1].max()))]
+
+
+def write_sample(out_dir, name, rng, plies, layout, rows, ttf_paths=(), max_skew=4.0):
+    """Render plies (from the initial position) as one photo + .pgn + .json."""
+    page, cells = draw_sheet(rng, plies, layout, rows, ttf_paths)
+    H, size, angle = distortion(rng, max_skew=max_skew)
+    photo = photograph(rng, page, H, size)
+    cv2.imwrite(os.path.join(out_dir, name + '.jpg'), photo)
+
+    # the moves written on the sheet
+    game = chess.pgn.Game()
+    game.headers['Event'] = 'Synthetic'
+    board = chess.Board()
+    node = game
+    for san in plies:
+        move = board.parse_san(san)
+        node = node.add_variation(move)
+        board.push(move)
+    with open(os.path.join(out_dir, name + '.pgn'), 'w') as f:
+        f.write(str(game) + '\n')
+
+    moves = [{'number': 1 + i // 2, 'white': plies[i], 'black': plies[i + 1] if i + 1 < len(plies) else None}
+             for i in range(0, len(plies), 2)]
+    texts = {(1 + i // 2, 'white' if i % 2 == 0 else 'black'): san for i, san in enumerate(plies)}
+    truth = {
+        'image': name + '.jpg',
+        'layout': layout,
+        'rows': rows,
+        'size': list(size),
+        'skew_deg': float(angle),
+        'homography': H.tolist(),
+        'moves': moves,
+        'cells': [{'number': num, 'kind': kind, 'text': str(num) if kind == 'number' else texts.get((num, kind), ''),
+                   'box': warp_box(H, box)}
+                  for (num, kind), box in sorted(cells.items())],
+    }
+    with open(os.path.join(out_dir, name + '.json'), 'w') as f:
+        json.dump(truth, f)
+    return truth
+
+
+def write_game(out_dir, name, rng, sans, layout, rows=None, ttf_paths=(), max_skew=4.0):
+    """Render as much of a game as fits on one sheet, returns the ground truth."""
+    rows = sheet_rows(layout, rows)
+    plies = sans[:2 * LAYOUTS[layout][0] * rows]
+    truth = write_sample(out_dir, name, rng, plies, layout, rows, ttf_paths=ttf_paths, max_skew=max_skew)
+    truth['plies_left_out'] = len(sans) - len(plies)
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pgn', help='PGN file with the games to render')
+    parser.add_argument('--random', type=int, default=0, help='also render this many random legal games')
+    parser.add_argument('--plies', type=int, default=90, help='length of the random games in half-moves')
+    parser.add_argument('--layouts', type=int, nargs='+', default=[2, 4, 6], choices=sorted(LAYOUTS))
+    parser.add_argument('--rows', type=int, default=None,
+                        help=f'rows per block (default depends on the layout, at most {MAX_MOVES} moves per sheet)')
+    parser.add_argument('--fonts', nargs='*', default=[], help='TTF handwriting fonts (Hershey script fonts otherwise)')
+    parser.add_argument('--max-skew', type=float, default=4.0, help='largest page rotation in degrees')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    games = read_games(args.pgn) if args.pgn else []
+    games += [random_game(rng, args.plies) for _ in range(args.random)]
+    if not games:
+        parser.error('nothing to render, give --pgn and/or --random')
+    for layout in args.layouts:
+        if args.rows and args.rows > sheet_rows(layout, args.rows):
+            parser.error(f'--rows {args.rows} puts more than {MAX_MOVES} moves on a {layout}-column sheet')
+    os.makedirs(args.out, exist_ok=True)
+
+    count = 0
+    for g, sans in enumerate(games):
+        for layout in args.layouts:
+            name = f'synth_{g:04d}_{layout}col'
+            truth = write_game(args.out, name, rng, sans, layout, args.rows, args.fonts, args.max_skew)
+            count += 1
+            left_out = f", {truth['plies_left_out']} plies left out" if truth['plies_left_out'] else ""
+            print(f"  {truth['image']}: {len(truth['moves'])} moves, {truth['rows']} rows, "
+                  f"skew {truth['skew_deg']:+.1f} deg{left_out}")
+    print(f"wrote {count} scoresheets to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
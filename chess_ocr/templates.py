@@ -0,0 +1,331 @@
+"""
+Scoresheet template registry
+Most uploads come from a few printed scoresheet designs. A template stores the
+number anchors and white/black move cells of one design, learned from a sheet
+that processed well. When the YOLO move boxes of a new sheet match a template,
+the number anchors and move cells come from the template (fitted with a
+homography) and steps 3-5 are skipped.
+
+Template coordinates are in units of the median move cell height, relative to
+the center of the white cell of move 1, so they do not depend on photo scale.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from box_table import box_dict, make_numbers
+
+# lane offsets (in cell heights) must agree this well for a template to be tried
+LANE_TOLERANCE = 0.6
+# a detected box within this many cell heights of a template cell is an inlier
+INLIER_DIST = 0.35
+# a match needs this many inliers, and this fraction of the detected move boxes
+MIN_INLIERS = 12
+MIN_INLIER_RATIO = 0.7
+# the top boxes of the first lane are paired with this many top template cells
+# of the first lane as starting alignments (row 1 may be missed, headers detected)
+ROW_HYPOTHESES = 4
+# new templates and hit counts are written to disk at most this often (seconds),
+# and once more at exit (flush)
+SAVE_INTERVAL = 60.0
+# every request tries each template, past this many the one with the fewest hits is dropped
+MAX_TEMPLATES = 64
+
+
+def box_arrays(boxes):
+    """(centers (N, 2), widths (N,), heights (N,)) of a box table."""
+    centers = np.stack([boxes['cx'], boxes['cy']], axis=1).astype(np.float64)
+    return centers, boxes['w'].astype(np.float64), boxes['h'].astype(np.float64)
+
+
+def cluster_lanes(cx, widths):
+    """Group box indices into vertical lanes by x gaps, lanes with fewer than 3 boxes are dropped."""
+    order = np.argsort(cx)
+    gaps = np.diff(cx[order])
+    splits = np.where(gaps > np.median(widths) * 0.7)[0] + 1
+    return [g for g in np.split(order, splits) if len(g) >= 3]
+
+
+def make_box(x1, y1, x2, y2, source):
+    x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+    return {
+        'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
+        'cx': (x1 + x2) // 2, 'cy': (y1 + y2) // 2,
+        'w': x2 - x1, 'h': y2 - y1,
+        'source': source,
+    }
+
+
+class ScoresheetTemplate:
+    def __init__(self, numbers, anchors, white, black, lanes, hits=0):
+        self.numbers = np.asarray(numbers, dtype=np.int64)     # (N,) move numbers
+        self.anchors = np.asarray(anchors, dtype=np.float64)   # (N, 2) number cell centers
+        self.white = np.asarray(white, dtype=np.float64)       # (N, 4) x1, y1, x2, y2
+        self.black = np.asarray(black, dtype=np.float64)       # (N, 4)
+        self.lanes = np.asarray(lanes, dtype=np.float64)       # (L,) lane x centers
+        self.hits = hits
+
+    # centers of all move cells, white cells first then black cells
+    def cell_centers(self):
+        boxes = np.concatenate([self.white, self.black])
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+
+class TemplateRegistry:
+    """Scoresheet templates kept in memory and in a compact .npz index on disk."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.templates = []
+        # guards templates and hit counts, held only for bookkeeping, never during a match
+        self.lock = threading.Lock()
+        # serializes index writes, taken without self.lock so requests never wait on disk
+        self.save_lock = threading.Lock()
+        self.version = 0
+        self.saved_version = 0
+        # bumped when a template is added or dropped (version also counts hits)
+        self.generation = 0
+        self.last_save = time.monotonic()
+        if path and os.path.exists(path):
+            self.load()
+        if path:
+            atexit.register(self.flush)
+
+    def fingerprint(self, move_boxes):
+        """Lane layout of a sheet: (lane x centers, median cell height), or None."""
+        if len(move_boxes) < MIN_INLIERS:
+            return None
+        centers, widths, heights = box_arrays(move_boxes)
+        lanes = cluster_lanes(centers[:, 0], widths)
+        if len(lanes) < 2:
+            return None
+        lane_x = np.sort([np.median(centers[g, 0]) for g in lanes])
+        return lane_x, float(np.median(heights)), lanes
+
+    def match(self, move_boxes, count_hit=True):
+        """Fit the best matching template to the detected move boxes (a box table).
+
+        Returns:
+            (numbers, rows) in the same format as steps 4 and 5, or None if
+            no template matches confidently
+        """
+        with self.lock:
+            templates = list(self.templates)
+        if not templates:
+            return None
+        fp = self.fingerprint(move_boxes)
+        if fp is None:
+            return None
+        lane_x, cell_h, lanes = fp
+        offsets = (lane_x - lane_x[0]) / cell_h
+        centers, _, _ = box_arrays(move_boxes)
+
+        # top boxes of the leftmost lane, one of them lines up with a top template cell
+        first_lane = min(lanes, key=lambda g: np.median(centers[g, 0]))
+        top = first_lane[np.argsort(centers[first_lane, 1])][:ROW_HYPOTHESES]
+
+        best = None
+        for tpl in templates:
+            if len(tpl.lanes) != len(offsets):
+                continue
+            if np.max(np.abs((tpl.lanes - tpl.lanes[0]) - offsets)) > LANE_TOLERANCE:
+                continue
+            cells = tpl.cell_centers()
+            lane_cells = np.where(np.abs(cells[:, 0] - tpl.lanes[0]) < LANE_TOLERANCE)[0]
+            top_cells = lane_cells[np.argsort(cells[lane_cells, 1])][:ROW_HYPOTHESES]
+            for start in top:
+                for cell in top_cells:
+                    fit = self.fit(tpl, centers, centers[start], cells[cell], cell_h)
+                    if fit is not None and (best is None or fit[1] > best[2]):
+                        best = (tpl, fit[0], fit[1], fit[2])
+
+        if best is None:
+            return None
+        tpl, H, inliers, matches = best
+        if inliers < MIN_INLIERS or inliers < MIN_INLIER_RATIO * len(move_boxes):
+            return None
+        if count_hit:
+            with self.lock:
+                tpl.hits += 1
+                self.version += 1
+            self.maybe_save()
+        return self.apply(tpl, H, matches, move_boxes)
+
+    def fit(self, tpl, centers, origin, tpl_origin, cell_h):
+        """Homography from template to page, starting from template point tpl_origin at page point origin.
+
+        Returns (H, inlier count, {template cell index: detected box index}) or None.
+        """
+        cells = tpl.cell_centers()
+        initial = np.array([[cell_h, 0, origin[0] - cell_h * tpl_origin[0]],
+                            [0, cell_h, origin[1] - cell_h * tpl_origin[1]],
+                            [0, 0, 1]])
+        matches = self.match_cells(cells, centers, initial, cell_h)
+        if len(matches) < 4:
+            return None
+
+        src = cells[list(matches.keys())].astype(np.float32)
+        dst = centers[list(matches.values())].astype(np.float32)
+        H, _ = cv2.findHomography(src, dst, cv2.RANSAC, INLIER_DIST * cell_h)
+        if H is None:
+            return None
+        matches = self.match_cells(cells, centers, H, cell_h)
+        return H, len(matches), matches
+
+    def match_cells(self, cells, centers, H, cell_h):
+        """One-to-one nearest matches between projected template cells and detected centers."""
+        projected = cv2.perspectiveTransform(cells.reshape(-1, 1, 2).astype(np.float64), H).reshape(-1, 2)
+        dist = np.linalg.norm(centers[:, None, :] - projected[None, :, :], axis=2)
+        nearest = dist.argmin(axis=1)
+        near_dist = dist[np.arange(len(centers)), nearest]
+
+        matches = {}
+        for det in np.argsort(near_dist):
+            if near_dist[det] > INLIER_DIST * cell_h:
+                break
+            cell = int(nearest[det])
+            if cell not in matches:
+                matches[cell] = int(det)
+        return matches
+
+    def apply(self, tpl, H, matches, move_boxes):
+        """Number anchors and white/black cells of the template, mapped onto the page."""
+        anchors = cv2.perspectiveTransform(tpl.anchors.reshape(-1, 1, 2), H).reshape(-1, 2)
+        n = len(tpl.numbers)
+
+        def mapped_box(box):
+            corners = np.array([[box[0], box[1]], [box[2], box[1]], [box[2], box[3]], [box[0], box[3]]])
+            pts = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), H).reshape(-1, 2)
+            return make_box(pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max(), 'template')
+
+        numbers = make_numbers([(num, x, y, 'template') for num, (x, y) in zip(tpl.numbers, anchors)])
+        rows = {}
+        for i, num in enumerate(tpl.numbers):
+            row = {'y': float(anchors[i, 1])}
+            for ctype, offset, boxes in (('white', 0, tpl.white), ('black', n, tpl.black)):
+                det = matches.get(i + offset)
+                row[f'{ctype}_box'] = box_dict(move_boxes[det]) if det is not None else mapped_box(boxes[i])
+            rows[int(num)] = row
+        return numbers, rows
+
+    def learn(self, numbers, rows, move_boxes):
+        """Add a template from a sheet that processed well, unless a known template already matches.
+
+        Returns True if a template was added.
+        """
+        fp = self.fingerprint(move_boxes)
+        if fp is None or 1 not in rows or not rows[1].get('white_box'):
+            return False
+        lane_x, cell_h, _ = fp
+
+        origin = np.array([rows[1]['white_box']['cx'], rows[1]['white_box']['cy']], dtype=np.float64)
+        by_number = {int(n['number']): (float(n['x']), float(n['y'])) for n in numbers}
+        keep = [num for num in sorted(rows)
+                if num in by_number and rows[num].get('white_box') and rows[num].get('black_box')]
+        if len(keep) < MIN_INLIERS:
+            return False
+
+        def norm_box(b):
+            return [(b['x1'] - origin[0]) / cell_h, (b['y1'] - origin[1]) / cell_h,
+                    (b['x2'] - origin[0]) / cell_h, (b['y2'] - origin[1]) / cell_h]
+
+        tpl = ScoresheetTemplate(
+            numbers=keep,
+            anchors=[[(by_number[n][0] - origin[0]) / cell_h, (by_number[n][1] - origin[1]) / cell_h] for n in keep],
+            white=[norm_box(rows[n]['white_box']) for n in keep],
+            black=[norm_box(rows[n]['black_box']) for n in keep],
+            lanes=(lane_x - origin[0]) / cell_h,
+        )
+
+        # the duplicate check runs without the lock, if templates were added or dropped
+        # meanwhile it is repeated against the new set before this one is added
+        while True:
+            with self.lock:
+                generation = self.generation
+            if self.match(move_boxes, count_hit=False) is not None:
+                return False
+            with self.lock:
+                if self.generation != generation:
+                    continue
+                self.templates.append(tpl)
+                evicted = self.evict()
+                self.generation += 1
+                self.version += 1
+                index = len(self.templates) - 1
+                break
+        self.maybe_save()
+        print(f"  [Templates] Learned template {index} ({len(keep)} rows, {len(lane_x)} lanes)")
+        if evicted is not None:
+            print(f"  [Templates] Dropped a template with {evicted.hits} hits (limit {MAX_TEMPLATES})")
+        return True
+
+    def evict(self):
+        # called under the lock after an append, the new template is never the one dropped
+        if len(self.templates) <= MAX_TEMPLATES:
+            return None
+        old = self.templates[:-1]
+        victim = min(range(len(old)), key=lambda i: old[i].hits)
+        return self.templates.pop(victim)
+
+    def maybe_save(self):
+        if self.path and time.monotonic() - self.last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def flush(self):
+        """Write unsaved templates and hit counts now."""
+        if self.path:
+            self.save()
+
+    def save(self):
+        # snapshot under the lock, write outside it
+        with self.lock:
+            if self.version == self.saved_version:
+                return
+            version = self.version
+            data = self.snapshot()
+            self.last_save = time.monotonic()
+        with self.save_lock:
+            # a newer snapshot was already written by another thread
+            if version <= self.saved_version:
+                return
+            # write then rename so a crash never leaves a half-written index
+            tmp_path = self.path + '.tmp.npz'
+            np.savez_compressed(tmp_path, **data)
+            os.replace(tmp_path, self.path)
+            self.saved_version = version
+
+    def snapshot(self):
+        tpls = self.templates
+        return {
+            'counts': np.array([len(t.numbers) for t in tpls], dtype=np.int32),
+            'lane_counts': np.array([len(t.lanes) for t in tpls], dtype=np.int32),
+            'hits': np.array([t.hits for t in tpls], dtype=np.int64),
+            'numbers': np.concatenate([t.numbers for t in tpls]).astype(np.int16) if tpls else np.zeros(0, np.int16),
+            'anchors': np.concatenate([t.anchors for t in tpls]).astype(np.float32) if tpls else np.zeros((0, 2), np.float32),
+            'white': np.concatenate([t.white for t in tpls]).astype(np.float32) if tpls else np.zeros((0, 4), np.float32),
+            'black': np.concatenate([t.black for t in tpls]).astype(np.float32) if tpls else np.zeros((0, 4), np.float32),
+            'lanes': np.concatenate([t.lanes for t in tpls]).astype(np.float32) if tpls else np.zeros(0, np.float32),
+        }
+
+    def load(self):
+        data = np.load(self.path)
+        ends = np.cumsum(data['counts'])
+        lane_ends = np.cumsum(data['lane_counts'])
+        self.templates = []
+        for i in range(len(ends)):
+            s, e = (ends[i - 1] if i else 0), ends[i]
+            ls, le = (lane_ends[i - 1] if i else 0), lane_ends[i]
+            self.templates.append(ScoresheetTemplate(
+                data['numbers'][s:e], data['anchors'][s:e], data['white'][s:e], data['black'][s:e],
+                data['lanes'][ls:le], hits=int(data['hits'][i]),
+            ))
+        if len(self.templates) > MAX_TEMPLATES:
+            # an index from before the limit (or a lower one), keep the most used templates
+            keep = sorted(sorted(range(len(self.templates)), key=lambda i: -self.templates[i].hits)[:MAX_TEMPLATES])
+            self.templates = [self.templates[i] for i in keep]
+        print(f"  Loaded {len(self.templates)} scoresheet templates from {self.path}")